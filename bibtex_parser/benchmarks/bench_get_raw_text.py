@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Measure the per-call latency of `get_raw_text`.
+
+usage:
+    python3 bench_get_raw_text.py [--baseline path/to/old/bibtex.py]
+
+e.g. compare with the last commit:
+    git show HEAD~1:bibtex_parser/bibtex.py > /tmp/bibtex_old.py
+    python3 bench_get_raw_text.py --baseline /tmp/bibtex_old.py
+(the samples whose output differs from the baseline are printed as well)
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import timeit
+import unicodedata
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+samples = [
+    # author names
+    r"Emmanuel Vincent",
+    r"R{\'e}mi Gribonval",
+    r"C{\'e}dric F{\'e}votte",
+    r"J{\"o}rg M{\"u}ller",
+    r"Jos{\'e} Garc{\'\i}a",
+    r"S{\o}ren {\O}stergaard",
+    r"Ho\`{a}ng Vi\d{\^e}t",
+    r"Ph\d{\^o} \'{\^a}",
+    # titles
+    r"Performance measurement in blind audio source separation",
+    r"Deep recurrent de-noising auto-encoder: {A} study on {ICASSP} {CHiME} data",
+    r"{ESPnet-SE}: End-to-end speech enhancement and separation toolkit",
+    r"Ein {\"U}berblick {\"u}ber die Spracherkennung \& {\AA}ngstr{\"o}m",
+    # venues
+    r"#icassp",
+    r"Computer Speech \& Language",
+    r"Proc. Annual Meeting of the Association for Computational Linguistics (ACL)",
+]
+
+
+def load_module(path, name):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench(module, number):
+    for not_change_letter_case in (True, False):
+        t = timeit.timeit(
+            lambda: [
+                module.get_raw_text(s, not_change_letter_case=not_change_letter_case)
+                for s in samples
+            ],
+            number=number,
+        )
+        print(
+            "  not_change_letter_case={!s:5}  {:8.2f} us/call".format(
+                not_change_letter_case, t / number / len(samples) * 1e6
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--baseline", type=str, default=None, help="another bibtex.py to compare with"
+    )
+    parser.add_argument("--number", type=int, default=2000, help="number of runs")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline is not None:
+        baseline = load_module(args.baseline, "bibtex_baseline")
+        print("baseline ({}):".format(args.baseline))
+        bench(baseline, args.number)
+    import bibtex
+
+    print("current ({}):".format(bibtex.__file__))
+    bench(bibtex, args.number)
+    if baseline is not None:
+        for s in samples:
+            for not_change_letter_case in (True, False):
+                old, new = (
+                    unicodedata.normalize(
+                        "NFC", m.get_raw_text(s, not_change_letter_case=not_change_letter_case)
+                    )
+                    for m in (baseline, bibtex)
+                )
+                if old != new:
+                    print("differs: {!r} {!r} -> {!r}".format(s, old, new))
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Check the start-up time of the command line tools against a budget.
+
+Each case runs in a fresh interpreter and is repeated several times; the best
+run is reported, minus the start-up time of a bare interpreter
+(`python3 -c pass`) so that the budgets depend less on the machine:
+    import_bibtex             `import bibtex`
+    import_bibtex_database    `import bibtex_database`
+    cli_list                  `bibtex_database.py --list` on a small database
+
+usage:
+    python3 check_startup.py [--repeat 10] [--entries 50]
+                             [--budget-import 0.06] [--budget-list 0.12]
+(the exit code is 1 if any case is over its budget)
+"""
+import argparse
+import compileall
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, package_dir)
+
+from corpus import write_corpus  # noqa: E402
+
+
+def best_time(cmd, repeat, cwd=None):
+    """Return the shortest wall time of running `cmd` over `repeat` runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            cmd, cwd=cwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(workdir, repeat, entries):
+    """Measure the start-up time of each case.
+
+    Returns:
+        results (Dict[str, float]): case -> seconds on top of a bare interpreter
+    """
+    # measure with the bytecode cache, like an installed copy
+    compileall.compile_dir(package_dir, quiet=1)
+    bibfile = os.path.join(workdir, "corpus.bib")
+    write_corpus(bibfile, entries)
+    script = os.path.join(package_dir, "bibtex_database.py")
+    subprocess.run(
+        [sys.executable, script, "--add-fromfile", bibfile],
+        cwd=workdir,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+    baseline = best_time([sys.executable, "-c", "pass"], repeat)
+    imports = "import sys; sys.path.insert(0, {!r}); import ".format(package_dir)
+    cases = {
+        "import_bibtex": [sys.executable, "-c", imports + "bibtex"],
+        "import_bibtex_database": [sys.executable, "-c", imports + "bibtex_database"],
+        "cli_list": [sys.executable, script, "--list"],
+    }
+    results = {}
+    for name, cmd in cases.items():
+        results[name] = best_time(cmd, repeat, cwd=workdir) - baseline
+        print("{:>24} {:8.1f} ms".format(name, results[name] * 1000), file=sys.stderr)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=10, help="number of runs per case")
+    parser.add_argument(
+        "--entries", type=int, default=50, help="number of entries for cli_list"
+    )
+    parser.add_argument(
+        "--budget-import",
+        type=float,
+        default=0.06,
+        help="seconds allowed for each import case",
+    )
+    parser.add_argument(
+        "--budget-list", type=float, default=0.12, help="seconds allowed for cli_list"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run(workdir, args.repeat, args.entries)
+    budgets = {
+        "import_bibtex": args.budget_import,
+        "import_bibtex_database": args.budget_import,
+        "cli_list": args.budget_list,
+    }
+    over = [name for name in results if results[name] > budgets[name]]
+    for name in over:
+        print(
+            "Over budget: {} {:.1f} ms > {:.1f} ms".format(
+                name, results[name] * 1000, budgets[name] * 1000
+            ),
+            file=sys.stderr,
+        )
+    if over:
+        sys.exit(1)
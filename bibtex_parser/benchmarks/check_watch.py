@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Check that `BibTeXDatabase.watch` tracks a file like a full sync.
+
+Random sequences of edits (deleting, duplicating, moving, modifying and
+inserting entries) are applied to a synthetic .bib file. After each edit, the
+changes found by rescanning only the modified region are applied to a
+database, and the tracked entries and offsets (`<table>_sources`) and the
+records are compared with those of a fresh `sync_fromfile` of the same file.
+
+usage:
+    python3 check_watch.py [--sequences 150] [--edits 10] [--entries 30] [--seed 0]
+(the exit code is 1 if any sequence differs from a full sync)
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+
+package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, package_dir)
+
+from corpus import generate_corpus, generate_entry  # noqa: E402
+from bibtex_database import BibTeXDatabase, _WatchedFile  # noqa: E402
+
+
+def edit(rnd, blocks, index):
+    """Apply a random edit to the entries of a file.
+
+    Args:
+        rnd (random.Random): random number generator
+        blocks (List[str]): blocks of the file, modified in place; the first
+            ones are the header and the @string definitions, which are kept
+        index (int): index of a new entry, used to make its name unique
+    """
+    header = 1 + sum(block.startswith("@string") for block in blocks)
+    if len(blocks) == header:
+        blocks.append(generate_entry(rnd, index))
+        return
+    i = rnd.randrange(header, len(blocks))
+    j = rnd.randrange(header, len(blocks) + 1)
+    kind = rnd.random()
+    if kind < 0.2:
+        del blocks[i]
+    elif kind < 0.45:
+        # duplicates share the offsets of their first occurrence
+        blocks.insert(j, blocks[i])
+    elif kind < 0.6:
+        blocks.insert(j, blocks.pop(i))
+    elif kind < 0.8:
+        if rnd.random() < 0.5:
+            # the name of a record is made from its title, so that a modified
+            # copy of a duplicated entry does not conflict with the others
+            blocks[i] = re.sub(
+                r"(\btitle\s*=\s*[{\"])", r"\g<1>Edited{} ".format(index), blocks[i], count=1
+            )
+        elif rnd.random() < 0.5:
+            blocks[i] = blocks[i].replace(",\n", ",\n\n", 1)
+        else:
+            blocks[i] += " "
+    elif kind < 0.9:
+        blocks.insert(j, generate_entry(rnd, index))
+    elif kind < 0.95:
+        blocks.insert(j, "@comment{{edit {}}}".format(index) if rnd.random() < 0.5 else "% edit")
+    else:
+        # changes the hashes of all the entries
+        blocks.insert(header, '@string{{edit{} = "Edit"}}'.format(index))
+
+
+def snapshot(db, path):
+    """Return the tracked entries of `path` and the records of `db`.
+
+    The names of the records are left out, as the suffixes of renamed records
+    depend on the order in which they were inserted, and so are the copies
+    of a record (a copy of a renamed entry is inserted again by a full sync).
+    """
+    cursor = db._BibTeXDatabase__cursor
+    cursor.execute(
+        f"SELECT hash, start, end FROM {db.name}_sources WHERE source = ?",
+        (os.path.abspath(path),),
+    )
+    sources = sorted(cursor.fetchall())
+    cursor.execute(f"SELECT bibstring FROM {db.name}")
+    records = sorted({re.sub(r"^@\w+\{[^,]*,", "", bibstring) for bibstring, in cursor.fetchall()})
+    return sources, records
+
+
+def check_sequence(workdir, seed, num_edits, num_entries, style="IEEEtran"):
+    """Apply a sequence of edits, and compare the database after each of them.
+
+    Returns:
+        errors (List[str]): descriptions of the differences
+    """
+    rnd = random.Random(seed)
+    path = os.path.join(workdir, "watched.bib")
+    blocks = generate_corpus(num_entries, seed=seed).rstrip("\n").split("\n\n")
+    with open(path, "w") as f:
+        f.write("\n\n".join(blocks) + "\n")
+    db = BibTeXDatabase(os.path.join(workdir, f"watched-{seed}.db"))
+    watched = _WatchedFile(path, style)
+    watched.poll()
+    db._BibTeXDatabase__apply_sync(path, watched.entries(), True, style, 500)
+    errors = []
+    for step in range(num_edits):
+        # several edits may be saved between two polls
+        for k in range(rnd.choice((1, 1, 2, 3))):
+            edit(rnd, blocks, num_entries + 3 * step + k)
+        with open(path, "w") as f:
+            f.write("\n\n".join(blocks) + "\n")
+        # the file may be rewritten within the resolution of its mtime
+        watched.signature = None
+        if not watched.poll():
+            continue
+        if watched.diff is None:
+            db._BibTeXDatabase__apply_sync(path, watched.entries(), True, style, 500)
+        else:
+            db._BibTeXDatabase__apply_diff(path, watched.diff, True, style, 500)
+        fresh = BibTeXDatabase(os.path.join(workdir, f"fresh-{seed}-{step}.db"))
+        fresh.sync_fromfile(path, delete=True, style=style)
+        expected, got = snapshot(fresh, path), snapshot(db, path)
+        fresh.close()
+        if got[0] != expected[0]:
+            errors.append(f"seed {seed}, edit {step}: offsets differ from a full sync")
+        if got[1] != expected[1]:
+            errors.append(f"seed {seed}, edit {step}: records differ from a full sync")
+        if got != expected:
+            break
+    db.close()
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sequences", type=int, default=150, help="number of edit sequences")
+    parser.add_argument("--edits", type=int, default=10, help="number of edits per sequence")
+    parser.add_argument("--entries", type=int, default=30, help="number of entries in the file")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first sequence")
+    args = parser.parse_args()
+
+    errors = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for seed in range(args.seed, args.seed + args.sequences):
+            errors.extend(check_sequence(workdir, seed, args.edits, args.entries))
+    for error in errors:
+        print(error, file=sys.stderr)
+    print(
+        "{} of {} sequences differ from a full sync".format(
+            len({e.split(",")[0] for e in errors}), args.sequences
+        ),
+        file=sys.stderr,
+    )
+    if errors:
+        sys.exit(1)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""Deterministic generator of synthetic .bib files for benchmarking.
+
+The generated entries cover the formats accepted by the parser: braced and
+quoted values, bare numbers and months, macros from `predefined_string` and
+@string definitions, "#" concatenation, LaTeX accents in names and titles,
+comments and long multi-line abstracts.
+
+usage:
+    python3 corpus.py 10000 -o corpus.bib [--seed 0]
+"""
+import argparse
+import random
+import re
+import sys
+
+
+first_names = [
+    "Emmanuel", "R{\\'e}mi", "C{\\'e}dric", "J{\\\"o}rg", "Jos{\\'e}", "S{\\o}ren",
+    "Fran{\\c{c}}ois", "Bj{\\\"o}rn", "Wangyou", "Chenda", "Shinji", "Yanmin",
+    "Ond{\\v{r}}ej", "Zolt{\\'a}n", "Anna", "Michael", "Maria", "John", "Jane", "Li",
+    "A.", "B. C.", "D.", "Hiroshi", "Katerina",
+]
+last_names = [
+    "Vincent", "Gribonval", "F{\\'e}votte", "M{\\\"u}ller", "Garc{\\'\\i}a",
+    "{\\O}stergaard", "Schuller", "Watanabe", "Zhang", "Li", "Qian", "Chen",
+    "Smith", "Doe", "Ko{\\v{s}}ek", "N{\\'e}meth", "Le Roux", "{van der Berg}",
+    "{De Mori}", "Yoshioka", "Hershey", "Erdogan", "Kinoshita", "Delcroix",
+]
+title_words = [
+    "deep", "neural", "speech", "separation", "enhancement", "recognition",
+    "robust", "end-to-end", "multi-channel", "self-supervised", "learning",
+    "acoustic", "model", "language", "network", "attention", "transformer",
+    "beamforming", "dereverberation", "diarization", "source", "audio",
+    "representation", "training", "evaluation", "benchmark", "toolkit", "noisy",
+    "far-field", "streaming", "adaptation", "unsupervised", "signal", "sparse",
+]
+title_specials = [
+    "{ICASSP}", "{CHiME}", "{LSTM}", "{B}ayesian", "{G}aussian", "{ESPnet}",
+    "\\\"{U}ber", "{\\AA}ngstr{\\\"o}m", "50\\%", "\\& more", "{TF-GridNet}",
+    "{\\em et al.}",
+]
+macro_venues = [
+    "icassp", "interspeech", "asru", "slt", "ieee-taslp", "ieee-acm-taslp",
+    "csl", "iclr", "icml", "acl", "naacl", "emnlp", "nips",
+]
+# @string definitions written at the beginning of each corpus
+string_definitions = [
+    ("jasa", "J. Acoust. Soc. Am."),
+    ("spl", "IEEE Signal Process. Lett."),
+    ("eusipco", "Proc. European Signal Processing Conference (EUSIPCO)"),
+]
+journals = [
+    "IEEE Trans. Signal Process.", "Computer Speech \\& Language",
+    "Journal of {M}achine {L}earning {R}esearch", "Speech Communication",
+    "Neural Computation", "Proceedings of the {IEEE}",
+]
+conferences = [
+    "Proc. IEEE Workshop on Applications of Signal Processing to Audio and Acoustics (WASPAA)",
+    "Proc. International Workshop on Acoustic Signal Enhancement (IWAENC)",
+    "Advances in Neural Information Processing Systems",
+    "Proc. Annual Meeting of the Association for Computational Linguistics",
+]
+publishers = ["Springer", "Addison-Wesley", "MIT Press", "Cambridge University Press"]
+months = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+
+
+def _value(rnd, text):
+    # braced or quoted value (quoted values cannot contain bare double quotes)
+    if '"' not in text and rnd.random() < 0.3:
+        return '"{}"'.format(text)
+    return "{{{}}}".format(text)
+
+
+def _number(rnd, number):
+    # bare, braced or quoted number
+    r = rnd.random()
+    if r < 0.4:
+        return str(number)
+    elif r < 0.8:
+        return "{{{}}}".format(number)
+    return '"{}"'.format(number)
+
+
+def _title(rnd):
+    words = rnd.sample(title_words, rnd.randint(4, 12))
+    for _ in range(rnd.randint(0, 2)):
+        words.insert(rnd.randrange(1, len(words) + 1), rnd.choice(title_specials))
+    words[0] = words[0][0].upper() + words[0][1:]
+    if rnd.random() < 0.3:
+        words[len(words) // 2] += ":"
+    return " ".join(words)
+
+
+def _authors(rnd):
+    names = []
+    for _ in range(rnd.randint(1, 8)):
+        first = rnd.choice(first_names)
+        last = rnd.choice(last_names)
+        if rnd.random() < 0.5:
+            names.append("{}, {}".format(last, first))
+        else:
+            names.append("{} {}".format(first, last))
+    if rnd.random() < 0.05:
+        names.append("others")
+    return " and ".join(names)
+
+
+def _abstract(rnd):
+    lines = []
+    for _ in range(rnd.randint(3, 10)):
+        line = " ".join(rnd.choice(title_words) for _ in range(rnd.randint(8, 16)))
+        lines.append(line[0].upper() + line[1:] + ".")
+    return "\n    ".join(lines)
+
+
+def generate_entry(rnd, index):
+    """Generate one synthetic entry.
+
+    Args:
+        rnd (random.Random): random number generator
+        index (int): index of the entry, used to make its name unique
+    Returns:
+        bibstring (str): bib string of the entry
+    """
+    year = rnd.randint(1990, 2024)
+    # entry name: ASCII letters of a last name, the year and the index
+    last = re.sub(r"\\.|[^A-Za-z]", "", rnd.choice(last_names))
+    kind = rnd.random()
+    name = "{}{}-{}".format(last, year, index)
+    fields = [
+        ("title", _value(rnd, _title(rnd))),
+        ("author", _value(rnd, _authors(rnd))),
+    ]
+    if kind < 0.4:
+        pub_type = "inproceedings"
+        r = rnd.random()
+        if r < 0.5:
+            fields.append(("booktitle", rnd.choice(macro_venues)))
+        elif r < 0.6:
+            fields.append(("booktitle", '"Proc. " # {}'.format(rnd.choice(macro_venues))))
+        elif r < 0.7:
+            fields.append(("booktitle", "eusipco"))
+        else:
+            fields.append(("booktitle", _value(rnd, rnd.choice(conferences))))
+        start = rnd.randint(1, 5000)
+        fields.append(("pages", _value(rnd, "{}--{}".format(start, start + rnd.randint(1, 12)))))
+    elif kind < 0.75:
+        pub_type = "article"
+        r = rnd.random()
+        if r < 0.3:
+            fields.append(("journal", rnd.choice(("jasa", "spl", "ieee-taslp", "csl"))))
+        else:
+            fields.append(("journal", _value(rnd, rnd.choice(journals))))
+        fields.append(("volume", _number(rnd, rnd.randint(1, 60))))
+        fields.append(("number", _number(rnd, rnd.randint(1, 12))))
+        start = rnd.randint(1, 5000)
+        fields.append(("pages", _value(rnd, "{}-{}".format(start, start + rnd.randint(1, 30)))))
+    elif kind < 0.85:
+        pub_type = "misc"
+        fields.append(("archivePrefix", _value(rnd, "arXiv")))
+        fields.append(("eprint", _value(rnd, "{}{:02d}.{:05d}".format(year % 100, rnd.randint(1, 12), index % 100000))))
+        fields.append(("primaryClass", _value(rnd, "eess.AS")))
+    elif kind < 0.93:
+        pub_type = "book"
+        fields.append(("publisher", _value(rnd, rnd.choice(publishers))))
+        fields.append(("edition", _number(rnd, rnd.randint(1, 5))))
+        fields.append(("address", _value(rnd, "New York, NY, USA")))
+    else:
+        pub_type = "techreport"
+        fields.append(("institution", _value(rnd, "MIT \\& ACME Lab.")))
+        fields.append(("note", _value(rnd, "Technical report TR-{}".format(rnd.randint(1, 999)))))
+    fields.append(("year", _number(rnd, year)))
+    if rnd.random() < 0.3:
+        fields.append(("month", rnd.choice(months)))
+    if rnd.random() < 0.2:
+        fields.append(("doi", _value(rnd, "10.{}/{}.{}".format(rnd.randint(1000, 9999), year, index))))
+    if rnd.random() < 0.15:
+        fields.append(("abstract", "{{{}}}".format(_abstract(rnd))))
+    rnd.shuffle(fields)
+
+    lines = ["@{}{{{},".format(pub_type if rnd.random() < 0.9 else pub_type.upper(), name)]
+    for k, v in fields:
+        sep = rnd.choice(("=", " = ", "=  "))
+        lines.append("  {}{}{},".format(k, sep, v))
+        if rnd.random() < 0.02:
+            lines.append("  % a comment inside the entry")
+    if rnd.random() < 0.5:
+        # no trailing comma after the last field
+        lines[-1] = lines[-1][:-1]
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def generate_corpus(num_entries, seed=0):
+    """Generate the content of a synthetic .bib file.
+
+    The same arguments always produce the same content.
+
+    Args:
+        num_entries (int): number of entries
+        seed (int): random seed
+    Returns:
+        bibtext (str): content of the .bib file
+    """
+    rnd = random.Random(seed)
+    blocks = ["% synthetic corpus: {} entries, seed {}".format(num_entries, seed)]
+    for name, value in string_definitions:
+        blocks.append('@string{{{} = "{}"}}'.format(name, value))
+    for i in range(num_entries):
+        blocks.append(generate_entry(rnd, i))
+    return "\n\n".join(blocks) + "\n"
+
+
+def write_corpus(path, num_entries, seed=0):
+    """Write a synthetic .bib file (see `generate_corpus`)."""
+    with open(path, "w") as f:
+        f.write(generate_corpus(num_entries, seed=seed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("num_entries", type=int, help="number of entries")
+    parser.add_argument("-o", "--output", type=str, default=None, help="output .bib file")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+
+    if args.output is None:
+        sys.stdout.write(generate_corpus(args.num_entries, seed=args.seed))
+    else:
+        write_corpus(args.output, args.num_entries, seed=args.seed)
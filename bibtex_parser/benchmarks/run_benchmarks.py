@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""Measure the throughput of the parser, the renderer and the database.
+
+Each benchmark runs on a synthetic corpus generated by `corpus.py` and is
+repeated several times; the best run is reported. Caches of `get_raw_text`
+and `raw_string_to_bib_style` are cleared before every run.
+
+usage:
+    python3 run_benchmarks.py [--sizes 1000 10000 100000] [--output results.json]
+                              [--compare baseline.json] [--tolerance 0.2]
+
+e.g. catch throughput regressions against the results of the last release:
+    python3 run_benchmarks.py --output new.json --compare old.json
+(the exit code is 1 if any benchmark is slower than the baseline by more than
+the tolerance)
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bibtex  # noqa: E402
+from bibtex import BibTeXEntry, get_raw_text, iter_entries, render_many  # noqa: E402
+from bibtex_database import BibTeXDatabase  # noqa: E402
+from corpus import last_names, title_words, write_corpus  # noqa: E402
+
+
+styles = ("IEEEtran", "IEEEbib", "APA", "ACM")
+benchmark_names = (
+    "parse",
+    "to_plaintext",
+    "render_many",
+    "plaintext_to_bibtex",
+    "get_raw_text",
+    "add_fromfile",
+    "search_bibtex",
+)
+
+
+def timed(func, repeat, setup=None):
+    """Return the shortest wall time of `func()` over `repeat` runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        bibtex.clear_cache()
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(size, workdir, repeat, only=benchmark_names):
+    """Run the benchmarks on a corpus of `size` entries.
+
+    Returns:
+        results (List[dict]): one record for each benchmark
+    """
+    bibfile = os.path.join(workdir, "corpus_{}.bib".format(size))
+    write_corpus(bibfile, size)
+    # parse once to define the @string macros and to prepare the inputs
+    bibstrings = [
+        span.string
+        for span in iter_entries(bibfile, raw=True)
+        if span.type not in ("string", "preamble", "comment")
+    ]
+    entries = list(iter_entries(bibfile))
+    plaintexts = [bib.to_plaintext() for bib in entries]
+    raw_strings = [bib.tags["title"] for bib in entries] + [
+        " ".join(name) for bib in entries for name in bib.tags["author"]
+    ]
+    queries = [{"title": word} for word in title_words] + [
+        {"author": get_raw_text(name, not_change_letter_case=True)} for name in last_names
+    ]
+    dbfile = os.path.join(workdir, "bench_{}.db".format(size))
+
+    def new_database():
+        if os.path.exists(dbfile):
+            os.remove(dbfile)
+
+    def add_fromfile():
+        db = BibTeXDatabase(dbfile=dbfile)
+        db.add_fromfile(bibfile)
+        db.close(do_commit=True)
+
+    def search_bibtex():
+        for query in queries:
+            db.search_bibtex(**query)
+
+    db = None
+    results = []
+    for name in only:
+        if name == "parse":
+            items = len(bibstrings)
+            seconds = timed(lambda: [BibTeXEntry(s) for s in bibstrings], repeat)
+        elif name == "to_plaintext":
+            items = len(entries)
+            seconds = timed(lambda: [bib.to_plaintext() for bib in entries], repeat)
+        elif name == "render_many":
+            # all the built-in styles at once
+            items = len(entries) * len(styles)
+            seconds = timed(lambda: render_many(entries, styles), repeat)
+        elif name == "plaintext_to_bibtex":
+            items = len(plaintexts)
+            seconds = timed(
+                lambda: [BibTeXEntry.plaintext_to_bibtex(p) for p in plaintexts], repeat
+            )
+        elif name == "get_raw_text":
+            items = len(raw_strings)
+            seconds = timed(lambda: [get_raw_text(s) for s in raw_strings], repeat)
+        elif name == "add_fromfile":
+            items = size
+            seconds = timed(add_fromfile, repeat, setup=new_database)
+        elif name == "search_bibtex":
+            if not os.path.exists(dbfile):
+                add_fromfile()
+            db = BibTeXDatabase(dbfile=dbfile)
+            items = len(queries)
+            seconds = timed(search_bibtex, repeat)
+            db.close()
+        else:
+            raise ValueError("Unknown benchmark: {}".format(name))
+        results.append(
+            {
+                "benchmark": name,
+                "size": size,
+                "items": items,
+                "seconds": seconds,
+                "items_per_second": items / seconds if seconds > 0 else float("inf"),
+            }
+        )
+        print(
+            "{:>20} {:>8} entries  {:10.4f} s  {:12.1f} items/s".format(
+                name, size, seconds, results[-1]["items_per_second"]
+            ),
+            file=sys.stderr,
+        )
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return the benchmarks that are slower than `baseline` beyond `tolerance`."""
+    old = {(r["benchmark"], r["size"]): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        key = (r["benchmark"], r["size"])
+        if key not in old:
+            continue
+        ratio = r["items_per_second"] / old[key]["items_per_second"]
+        if ratio < 1 - tolerance:
+            regressions.append(dict(r, baseline_items_per_second=old[key]["items_per_second"], ratio=ratio))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1000, 10000], help="numbers of entries"
+    )
+    parser.add_argument(
+        "--benchmarks",
+        type=str,
+        nargs="+",
+        default=list(benchmark_names),
+        choices=benchmark_names,
+        help="benchmarks to run",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs per benchmark")
+    parser.add_argument(
+        "--output", type=str, default=None, help="write the results as JSON to this file"
+    )
+    parser.add_argument(
+        "--compare", type=str, default=None, help="JSON results to compare with"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed relative throughput drop compared with --compare",
+    )
+    parser.add_argument(
+        "--workdir", type=str, default=None, help="directory for the corpora and databases"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        results = []
+        for size in args.sizes:
+            results.extend(run(size, workdir, args.repeat, only=args.benchmarks))
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for r in regressions:
+            print(
+                "Regression: {} ({} entries) {:.1f} -> {:.1f} items/s ({:.0%})".format(
+                    r["benchmark"],
+                    r["size"],
+                    r["baseline_items_per_second"],
+                    r["items_per_second"],
+                    r["ratio"],
+                ),
+                file=sys.stderr,
+            )
+        if regressions:
+            sys.exit(1)
@@ -1,4 +1,11 @@
+import os
 import re
+import sys
+import time
+from array import array
+from collections import namedtuple
+from functools import lru_cache
+from functools import wraps
 
 
 # Unicode combining symbols
@@ -20,9 +27,7 @@ combining_symbols = {
     "\\t": u"\u0361",  # Double inverted breve (two args required) (⌒)
 }
 
-inverted_combining_symbols = {
-    v.encode("utf-8").decode("utf-8"): k for k, v in combining_symbols.items()
-}
+inverted_combining_symbols = {v: k for k, v in combining_symbols.items()}
 
 # Special symbols in LaTeX
 special_latex_symbols = {
@@ -245,26 +250,65 @@ predefined_string = {
 }
 
 
+_unescaped_brace_ptn = re.compile(r"(?<!\\)[{}]")
+
+
+def analyze_braces(string):
+    """Analyze the structure of all braces in the input string in a single pass.
+
+    Note: \{ and \} are ignored for the special grammar in LaTeX.
+
+    Args:
+        string (str): input string
+    Returns:
+        braces (List[int]): positions of all braces in `string`
+        pairs (List[Tuple[int, int, int, bool]]): (left, right, depth, has_inner) of
+            each pair of braces in the order they are closed, where `depth` is the
+            number of pairs wrapping it, and `has_inner` is True if any other pair
+            is nested inside it
+        unpaired (List[int]): positions of all braces without a matching one
+    """
+    braces = []
+    pairs = []
+    unpaired = []
+    stack = []
+    for match in _unescaped_brace_ptn.finditer(string):
+        pos = match.start()
+        braces.append(pos)
+        if match.group() == "{":
+            stack.append([pos, False])
+        elif len(stack) > 0:
+            left, has_inner = stack.pop()
+            if len(stack) > 0:
+                stack[-1][1] = True
+            pairs.append((left, pos, len(stack), has_inner))
+        else:
+            unpaired.append(pos)
+    unpaired.extend(left for left, _ in stack)
+    return braces, pairs, sorted(unpaired)
+
+
+def _remove_chars(string, positions):
+    """Remove the characters at the given (ascending) positions from the input string."""
+    parts = []
+    prev = 0
+    for pos in positions:
+        parts.append(string[prev:pos])
+        prev = pos + 1
+    parts.append(string[prev:])
+    return "".join(parts)
+
+
 def remove_brace_pair(string):
     """Remove all paired braces from the input string.
     
     Note: \{ and \} are ignored for the special grammar in LaTeX.
     """
-    pattern = r'(^\{|(?<=[^\\])\{|(?<=[^\\])\})'
-    left_brace_pos = []
-    left_brace = False
-    split_parts = re.split(pattern, string)
-    for i, part in enumerate(split_parts):
-        if len(part) == 0:
-            continue
-        if part == '{':
-            left_brace = True
-            left_brace_pos.append(i)
-        elif part == '}' and left_brace:
-            split_parts[left_brace_pos.pop(-1)] = ''
-            split_parts[i] = ''
-            left_brace = len(left_brace_pos) != 0
-    return ''.join(split_parts)
+    braces, pairs, unpaired = analyze_braces(string)
+    if len(unpaired) == 0:
+        return _remove_chars(string, braces)
+    unpaired = set(unpaired)
+    return _remove_chars(string, [pos for pos in braces if pos not in unpaired])
 
 
 def remove_redundant_brace_pair(string, keep_inner=True):
@@ -277,88 +321,178 @@ def remove_redundant_brace_pair(string, keep_inner=True):
         keep_inner (bool): If True, only keep the paired braces nested inside;
                            If False, only keep the outside paired braces.
     """
-    pattern = r'(^\{|(?<=[^\\])\{|(?<=[^\\])\})'
-    brace_pairs = []
-    left_brace_pos = []
-    left_brace = False
-    split_parts = re.split(pattern, string)
-    for i, part in enumerate(split_parts):
-        if len(part) == 0:
+    braces, pairs, unpaired = analyze_braces(string)
+    removed = set()
+    for left, right, depth, has_inner in pairs:
+        if (has_inner if keep_inner else depth > 0):
+            removed.add(left)
+            removed.add(right)
+    if len(removed) == 0:
+        return string
+    return _remove_chars(string, [pos for pos in braces if pos in removed])
+
+
+# Token emitted by the BibTeX lexer:
+#   kind (str): one of "TYPE", "KEY", "FIELD", "BRACED", "QUOTED", "BARE", "CONCAT"
+#   value (str): token text (the inner content for braced / quoted values)
+#   start, end (int): offsets of the token in the original buffer
+Token = namedtuple("Token", ["kind", "value", "start", "end"])
+
+_skip_ptn = re.compile(r"(?:\s|%[^\n]*)*")
+_entry_head_ptn = re.compile(r"@\s*(\w+)\s*\{\s*([^,\s}]+)")
+_string_head_ptn = re.compile(r"@\s*string\s*\{", re.IGNORECASE)
+_field_name_ptn = re.compile(r"[^\s=,{}\"#%]+")
+_bare_value_ptn = re.compile(r"\w[-\w]*")
+_braced_delim_ptn = re.compile(r"[{}%]")
+_quoted_delim_ptn = re.compile(r'["%]')
+_control_char_ptn = re.compile("[\t\a\b\r\v]")
+_control_char_to_code = {"\t": " ", "\a": "\\a", "\b": "\\b", "\r": "\\r", "\v": "\\v"}
+
+
+def _skip(string, pos):
+    """Return the position of the next character that is not whitespace or comment."""
+    return _skip_ptn.match(string, pos).end()
+
+
+def _scan_value(string, pos):
+    """Scan a single braced, quoted or bare value starting at `pos`.
+
+    Commented parts (from an unescaped "%" to the end of line) are dropped from
+    the value, while the token offsets still refer to `string`.
+    """
+    c = string[pos : pos + 1]
+    if c == "{":
+        kind, delim_ptn = "BRACED", _braced_delim_ptn
+    elif c == '"':
+        kind, delim_ptn = "QUOTED", _quoted_delim_ptn
+    else:
+        match = _bare_value_ptn.match(string, pos)
+        if not match:
+            raise ValueError("Invalid value at offset %d" % pos)
+        return Token("BARE", match.group(), pos, match.end())
+
+    pieces = []
+    count = 1
+    i = begin = pos + 1
+    while count > 0:
+        match = delim_ptn.search(string, i)
+        if match is None:
+            raise ValueError("Unterminated value %s... at offset %d" % (c, pos))
+        i = match.start()
+        if string[i - 1] == "\\":
+            i += 1
             continue
-        if part == '{':
-            left_brace = True
-            left_brace_pos.append(i)
-        elif part == '}' and left_brace:
-            pos = left_brace_pos.pop(-1)
-            left_brace = len(left_brace_pos) != 0
-            if keep_inner:
-                brace_pairs.append((pos, i))
-            elif left_brace:
-                split_parts[pos] = ''
-                split_parts[i] = ''
-    if keep_inner:
-        brace_pairs = sorted(brace_pairs)
-        for idx, (left, right) in enumerate(brace_pairs):
-            for l, r in brace_pairs:
-                if left < l and r < right:
-                    split_parts[left] = ''
-                    split_parts[right] = ''
-                    break
-                elif l > right:
-                    break
-    return ''.join(split_parts)
+        if match.group() == "%":
+            pieces.append(string[begin:i])
+            i = begin = string.find("\n", i)
+            if i < 0:
+                raise ValueError("Unterminated value %s... at offset %d" % (c, pos))
+            continue
+        count += 1 if match.group() == "{" else -1
+        i += 1
+    pieces.append(string[begin : i - 1])
+    return Token(kind, "".join(pieces), pos, i)
 
 
-def parse_author_list(string):
-    """Parse the author list with various formats.
+def _scan_field(string, pos, tokens):
+    """Scan `field_name = value # value ...` starting at `pos` into `tokens`.
+
+    Returns:
+        pos (int): position of the first character after the field
+    """
+    match = _field_name_ptn.match(string, pos)
+    if not match:
+        raise ValueError("Invalid field name at offset %d" % pos)
+    tokens.append(Token("FIELD", match.group(), pos, match.end()))
+    pos = _skip(string, match.end())
+    if string[pos : pos + 1] != "=":
+        raise ValueError("Expected '=' at offset %d" % pos)
+    pos = _skip(string, pos + 1)
+    while True:
+        token = _scan_value(string, pos)
+        if token.kind != "BARE" and _control_char_ptn.search(token.value):
+            # add possiblly missing "\\"
+            token = token._replace(
+                value=_control_char_ptn.sub(
+                    lambda m: _control_char_to_code[m.group()], token.value
+                )
+            )
+        tokens.append(token)
+        pos = _skip(string, token.end)
+        if string[pos : pos + 1] != "#":
+            return pos
+        tokens.append(Token("CONCAT", "#", pos, pos + 1))
+        pos = _skip(string, pos + 1)
+
+
+def tokenize_entry(string):
+    """Split a single BibTeX entry into tokens in one pass.
+
+    The entry is expected to look like:
+        @pub_type{entry_name,
+          field_name = {value},
+          field_name=    value,
+          field_name = "value" # macro,
+        }
 
     Args:
-        string (str): input string containing the author list in the beginning
+        string (str): input string containing a single BibTeX entry
     Returns:
-        authors (List[Tuple(First name + Middle name, Last name)]): list of authors
-        rest (str): remaining part of string
+        tokens (List[Token]): "TYPE" and "KEY" tokens, followed by a "FIELD" token
+            and its value tokens ("BRACED", "QUOTED", "BARE", joined by "CONCAT")
+            for each field
     """
-    # import pudb
-    # pudb.set_trace()
-    string_new = string.strip().replace(u"\u2013", "-").replace(u"\u2014", "-")
-    if string_new == "":
-        return [], ""
-    if string_new[0] == "{":
-        # {author list}
-        count = 1
-        for i in range(1, len(string_new)):
-            if string_new[i] == "{" and string_new[i - 1] != "\\":
-                count += 1
-            elif string_new[i] == "}" and string_new[i - 1] != "\\":
-                count -= 1
-            if count == 0:
-                author_list_str = string_new[1:i].strip()
-                rest = string_new[i + 1 :].strip()
-                assert rest == "" or rest[0] == ",", rest
-                if rest != "":
-                    rest = rest[1:].strip()
-                break
-        else:
-            # no match for {...}
-            raise ValueError("Invalid author list {...")
-
-    elif string_new[0] == '"':
-        # "author list"
-        count = 1
-        for i in range(1, len(string_new)):
-            if string_new[i] == '"' and string_new[i - 1] != "\\":
-                author_list_str = string_new[1:i].strip()
-                rest = string_new[i + 1 :].strip()
-                assert rest == "" or rest[0] == ",", rest
-                if rest != "":
-                    rest = rest[1:].strip()
-                break
-        else:
-            # no match for "..."
-            raise ValueError('Invalid author list "..."')
+    pos = _skip(string, 0)
+    match = _entry_head_ptn.match(string, pos)
+    if not match:
+        raise ValueError("Invalid entry head: %s" % string[pos : pos + 50])
+    tokens = [
+        Token("TYPE", match.group(1), match.start(1), match.end(1)),
+        Token("KEY", match.group(2), match.start(2), match.end(2)),
+    ]
+    length = len(string)
+    pos = _skip(string, match.end())
+    while True:
+        c = string[pos : pos + 1]
+        if c == "}":
+            pos += 1
+            break
+        elif c != ",":
+            raise ValueError("Expected ',' or '}' at offset %d" % pos)
+        pos = _skip(string, pos + 1)
+        if string[pos : pos + 1] == "}":
+            pos += 1
+            break
 
-    else:
+        pos = _scan_field(string, pos, tokens)
+
+    if _skip(string, pos) != length:
+        raise ValueError("Unexpected content after the entry at offset %d" % pos)
+    return tokens
+
+
+def _next_value(string):
+    """Scan the leading value of `string`.
+
+    Returns:
+        token (Token): the value token
+        rest (str): remaining part of string after the following comma
+    """
+    token = _scan_value(string, 0)
+    rest = string[token.end :].strip()
+    assert rest == "" or rest[0] == ",", rest
+    if rest != "":
+        rest = rest[1:].strip()
+    return token, rest
+
+
+def _parse_author_token(token):
+    """Parse the author list from a braced or quoted value token."""
+    if token.kind not in ("BRACED", "QUOTED"):
         raise ValueError("Invalid author list string")
+    author_list_str = (
+        token.value.replace(u"\u2013", "-").replace(u"\u2014", "-").strip()
+    )
 
     match = re.match(r".*and\s+others", author_list_str)
     if match:
@@ -395,18 +529,9 @@ def parse_author_list(string):
             # ... and zzz {xxx yyy} and ...
             # ... and xxx yyy and ...
             if author_name[-1] == "}" and author_name[-2] != "\\":
-                count = 1
-                for idx in range(len(author_name) - 2, -1, -1):
-                    # from len(author_name)-2 to 0
-                    if author_name[idx] == "{" and (
-                        idx == 0 or author_name[idx - 1] != "\\"
-                    ):
-                        count -= 1
-                    elif author_name[idx] == "}" and (
-                        idx == 0 or author_name[idx - 1] != "\\"
-                    ):
-                        count += 1
-                    if count == 0:
+                # the pair of braces closed at the end
+                for idx, right, _, _ in analyze_braces(author_name)[1]:
+                    if right == len(author_name) - 1:
                         last_name = re.sub(r'\s+', ' ', remove_brace_pair(author_name[idx:]).strip())
                         first_name = re.sub(r'\s+', ' ', remove_brace_pair(author_name[:idx]).strip())
                         break
@@ -429,361 +554,380 @@ def parse_author_list(string):
         else:
             authors.append((first_name, last_name))
 
-    return authors, rest
+    return authors
 
 
-def parse_number_range(string):
-    """Parse the number / number range.
+def parse_author_list(string):
+    """Parse the author list with various formats.
 
     Args:
-        string (str): input string containing the bib-style number range
+        string (str): input string containing the author list in the beginning
     Returns:
-        number_range (int or Tuple[int, int] or str or None): number / number range
+        authors (List[Tuple(First name + Middle name, Last name)]): list of authors
         rest (str): remaining part of string
     """
     string_new = string.strip()
     if string_new == "":
-        return None, ""
-    if string_new[0] == "{":
-        # {xxx--yyy} or {xxx}
-        count = 1
-        for i in range(1, len(string_new)):
-            if string_new[i] == "{" and string_new[i - 1] != "\\":
-                count += 1
-            elif string_new[i] == "}" and string_new[i - 1] != "\\":
-                count -= 1
-            if count == 0:
-                number_range_str = string_new[1:i].strip()
-                rest = string_new[i + 1 :].strip()
-                assert rest == "" or rest[0] == ",", rest
-                if rest != "":
-                    rest = rest[1:].strip()
-                break
-        else:
-            # no match for {...}
-            raise ValueError("Invalid number range {...")
+        return [], ""
+    token, rest = _next_value(string_new)
+    return _parse_author_token(token), rest
 
-        if re.search(r"[^\\]\{|[^\\]\}", number_range_str):
-            # remove all paired {}
-            count = 0
-            new_str = ""
-            for i, c in enumerate(number_range_str):
-                if c == "{" and (i == 0 or number_range_str[i - 1] != "\\"):
-                    count += 1
-                elif c == "}" and (i == 0 or number_range_str[i - 1] != "\\"):
-                    count -= 1
-                else:
-                    new_str += c
-            assert count == 0
-            number_range_str = new_str.strip()
 
-        if number_range_str == "":
-            number_range = None
-        else:
-            match = re.match(r"\s*(\d+)\s*-+\s*(\d+)\s*|\s*(\d+)\s*", number_range_str)
-            if match:
-                n1, n2, n3 = match.groups()
-                if n1 is None and n2 is None and n3 is not None:
-                    number_range = int(n3)
-                elif n1 is not None and n2 is not None and n3 is None:
-                    number_range = (int(n1), int(n2))
-                    if number_range[0] > number_range[1]:
-                        print(
-                            'Warning: "%d--%d" may be a wrong number range!'
-                            % number_range
-                        )
-                else:
-                    raise ValueError("Invalid match for number range")
-            elif number_range_str.rstrip(".").lower() in month2number:
-                number_range = month2number[number_range_str.rstrip(".").lower()]
-            else:
-                raise ValueError("No matched number range: {xxx--yyy} or {xxx}")
-
-    elif string_new[0] == '"':
-        # "xxx--yyy" or "xxx" or "{xxx--yyy}" or "{xxx}"
-        count = 1
-        for i in range(1, len(string_new)):
-            if string_new[i] == '"' and string_new[i - 1] != "\\":
-                number_range_str = string_new[1:i].strip()
-                rest = string_new[i + 1 :].strip()
-                assert rest == "" or rest[0] == ",", rest
-                if rest != "":
-                    rest = rest[1:].strip()
-                break
-        else:
-            # no match for "..."
-            raise ValueError('Invalid author list "..."')
+def _lookup_string(name, strings):
+    """Return the value of a predefined string, or None if it is not defined.
+
+    Args:
+        name (str): name of the predefined string
+        strings (dict or None): @string definitions of the file being parsed, which
+            take precedence over `predefined_string`
+    """
+    if strings is not None and name in strings:
+        return strings[name]
+    return predefined_string.get(name, None)
 
+
+def _parse_number_token(token, strings=None):
+    """Parse the number / number range from a single value token."""
+    if token.kind in ("BRACED", "QUOTED"):
+        # {xxx--yyy} or {xxx} or "xxx--yyy" or "xxx" or "{xxx--yyy}" or "{xxx}"
+        number_range_str = token.value.strip()
         if re.search(r"[^\\]\{|[^\\]\}", number_range_str):
             # remove all paired {}
-            count = 0
-            new_str = ""
-            for i, c in enumerate(number_range_str):
-                if c == "{" and (i == 0 or number_range_str[i - 1] != "\\"):
-                    count += 1
-                elif c == "}" and (i == 0 or number_range_str[i - 1] != "\\"):
-                    count -= 1
-                else:
-                    new_str += c
-            assert count == 0
-            number_range_str = new_str.strip()
+            braces, _, unpaired = analyze_braces(number_range_str)
+            assert sum(1 if number_range_str[i] == "{" else -1 for i in unpaired) == 0
+            number_range_str = _remove_chars(number_range_str, braces).strip()
 
         if number_range_str == "":
-            number_range = None
-        else:
-            match = re.match(r"\s*(\d+)\s*-+\s*(\d+)\s*|\s*(\d+)\s*", number_range_str)
-            if match:
-                n1, n2, n3 = match.groups()
-                if n1 is None and n2 is None and n3 is not None:
-                    number_range = int(n3)
-                elif n1 is not None and n2 is not None and n3 is None:
-                    number_range = (int(n1), int(n2))
-                    if number_range[0] > number_range[1]:
-                        print(
-                            'Warning: "%d--%d" may be a wrong number range!'
-                            % number_range
-                        )
-                else:
-                    raise ValueError("Invalid match for number range")
-            elif number_range_str.rstrip(".").lower() in month2number:
-                number_range = month2number[number_range_str.rstrip(".").lower()]
+            return None
+        match = re.match(r"\s*(\d+)\s*-+\s*(\d+)\s*|\s*(\d+)\s*", number_range_str)
+        if match:
+            n1, n2, n3 = match.groups()
+            if n1 is None and n2 is None and n3 is not None:
+                number_range = int(n3)
+            elif n1 is not None and n2 is not None and n3 is None:
+                number_range = (int(n1), int(n2))
+                if number_range[0] > number_range[1]:
+                    print(
+                        'Warning: "%d--%d" may be a wrong number range!'
+                        % number_range
+                    )
             else:
-                raise ValueError('No matched number range: "xxx--yyy" or "xxx"')
+                raise ValueError("Invalid match for number range")
+        elif number_range_str.rstrip(".").lower() in month2number:
+            number_range = month2number[number_range_str.rstrip(".").lower()]
+        elif token.kind == "BRACED":
+            raise ValueError("No matched number range: {xxx--yyy} or {xxx}")
+        else:
+            raise ValueError('No matched number range: "xxx--yyy" or "xxx"')
 
-    elif re.match(r"\d", string_new[0]):
+    elif re.match(r"\d", token.value):
         # number
-        match = re.search(r"^(\d+)\s*(?:,|$)", string_new)
-        if match:
-            number_range = int(match.group(1))
-            rest = string_new[match.end() :]
-        else:
+        if not re.match(r"\d+$", token.value):
             raise ValueError("Invalid number range xxx")
+        number_range = int(token.value)
 
-    elif re.match(r"\w", string_new[0]):
+    else:
         # predefined_string or month string (e.g. Sep)
-        for i in range(1, len(string_new)):
-            if re.match(r"[^-\w]", string_new[i]):
-                number_range = string_new[:i].strip()
-                rest = string_new[i:].strip()
-                assert rest == "" or rest[0] == ",", rest
-                if rest != "":
-                    rest = rest[1:].strip()
-                break
-        else:
-            number_range = string_new
-            rest = ""
-
+        number_range = token.value
         if number_range.rstrip(".").lower() in month2number:
             number_range = month2number[number_range.rstrip(".").lower()]
-        elif number_range not in predefined_string:
-            print('Warning: "%s" is not defined in `predefined_string`!' % number_range)
+        else:
+            if _lookup_string(number_range, strings) is None:
+                print('Warning: "%s" is not defined in `predefined_string`!' % number_range)
             # for distinguishing the predefined string
             number_range = "#" + number_range
-    else:
-        raise ValueError("Invalid number range string")
 
-    return number_range, rest
+    return number_range
 
 
-def parse_string(string):
-    """Parse the bib-style string field.
+def parse_number_range(string):
+    """Parse the number / number range.
 
     Args:
-        string (str): input string containing the bib-style string
+        string (str): input string containing the bib-style number range
     Returns:
-        ret_str (str): parsed string field
+        number_range (int or Tuple[int, int] or str or None): number / number range
         rest (str): remaining part of string
     """
     string_new = string.strip()
     if string_new == "":
-        return "", ""
-    if string_new[0] == "{":
-        # {xxx}
-        count = 1
-        for i in range(1, len(string_new)):
-            if string_new[i] == "{" and string_new[i - 1] != "\\":
-                count += 1
-            elif string_new[i] == "}" and string_new[i - 1] != "\\":
-                count -= 1
-            if count == 0:
-                ret_str = re.sub(r"\s+", " ", string_new[1:i].strip())
-                rest = string_new[i + 1 :].strip()
-                assert rest == "" or rest[0] == ",", rest
-                if rest != "":
-                    rest = rest[1:].strip()
-                break
-        else:
-            # no match for {...}
-            raise ValueError("Invalid string {...")
-
-    elif string_new[0] == '"':
-        # "xxx"
-        count = 1
-        for i in range(1, len(string_new)):
-            if string_new[i] == '"' and string_new[i - 1] != "\\":
-                ret_str = re.sub(r"\s+", " ", string_new[1:i].strip())
-                rest = string_new[i + 1 :].strip()
-                assert rest == "" or rest[0] == ",", rest
-                if rest != "":
-                    rest = rest[1:].strip()
-                break
-        else:
-            # no match for "..."
-            raise ValueError('Invalid string "..."')
+        return None, ""
+    token, rest = _next_value(string_new)
+    return _parse_number_token(token), rest
 
-    elif re.match(r"\w", string_new[0]):
-        # predefined_string
-        for i in range(1, len(string_new)):
-            if re.match(r"[^-\w]", string_new[i]):
-                ret_str = string_new[:i].strip()
-                rest = string_new[i:].strip()
-                assert rest == "" or rest[0] == ",", rest
-                if rest != "":
-                    rest = rest[1:].strip()
-                break
-        else:
-            ret_str = string_new
-            rest = ""
 
-        if ret_str not in predefined_string:
+def _parse_string_token(token, strings=None):
+    """Parse the bib-style string field from a single value token."""
+    if token.kind in ("BRACED", "QUOTED"):
+        # {xxx} or "xxx"
+        ret_str = re.sub(r"\s+", " ", token.value.strip())
+    else:
+        # predefined_string
+        ret_str = token.value
+        if _lookup_string(ret_str, strings) is None:
             print('Warning: "%s" is not defined in `predefined_string`!' % ret_str)
         # for distinguishing the predefined string
         ret_str = "#" + ret_str
-    else:
-        raise ValueError("Invalid string")
+    return remove_redundant_brace_pair(ret_str)
 
-    return remove_redundant_brace_pair(ret_str), rest
 
+def _join_string_tokens(tokens, strings=None):
+    """Join value tokens separated by "#" into a single bib-style string.
+
+    Predefined strings are expanded with their values in `strings` or
+    `predefined_string`.
+    """
+    parts = []
+    for token in tokens:
+        if token.kind != "BARE":
+            parts.append(token.value)
+            continue
+        value = _lookup_string(token.value, strings)
+        if value is None:
+            raise ValueError(
+                '"%s" is not defined in `predefined_string`!' % token.value
+            )
+        parts.append(value)
+    return remove_redundant_brace_pair(re.sub(r"\s+", " ", "".join(parts).strip()))
 
-def get_raw_text(string, not_change_letter_case=False):
-    """Convert the input BibTeX style string to plain text.
+
+def _parse_string_tokens(tokens, strings=None):
+    """Parse the bib-style string field from value tokens joined by "#"."""
+    if len(tokens) == 1:
+        return _parse_string_token(tokens[0], strings)
+    # "xxx" # predefined_string # {yyy}
+    return _join_string_tokens(tokens, strings)
+
+
+def parse_string(string):
+    """Parse the bib-style string field.
 
     Args:
-        string (str): input string
-        not_change_letter_case (bool): True: keep the original letter case in `string`
-                                             (e.g. for author names)
-                                       False: auto capitalize a word-initial at the
-                                             beginning or after a colon
+        string (str): input string containing the bib-style string
     Returns:
-        ret_str (str): processed plain text
+        ret_str (str): parsed string field
+        rest (str): remaining part of string
+    """
+    string_new = string.strip()
+    if string_new == "":
+        return "", ""
+    token, rest = _next_value(string_new)
+    return _parse_string_token(token), rest
+
+
+def parse_string_definition(string, strings=None):
+    """Parse a string definition block, e.g. @string{ieee-taslp = "IEEE Trans. ..."}.
+
+    Args:
+        string (str): input string containing a single @string block
+        strings (dict or None): @string definitions of the same file that may be
+            used in the value, besides `predefined_string`
+    Returns:
+        name (str): name of the predefined string
+        value (str): bib-style value with all predefined strings expanded
     """
-    string_new = re.sub(r"\s+", " ", string.strip())
+    pos = _skip(string, 0)
+    match = _string_head_ptn.match(string, pos)
+    if not match:
+        raise ValueError("Invalid string definition: %s" % string[pos : pos + 50])
+    tokens = []
+    pos = _scan_field(string, _skip(string, match.end()), tokens)
+    if string[pos : pos + 1] != "}" or _skip(string, pos + 1) != len(string):
+        raise ValueError("Expected '}' at offset %d" % pos)
+    return tokens[0].value, _join_string_tokens(tokens[1::2], strings)
+
+
+def define_string(name, value):
+    """Add or overwrite a predefined string (used as `field = name` in BibTeX).
+
+    The string is defined for all the entries parsed afterwards in the process.
+    The @string definitions of a .bib file only apply to that file, see
+    `BibTeXEntry.strings`.
+    """
+    predefined_string[name] = value
+    # cached results of `get_raw_text` may contain the old value
+    clear_cache()
+
+
+# Precompiled patterns for `get_raw_text`
+#   - keys of `special_latex_symbols` that contain a preceding key (e.g. "\\ij") can
+#     never be matched, as the preceding one is always replaced first
+_special_latex_keys = []
+for _key in special_latex_symbols:
+    if not any(k in _key for k in _special_latex_keys):
+        _special_latex_keys.append(_key)
+_special_latex_ptn = re.compile("|".join(re.escape(k) for k in _special_latex_keys))
+#   - a combining symbol ending with a letter should be separated from its modified
+#     character by a non-word char or any {}-wrapped string, other combining symbols
+#     can be followed by any non-{ character or {}-wrapped string
+#   - the modified character or string must not contain a backslash, so that nested
+#     accents (e.g. \d{\^e}) are applied from the inside out by repeated substitution
+_combining_ptn = re.compile(
+    r"(?:{})(?:\{{\s*[^\s\}}\\]*\s*\}}|[^\{{\w\\])|(?:{})(?:\{{\s*[^\s\}}\\]*\s*\}}|[^\{{\\])".format(
+        "|".join(re.escape(k) for k in combining_symbols if re.match(r"\w", k[-1])),
+        "|".join(re.escape(k) for k in combining_symbols if not re.match(r"\w", k[-1])),
+    )
+)
+_whitespace_ptn = re.compile(r"\s+")
+_word_char_ptn = re.compile(r"\w")
+_left_brace_ptn = re.compile(r"([^\\]|^)\{")
+_keep_letter_case_ptn = re.compile(r"(?<=:)\w|(?<=: )\w")
+
+
+def _apply_combining_symbol(match):
+    """Move the combining symbol after the modified character, e.g. \\'{e} => {é}."""
+    string = match.group()
+    symbol = combining_symbols[string[:2]]
+    rest = string[2:]
+    if rest[0] != "{":
+        return rest + symbol
+    # skip inner braces, e.g. \^{{é}} => {{é̂}}
+    braces = len(rest) - len(rest.lstrip("{"))
+    word = rest[braces:-1].lstrip()
+    if word == "":
+        return rest[:braces] + "}"
+    return rest[:braces] + word[0] + symbol + word[1:] + "}"
+
+
+def _lower_letter_case(string, start, end):
+    """Lower the letter case of string[start:end], except that:
+        - a word-initial at the beginning of `string` is capitalized
+        - a word-initial after a colon is kept unchanged
+    """
+    pieces = []
+    pos = start
+    for match in _keep_letter_case_ptn.finditer(string, start, end):
+        pieces.append(string[pos : match.start()])
+        pieces.append(None)
+        pos = match.end()
+    pieces.append(string[pos:end])
+    ret = []
+    pos = start
+    for piece in pieces:
+        if piece is None:
+            ret.append(string[pos])
+            pos += 1
+        else:
+            ret.append(piece.lower() if piece.isascii() else "".join(map(str.lower, piece)))
+            pos += len(piece)
+    if start == 0 and end > 0 and _word_char_ptn.match(string):
+        # the upper case of the original character, as `lower` may not round
+        # trip (e.g. "İ" => "i̇", two characters)
+        ret[0] = string[0].upper() + ret[0][len(string[0].lower()) :]
+    return "".join(ret)
+
+
+def _get_raw_text(string, not_change_letter_case=False):
+    """Uncached implementation of `get_raw_text`."""
+    string_new = _whitespace_ptn.sub(" ", string.strip())
     if string_new.startswith("#"):
         return predefined_string.get(string[1:], "UNDEFINED")
-    while "\\" in string_new:
+    if "\\" in string_new:
         # replace all LaTeX special symbols with Unicode characters
-        for pattern in special_latex_symbols:
-            string_new = string_new.replace(pattern, special_latex_symbols[pattern])
-        if "\\" not in string_new:
-            break
-
-        for pattern in combining_symbols:
-            if pattern not in string_new:
-                continue
-            ptn = re.escape(pattern)
-            if re.match(r"\w", pattern[-1]):
-                # should be separated from its modified character by a non-word char
-                # or any {}-wrapped string
-                ptn2 = "(" + ptn + r"\{\s*[^\s\}]*\s*\}|" + ptn + r"[^\{\w])"
-            else:
-                # any non-{ character or {}-wrapped string
-                ptn2 = "(" + ptn + r"\{\s*[^\s\}]*\s*\}|" + ptn + r"[^\{])"
-            new_str = ""
-            end = 0
-            for match in re.finditer(ptn2, string_new):
-                if match.start() > end:
-                    new_str += string_new[end : match.start()]
-                end = match.end()
-                count, wrapped = 0, False
-                is_modified_word = False
-                match_str = ""
-                for c in match.group()[2:]:
-                    if c == "{":
-                        count += 1
-                        wrapped = True
-                        match_str += c
-                    elif c == "}":
-                        count -= 1
-                        wrapped = count != 0
-                        match_str += c
-                    elif re.match(r"\s", c) and wrapped and not is_modified_word:
-                        continue
-                    elif not is_modified_word:
-                        is_modified_word = True
-                        match_str += c + combining_symbols[pattern]
-                    else:
-                        match_str += c
-
-                assert count == 0, count
-                new_str += match_str
-            string_new = new_str + string_new[end:]
-        break
+        string_new = _special_latex_ptn.sub(
+            lambda m: special_latex_symbols[m.group()], string_new
+        )
+        while "\\" in string_new:
+            string_new, count = _combining_ptn.subn(_apply_combining_symbol, string_new)
+            if count == 0:
+                break
 
-    if re.search(r"([^\\]|^)\{", string_new):
+    if _left_brace_ptn.search(string_new):
         # remove all paired {}
         count = 0
-        new_str = ""
         wrapped = False
-        for i, c in enumerate(string_new):
-            if c == "{" and (i == 0 or string_new[i - 1] != "\\"):
+        new_str = []
+        pos = 0
+        for brace in analyze_braces(string_new)[0]:
+            if brace > pos:
+                if not_change_letter_case or wrapped:
+                    new_str.append(string_new[pos:brace])
+                else:
+                    new_str.append(_lower_letter_case(string_new, pos, brace))
+            if string_new[brace] == "{":
                 count += 1
                 wrapped = True
-            elif c == "}" and (i == 0 or string_new[i - 1] != "\\"):
+            else:
                 count -= 1
                 wrapped = count != 0
-            elif re.match(r"\w", c):
-                if not_change_letter_case or wrapped:
-                    new_str += c
-                elif i == 0:
-                    new_str += c.upper()
-                elif string_new[i - 1] == ":" or (
-                    string_new[i - 1] == " " and string_new[i - 2 : i - 1] == ":"
-                ):
-                    new_str += c
-                else:
-                    new_str += c.lower()
-            else:
-                new_str += c.lower()
+            pos = brace + 1
+        if not_change_letter_case or wrapped:
+            new_str.append(string_new[pos:])
+        else:
+            new_str.append(_lower_letter_case(string_new, pos, len(string_new)))
         assert count == 0, count
-        string_new = new_str.strip()
+        string_new = "".join(new_str).strip()
     elif not_change_letter_case:
         string_new = string_new.strip()
     else:
-        new_str = ""
-        for i, c in enumerate(string_new):
-            if re.match(r"\w", c):
-                if i == 0:
-                    new_str += c.upper()
-                elif string_new[i - 1] == ":" or (
-                    string_new[i - 1] == " " and string_new[i - 2 : i - 1] == ":"
-                ):
-                    new_str += c
-                else:
-                    new_str += c.lower()
-            else:
-                new_str += c.lower()
-        string_new = new_str.strip()
+        string_new = _lower_letter_case(string_new, 0, len(string_new)).strip()
     return string_new
 
 
-def raw_string_to_bib_style(string, handle_letter_case=False):
-    """Convert the plain text to a bib-style string.
+# Precomputed tables for `raw_string_to_bib_style`, built once from the regex
+# tables above instead of matching every pattern against every character
+_combining_marks = "".join(sorted(inverted_combining_symbols))
+
+
+def _encode_word_char(c):
+    """Encode a word character (possibly followed by combining marks) as LaTeX.
 
     Args:
-        string (str): input plain text
-        handle_letter_case (bool): True: auto wrap upper- or mixed-case words with {}
-                                   False: use the original letter case in `string`
+        c (str): a word character and the combining marks attached to it
     Returns:
-        ret_str (str): bib-style string
+        c (str): LaTeX code of `c`, or `c` itself if it needs no encoding
     """
-    string = re.sub(r"\s+", " ", string.strip())
-    string_lst = []
-    for c in string:
-        if c in inverted_combining_symbols and len(string_lst) > 0:
-            string_lst[-1] = string_lst[-1] + c
-        else:
-            string_lst.append(c)
-    length = len(string_lst)
+    c_encoding = c.encode("ascii", "backslashreplace").decode("ascii")
+    for ptn, to_ptn in char_encoding_to_code.items():
+        if re.match(ptn, c_encoding):
+            return re.sub(ptn, to_ptn, c_encoding)
+    return c
+
+
+@lru_cache(maxsize=None)
+def _word_char_table():
+    """Return the LaTeX code of each single code point in `char_encoding_to_code`.
+
+    Characters absent from the table are kept as is (only clusters with combining
+    marks need `_encode_word_char`). Built on first use rather than at import, as
+    it matches every pattern against every character.
+
+    Returns:
+        table (Dict[str, str]): character -> LaTeX code
+    """
+    table = {}
+    for ptn in char_encoding_to_code:
+        char = ptn.replace("\\\\", "\\").encode("ascii").decode("unicode_escape")
+        if len(char) == 1:
+            table.setdefault(char, _encode_word_char(char))
+    return table
+
+# Printable ASCII characters that are copied to the output untouched
+_plain_word_chars = "-0-9A-Za-z"
+_plain_other_chars = r" !\"'()*+,./:;=?@\[\\\]{|}~"
+_plain_ascii_ptn = re.compile("[%s%s]*" % (_plain_word_chars, _plain_other_chars))
+# ASCII runs that are not followed by a combining mark, or a single character
+# together with its combining marks
+_bib_style_token_ptn = re.compile(
+    "([%s]+)(?![%s])|([%s]+)(?![%s])|(.[%s]*)"
+    % (
+        _plain_word_chars,
+        _combining_marks,
+        _plain_other_chars,
+        _combining_marks,
+        _combining_marks,
+    ),
+    re.DOTALL,
+)
+
+
+def _raw_string_to_bib_style(string, handle_letter_case=False):
+    """Uncached implementation of `raw_string_to_bib_style`."""
+    string = _whitespace_ptn.sub(" ", string.strip())
+    if not handle_letter_case and _plain_ascii_ptn.fullmatch(string):
+        return string
+    length = len(string)
+    word_char_to_code = _word_char_table()
     ret_str = []
 
     prev_char = ""
@@ -791,39 +935,59 @@ def raw_string_to_bib_style(string, handle_letter_case=False):
     is_word = False
     bracket_wrapped = False
     symbol_wrapped = False
-    for i, c in enumerate(string_lst):
-        if re.match(r"[-\w]", c, flags=re.UNICODE):
-            if c == "-":
-                word_str += "-"
-            elif c == u"\u2013":
-                word_str += "--"
-            elif c == u"\u2014":
-                word_str += "---"
+    for match in _bib_style_token_ptn.finditer(string):
+        word_run, other_run, c = match.groups()
+        if word_run is not None:
+            # ASCII letters, digits and hyphens are kept as they are
+            if handle_letter_case and not bracket_wrapped:
+                bracket_wrapped = (
+                    word_run[0].isupper() and prev_char not in ("", ":")
+                ) or word_run[1:].lower() != word_run[1:]
+            if symbol_wrapped:
+                word_str += word_run[0] + "}" + word_run[1:]
+                symbol_wrapped = False
             else:
-                if not bracket_wrapped:
-                    bracket_wrapped = (
-                        handle_letter_case
-                        and c.isupper()
-                        and prev_char not in ("", ":")
-                    )
-                c_encoding = c.encode("ascii", "backslashreplace").decode("ascii")
-                for ptn, to_ptn in char_encoding_to_code.items():
-                    match = re.match(ptn, c_encoding)
-                    if match:
-                        c = re.sub(ptn, to_ptn, c_encoding)
-                        break
-                word_str += c
+                word_str += word_run
+            is_word = True
+            prev_char = word_run[-1]
+            if match.end() == length:
+                if bracket_wrapped:
+                    ret_str.append("{%s}" % word_str)
+                else:
+                    ret_str.append(word_str)
+        elif other_run is not None:
+            # ASCII punctuation that needs no escaping ends the current word
+            if is_word:
+                if bracket_wrapped:
+                    ret_str.append("{%s}" % word_str)
+                else:
+                    ret_str.append(word_str)
+                word_str = ""
+                is_word = bracket_wrapped = False
+            ret_str.append(other_run)
+            prev_char = other_run[-1]
+        elif c[0] == "-" or _word_char_ptn.match(c):
+            if not bracket_wrapped:
+                bracket_wrapped = (
+                    handle_letter_case and c.isupper() and prev_char not in ("", ":")
+                )
+            if len(c) == 1:
+                c = word_char_to_code.get(c, c)
+            else:
+                c = _encode_word_char(c)
+            word_str += c
 
             if symbol_wrapped:
                 word_str += "}"
                 symbol_wrapped = False
 
             is_word = True
-            if i == length - 1:
+            if match.end() == length:
                 if bracket_wrapped:
                     ret_str.append("{%s}" % word_str)
                 else:
                     ret_str.append(word_str)
+            prev_char = c
         else:
             if c == u"\x7f":
                 continue
@@ -845,38 +1009,638 @@ def raw_string_to_bib_style(string, handle_letter_case=False):
                     is_word = bracket_wrapped = False
             else:
                 ret_str.append(c_str)
-        prev_char = c
+            prev_char = c
     return "".join(ret_str)
 
 
+# LRU caches for `get_raw_text` and `raw_string_to_bib_style`, as author names,
+# venues and journal names repeat heavily across a bibliography
+_get_raw_text_cached = lru_cache(maxsize=8192)(_get_raw_text)
+_raw_string_to_bib_style_cached = lru_cache(maxsize=8192)(_raw_string_to_bib_style)
+
+
+def set_cache_size(maxsize):
+    """Resize the caches of `get_raw_text` and `raw_string_to_bib_style`.
+
+    All cached results and hit/miss counters are discarded.
+
+    Args:
+        maxsize (int or None): maximum number of cached results per function
+            (0 disables caching, None means unbounded)
+    """
+    global _get_raw_text_cached, _raw_string_to_bib_style_cached
+    _get_raw_text_cached = lru_cache(maxsize=maxsize)(_get_raw_text)
+    _raw_string_to_bib_style_cached = lru_cache(maxsize=maxsize)(_raw_string_to_bib_style)
+
+
+def clear_cache():
+    """Discard all cached results and hit/miss counters."""
+    _get_raw_text_cached.cache_clear()
+    _raw_string_to_bib_style_cached.cache_clear()
+
+
+def cache_info():
+    """Return the cache statistics of each cached function.
+
+    Returns:
+        info (Dict[str, CacheInfo]): (hits, misses, maxsize, currsize) of the caches
+            of "get_raw_text" and "raw_string_to_bib_style"
+    """
+    return {
+        "get_raw_text": _get_raw_text_cached.cache_info(),
+        "raw_string_to_bib_style": _raw_string_to_bib_style_cached.cache_info(),
+    }
+
+
+def get_raw_text(string, not_change_letter_case=False):
+    """Convert the input BibTeX style string to plain text.
+
+    Args:
+        string (str): input string
+        not_change_letter_case (bool): True: keep the original letter case in `string`
+                                             (e.g. for author names)
+                                       False: auto capitalize a word-initial at the
+                                             beginning or after a colon
+    Returns:
+        ret_str (str): processed plain text
+    """
+    return _get_raw_text_cached(string, bool(not_change_letter_case))
+
+
+def raw_string_to_bib_style(string, handle_letter_case=False):
+    """Convert the plain text to a bib-style string.
+
+    Args:
+        string (str): input plain text
+        handle_letter_case (bool): True: auto wrap upper- or mixed-case words with {}
+                                   False: use the original letter case in `string`
+    Returns:
+        ret_str (str): bib-style string
+    """
+    return _raw_string_to_bib_style_cached(string, bool(handle_letter_case))
+
+
+def _parse_field(keyword, values, strings=None):
+    """Parse the value tokens of a field.
+
+    Args:
+        keyword (str): lower-case field name
+        values (List[Token]): value tokens of the field, without CONCAT tokens
+        strings (dict or None): @string definitions of the file, see `_lookup_string`
+    Returns:
+        value (List[List[str]] or int or Tuple[int, int] or str or None): author
+            list, number / number range, or string
+    """
+    if keyword == "author":
+        # parse author list
+        if len(values) != 1:
+            raise ValueError("Invalid author list string")
+        return _parse_author_token(values[0])
+    elif keyword in (
+        "edition", "series", "chapter", "volume", "number", "pages", "month", "year"
+    ):
+        # parse number / number range
+        if len(values) != 1:
+            raise ValueError("Invalid number range string")
+        return _parse_number_token(values[0], strings)
+    else:
+        # parse string
+        return _parse_string_tokens(values, strings)
+
+
+# Unparsed field of a lazily parsed entry, with the @string definitions to parse
+# it with
+_RawField = namedtuple("_RawField", ["tokens", "strings"])
+
+
+class _LazyTags(dict):
+    """Field dict of a `BibTeXEntry` created with lazy=True.
+
+    Fields are stored as `_RawField`s and parsed (and cached) on first access.
+    Methods that expose all the values at once parse all pending fields first.
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if type(value) is _RawField:
+            value = _parse_field(key, value.tokens, value.strings)
+            dict.__setitem__(self, key, value)
+        return value
+
+    def __iter__(self):
+        # Overridden so that dict(tags) and {**tags} go through __getitem__
+        return dict.__iter__(self)
+
+    def parse_all(self):
+        """Parse all the fields that have not been accessed yet."""
+        for key, value in dict.items(self):
+            if type(value) is _RawField:
+                self[key]
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            dict.__delitem__(self, key)
+            return value
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        if type(value) is _RawField:
+            value = _parse_field(key, value.tokens, value.strings)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def values(self):
+        self.parse_all()
+        return dict.values(self)
+
+    def items(self):
+        self.parse_all()
+        return dict.items(self)
+
+    def copy(self):
+        self.parse_all()
+        return dict.copy(self)
+
+    def __eq__(self, other):
+        self.parse_all()
+        if isinstance(other, _LazyTags):
+            other.parse_all()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __repr__(self):
+        self.parse_all()
+        return dict.__repr__(self)
+
+    def __reduce__(self):
+        return dict, (self.copy(),)
+
+
+# Citation styles: each style is declared as one template per publication type
+# and compiled once into render functions (see `define_style`).
+#
+# Template syntax:
+#   {field}        value of a field, formatted by its default formatter
+#   {field:fmt}    value formatted by `fmt` (a key of `_field_formats`)
+#   {a|b}          value of the first field that is given
+#   [...]          optional part, omitted if any field inside it is not given
+#   {author}       author list, formatted by the "author" spec of the style
+# A field outside of [...] is required (KeyError if it is not given).
+citation_styles = {
+    "IEEEtran": {
+        "author": {
+            "name": "{first_abbr} {last}",
+            "sep": ", ",
+            "last_sep": ", and ",
+            "others_sep": " ",
+            "others": "et al.",
+            "end": ", ",
+        },
+        "types": {
+            ("article", "misc"): u"{author}\u201c{title},\u201d {journal}, "
+            "[vol. {volume}, ][no. {number}, ][pp. {pages}, ]{year}[, {note}].",
+            ("inproceedings", "incollection"): u"{author}\u201c{title},\u201d in "
+            "{booktitle}, {year}[, pp. {pages}][, {note}].",
+            "book": u"{author}\u201c{title},\u201d [{edition} ed., ][ser. {series}, ]"
+            "{publisher}, [vol. {volume}, ]{year}[, {note}].",
+            "manual": u"{author}\u201c{title},\u201d [{edition} ed., ]"
+            "{organization|address}, {year}[, {note}].",
+            "techreport": u"{author}\u201c{title},\u201d {institution|address}, "
+            "Tech. Rep.[ {number}], {year}[, {note}].",
+        },
+    },
+    "APA": {
+        "author": {
+            "name": "{last}, {first_abbr}",
+            "sep": ", ",
+            "last_sep": ", & ",
+            "others_sep": ", ",
+            "others": "et al.",
+            "end": " ",
+        },
+        "types": {
+            ("article", "misc"): "{author}({year}). {title}. {journal}"
+            "[, {volume}][({number})][, {pages}].[ {note}.]",
+            ("inproceedings", "incollection"): "{author}({year}). {title}. "
+            "In {booktitle}[ (pp. {pages})].[ {note}.]",
+            "book": "{author}({year}). {title}[ ({edition} ed.)][ (Vol. {volume})]. "
+            "{publisher}.[ {note}.]",
+            "manual": "{author}({year}). {title}[ ({edition} ed.)]. "
+            "{organization|address}.[ {note}.]",
+            "techreport": "{author}({year}). {title}[ (Tech. Rep. No. {number})]. "
+            "{institution|address}.[ {note}.]",
+        },
+    },
+    "ACM": {
+        "author": {
+            "name": "{first} {last}",
+            "sep": ", ",
+            "last_sep": ", and ",
+            "two_sep": " and ",
+            "others_sep": " ",
+            "others": "et al.",
+            "end": ". ",
+        },
+        "types": {
+            ("article", "misc"): "{author}{year}. {title:name}. {journal}"
+            "[ {volume}][, {number}] ({year})[, {pages}].[ {note}.]",
+            ("inproceedings", "incollection"): "{author}{year}. {title:name}. "
+            "In {booktitle}[, {pages}].[ {note}.]",
+            "book": "{author}{year}. {title:name}[ ({edition} ed.)][. Vol. {volume}]. "
+            "{publisher}.[ {note}.]",
+            "manual": "{author}{year}. {title:name}[ ({edition} ed.)]. "
+            "{organization|address}.[ {note}.]",
+            "techreport": "{author}{year}. {title:name}. Technical Report[ {number}]. "
+            "{institution|address}.[ {note}.]",
+        },
+    },
+}
+# IEEEbib only differs from IEEEtran in not abbreviating the first names
+citation_styles["IEEEbib"] = dict(
+    citation_styles["IEEEtran"],
+    author=dict(citation_styles["IEEEtran"]["author"], name="{first} {last}"),
+)
+
+
+def _format_text(value):
+    # title, year, volume, number, series: LaTeX -> plain text
+    return get_raw_text(value) if isinstance(value, str) else str(value)
+
+
+def _format_name(value):
+    # venues, publishers, ...: LaTeX -> plain text, keeping the letter case
+    if isinstance(value, str):
+        return get_raw_text(value, not_change_letter_case=True)
+    return str(value)
+
+
+def _format_pages(value):
+    if isinstance(value, str):
+        return re.sub(r"-+", u"\u2013", get_raw_text(value))
+    elif isinstance(value, tuple):
+        return u"{}\u2013{}".format(value[0], value[1])
+    return str(value)
+
+
+def _format_ordinal(value):
+    # edition: 1 -> 1st, 2 -> 2nd, 4 -> 4th, ...
+    value = _format_text(value)
+    for no in number_suffix:
+        if value.endswith(no):
+            return value + number_suffix[no]
+    return value + "th"
+
+
+_field_formats = {
+    "text": _format_text,
+    "name": _format_name,
+    "pages": _format_pages,
+    "ordinal": _format_ordinal,
+    "raw": str,
+}
+# formatter of the fields not listed here: "name"
+_default_field_formats = {
+    "title": "text",
+    "year": "text",
+    "volume": "text",
+    "number": "text",
+    "series": "text",
+    "pages": "pages",
+    "edition": "ordinal",
+    "note": "raw",
+}
+_template_token_ptn = re.compile(r"\[|\]|\{([^{}]*)\}|[^\[\]{}]+")
+_first_name_abbr_ptn = re.compile(r"(\s*-?\w)[^-\s]*")
+
+
+@lru_cache(maxsize=8192)
+def _abbreviate_first_name(first_name):
+    # "Jean-Pierre Marie" -> "J.-P. M."
+    return _first_name_abbr_ptn.sub("\\1.", first_name)
+
+
+class _RenderContext:
+    """Decoded fields of an entry, shared by all the styles it is rendered in."""
+
+    __slots__ = ("bib", "fields", "authors")
+
+    def __init__(self, bib):
+        self.bib = bib
+        # (field, format) -> formatted value (None if the field is not given),
+        # filled by the field getters of the compiled templates
+        self.fields = {}
+        # decoded author names: (name,) or (first name, last name)
+        self.authors = None
+
+    def author_names(self):
+        if self.authors is None:
+            authors = []
+            for names in self.bib.tags["author"]:
+                if len(names) == 1 or names[1] == "":
+                    authors.append((get_raw_text(names[0], not_change_letter_case=True),))
+                else:
+                    authors.append((
+                        get_raw_text(names[0], not_change_letter_case=True),
+                        get_raw_text(names[1], not_change_letter_case=True),
+                    ))
+            self.authors = authors
+        return self.authors
+
+
+def _compile_author_list(spec):
+    """Compile the "author" spec of a style into a function of `_RenderContext`."""
+    name_fmt = spec["name"]
+    abbreviate = "{first_abbr}" in name_fmt
+    sep = spec["sep"]
+    last_sep = spec["last_sep"]
+    two_sep = spec.get("two_sep", last_sep)
+    others_sep = spec["others_sep"]
+    others = spec["others"]
+    end = spec["end"]
+
+    def render(ctx):
+        authors = ctx.author_names()
+        num_authors = len(authors)
+        if num_authors == 0:
+            return ""
+        has_others = authors[-1] == ("others",)
+        string = ""
+        for i, names in enumerate(authors):
+            if len(names) == 1:
+                name_str = others if names[0] == "others" else names[0]
+            else:
+                first_name, last_name = names
+                name_str = name_fmt.format(
+                    first=first_name,
+                    last=last_name,
+                    first_abbr=_abbreviate_first_name(first_name) if abbreviate else "",
+                )
+            if i == num_authors - 1:
+                if name_str.endswith(".") and end.startswith("."):
+                    # e.g. "et al." + ". "
+                    string += name_str + end[1:]
+                else:
+                    string += name_str + end
+            elif i == num_authors - 2:
+                if has_others:
+                    string += name_str + others_sep
+                else:
+                    string += name_str + (two_sep if num_authors == 2 else last_sep)
+            else:
+                string += name_str + sep
+        return string
+
+    return render
+
+
+def _compile_template(template, author_list):
+    """Compile a template of a style into a function of `_RenderContext`.
+
+    Args:
+        template (str): template of a publication type (see `citation_styles`)
+        author_list (function): compiled author list of the style
+    Returns:
+        render (function): render(ctx) -> str
+    """
+    # literal strings and getters of the fields / optional groups
+    parts = []
+    group = None
+    for match in _template_token_ptn.finditer(template):
+        token = match.group()
+        if token == "[":
+            if group is not None:
+                raise ValueError("Nested [...] in template: {}".format(template))
+            group = []
+        elif token == "]":
+            if group is None:
+                raise ValueError("Unmatched ] in template: {}".format(template))
+            parts.append(_group_getter(group))
+            group = None
+        else:
+            if match.group(1) is None:
+                part = token
+            elif match.group(1) == "author":
+                part = author_list
+            else:
+                keys, _, fmt = match.group(1).partition(":")
+                if fmt != "" and fmt not in _field_formats:
+                    raise ValueError("Unknown format {} in template: {}".format(fmt, template))
+                part = _field_getter(keys.split("|"), fmt, required=group is None)
+            (parts if group is None else group).append(part)
+    if group is not None:
+        raise ValueError("Unclosed [ in template: {}".format(template))
+
+    def render(ctx):
+        return "".join([p if p.__class__ is str else p(ctx) for p in parts])
+
+    return render
+
+
+def _group_getter(parts):
+    # optional part of a template: "" if any field in it is not given
+    def getter(ctx):
+        strings = []
+        for p in parts:
+            if p.__class__ is not str:
+                p = p(ctx)
+                if p is None:
+                    return ""
+            strings.append(p)
+        return "".join(strings)
+
+    return getter
+
+
+_not_decoded = object()
+
+
+def _expand_string(value, strings):
+    # "#name" -> value of the macro `name` if it is defined in `strings` (the
+    # macros of `predefined_string` are looked up by `get_raw_text`)
+    if strings and value.__class__ is str and value.startswith("#"):
+        return strings.get(value[1:], value)
+    return value
+
+
+def _field_getter(keys, fmt, required):
+    # the first given field in `keys`, formatted by `fmt` or its default format
+    specs = []
+    for key in keys:
+        key_fmt = fmt or _default_field_formats.get(key, "name")
+        specs.append(((key, key_fmt), key, _field_formats[key_fmt]))
+
+    def getter(ctx):
+        fields = ctx.fields
+        for cache_key, key, format_value in specs:
+            value = fields.get(cache_key, _not_decoded)
+            if value is _not_decoded:
+                value = ctx.bib.tags.get(key, None)
+                if value is not None:
+                    value = format_value(_expand_string(value, ctx.bib.strings))
+                fields[cache_key] = value
+            if value is not None:
+                return value
+        if required:
+            # KeyError if the field is not given at all, "None" if it is empty
+            return str(ctx.bib.tags[keys[-1]])
+        return None
+
+    return getter
+
+
+# Version of the rendering code, to be increased whenever a change to it alters
+# the output of existing styles (see `style_version`)
+RENDERER_VERSION = 1
+
+# style name -> {publication type: compiled render function}
+_compiled_styles = {}
+# style name -> version string
+_style_versions = {}
+
+
+def define_style(name, spec):
+    """Add or replace a citation style.
+
+    Args:
+        name (str): name of the style, e.g. "APA"
+        spec (dict): {"author": author list format,
+                      "types": {publication type(s): template}}
+            (see `citation_styles` for the format)
+    """
+    citation_styles[name] = spec
+    _compiled_styles.pop(name, None)
+    _style_versions.pop(name, None)
+
+
+def style_version(style):
+    """Return the version of a citation style.
+
+    The version changes whenever the spec of the style or `RENDERER_VERSION`
+    changes, so it can be used to invalidate previously rendered strings.
+
+    Args:
+        style (str): name of the style in `citation_styles`
+    Returns:
+        version (str): e.g. "1-3f2a9c0d41b7"
+    """
+    try:
+        return _style_versions[style]
+    except KeyError:
+        pass
+    if style not in citation_styles:
+        raise ValueError("Unsupported style: %s" % style)
+    import hashlib
+
+    digest = hashlib.sha1(repr(citation_styles[style]).encode("utf-8")).hexdigest()
+    version = "{}-{}".format(RENDERER_VERSION, digest[:12])
+    _style_versions[style] = version
+    return version
+
+
+def _compile_style(style):
+    try:
+        return _compiled_styles[style]
+    except KeyError:
+        pass
+    if style not in citation_styles:
+        raise ValueError("Unsupported style: %s" % style)
+    spec = citation_styles[style]
+    author_list = _compile_author_list(spec["author"])
+    renderers = {}
+    for pub_types, template in spec["types"].items():
+        render = _compile_template(template, author_list)
+        if isinstance(pub_types, str):
+            pub_types = (pub_types,)
+        for pub_type in pub_types:
+            renderers[pub_type] = render
+    _compiled_styles[style] = renderers
+    return renderers
+
+
+def _render(ctx, renderers):
+    try:
+        render = renderers[ctx.bib.type]
+    except KeyError:
+        raise ValueError("Unsupported publication type: %s" % ctx.bib.type)
+    return render(ctx)
+
+
+def render_many(bibs, style="IEEEtran"):
+    """Render the reference strings of many entries.
+
+    With several styles, the fields of each entry are only decoded once.
+
+    Args:
+        bibs (Iterable[BibTeXEntry]): entries to render
+        style (str or Sequence[str]): name(s) of the style(s) in `citation_styles`
+    Returns:
+        strings (List[str] or List[Tuple[str, ...]]): plain reference string of each
+            entry (a tuple with one string per style if `style` is a sequence)
+    """
+    if isinstance(style, str):
+        renderers = _compile_style(style)
+        return [_render(_RenderContext(bib), renderers) for bib in bibs]
+    renderers = [_compile_style(s) for s in style]
+    strings = []
+    for bib in bibs:
+        ctx = _RenderContext(bib)
+        strings.append(tuple(_render(ctx, r) for r in renderers))
+    return strings
+
+
 class BibTeXEntry:
     """BibTeX entry parser that converts a bib string into a manageable object,
     which can be converted back into bib string or plain text as well.
     """
 
-    def __init__(self, bibstring, indent=2, force_name=False):
+    __slots__ = ("tags", "type", "name", "indent", "strings")
+
+    # order of the fields in the bib string
+    __preferred_order = (
+        "title",
+        "author",
+        "booktitle",
+        "journal",
+        "volume",
+        "number",
+        "pages",
+        "year",
+        "institution",
+        "organization",
+        "address",
+        "publisher",
+        "note",
+    )
+
+    def __init__(self, bibstring, indent=2, force_name=False, lazy=False, strings=None):
         # tags including 'title' and 'author'
-        self.tags = {}
+        # lazy: only tokenize the fields here, and parse each of them on first
+        # access to self.tags[...] (parsing errors are raised at that point)
+        # strings: @string definitions of the file of the entry ({name: value}),
+        # used besides `predefined_string` when parsing and rendering it; a
+        # field that refers to one of them is kept as "#name"
+        self.tags = _LazyTags() if lazy else {}
         self.type = "unknown"
         self.name = "notdefined"
         self.indent = indent
+        self.strings = strings
         if len(bibstring) > 0:
-            self.__parse_string(bibstring)
-        self.__preferred_order = (
-            "title",
-            "author",
-            "booktitle",
-            "journal",
-            "volume",
-            "number",
-            "pages",
-            "year",
-            "institution",
-            "organization",
-            "address",
-            "publisher",
-            "note",
-        )
+            self.__parse_string(bibstring, lazy)
         if force_name and (
             'title' in self.tags
             and 'author' in self.tags
@@ -953,64 +1717,32 @@ class BibTeXEntry:
                     s += "{}{}={{{}}},\n".format(space, k, string)
         return s + "}"
 
-    def __parse_string(self, string):
-        string = string.strip().replace("\t", " ")
-        # remove commented parts
-        string_new, prev = "", ""
-        commented = False
-        for c in string:
-            if c == "%" and prev != "\\":
-                commented = True
-            elif not commented:
-                string_new += c
-            elif c == "\n":
-                commented = False
-                string_new += c
-
-        # add possiblly missing "\\"
-        for k, v in {
-            "\a": "\\a", "\b": "\\b", "\r": "\\r", "\t": "\\t", "\v": "\\v"
-        }.items():
-            if k in string_new:
-                string_new = string_new.replace(k, v)
-        if re.match(r'''[^\\]'|"''', string_new):
-            print(
-                "WARNING: potential special characters \\' and \\\" are not handled.\n"
-                "Please escape them manually (if applicable) by using \\\\' and \\\\\"."
-            )
-
-        # 1st line: @pub_type{entry_name,
-        assert string_new.startswith("@") and string_new.endswith("}"), string_new
-        first_line, rest = string_new[:-1].split(",", maxsplit=1)
-        # self.type: publication type
-        # self.name: entry name/label
-        self.type, self.name = re.search(r"^@(\w+)\{([^,\s]+)", first_line).groups()
-        self.type = self.type.lower()
-
-        # following lines:
+    def __parse_string(self, string, lazy=False):
+        # @pub_type{entry_name,
         #   field_name = {value},
         #   field_name=    value,
         #   field_name = "value",
-        while True:
-            rest = rest.strip()
-            if rest == "":
-                break
-            tag_name, rest = rest.split("=", maxsplit=1)
-            keyword = tag_name.strip().lower()
+        # }
+        tokens = tokenize_entry(string)
+        # self.type: publication type
+        # self.name: entry name/label
+        self.type = tokens[0].value.lower()
+        self.name = tokens[1].value
+
+        fields = []
+        for token in tokens[2:]:
+            if token.kind == "FIELD":
+                fields.append((token.value.lower(), []))
+            elif token.kind != "CONCAT":
+                fields[-1][1].append(token)
+
+        for keyword, values in fields:
             assert keyword not in self.tags, keyword
-            if keyword == "author":
-                # parse author list
-                value, rest = parse_author_list(rest)
-            elif keyword in (
-                "edition", "series", "chapter", "volume", "number", "pages", "month", "year"
-            ):
-                # parse number / number range
-                value, rest = parse_number_range(rest)
+            if lazy:
+                # keep the value tokens, which are parsed on first access
+                dict.__setitem__(self.tags, keyword, _RawField(values, self.strings))
             else:
-                # parse string
-                value, rest = parse_string(rest)
-
-            self.tags[keyword] = value
+                self.tags[keyword] = _parse_field(keyword, values, self.strings)
 
         # Normalize arXiv bibstring
         if (
@@ -1025,195 +1757,69 @@ class BibTeXEntry:
             if "primaryclass" in self.tags:
                 self.tags.pop("primaryclass")
 
+    def copy(self):
+        """Return a copy of the entry whose name and fields can be changed
+        without changing the entry. Fields that are not parsed yet stay so.
+
+        Returns:
+            entry (BibTeXEntry): the copy
+        """
+        entry = BibTeXEntry("", indent=self.indent, strings=self.strings)
+        entry.tags = type(self.tags)(dict.items(self.tags))
+        entry.type = self.type
+        entry.name = self.name
+        return entry
+
+    def expand_strings(self):
+        """Replace the references to the macros in `strings` with their values.
+
+        The bib string of the entry then no longer depends on the @string
+        definitions of its file. References to `predefined_string` are kept.
+        """
+        if self.strings:
+            for k, v in list(self.tags.items()):
+                if not (isinstance(v, str) and v.startswith("#") and v[1:] in self.strings):
+                    continue
+                value = self.strings[v[1:]]
+                if k in (
+                    "edition", "series", "chapter", "volume", "number", "pages", "month", "year"
+                ):
+                    try:
+                        value = _parse_number_token(Token("BRACED", value, 0, len(value)))
+                    except ValueError:
+                        # e.g. a volume named by a word: keep the reference
+                        continue
+                self.tags[k] = value
+        self.strings = None
+
+    def undefined_strings(self):
+        """Return the names of the macros that the fields refer to but are not defined.
+
+        Such fields are rendered as "UNDEFINED".
+
+        Returns:
+            names (Set[str]): names of the undefined macros
+        """
+        return {
+            v[1:]
+            for v in self.tags.values()
+            if isinstance(v, str)
+            and v.startswith("#")
+            and _lookup_string(v[1:], self.strings) is None
+        }
 
     def to_plaintext(self, style="IEEEtran"):
-        """Render the reference string in IEEE style.
+        """Render the reference string in the given citation style.
 
         Reference:
             https://www.bibtex.com/s/bibliography-style-ieeetran-ieeetran/
 
         Args:
-            style (str): render in IEEE style: IEEEtran or IEEEbib
+            style (str): IEEEtran, IEEEbib, APA, ACM or a style added by `define_style`
         Returns:
             string (str): plain reference string
         """
-        if style in ("IEEEbib", "IEEEtran"):
-            # APA-like style
-            string = ""
-            authors = self.tags["author"]
-            num_authors = len(authors)
-            for i, names in enumerate(authors):
-                if len(names) == 1 or names[1] == "":
-                    name_str = get_raw_text(names[0], not_change_letter_case=True)
-                    if name_str == "others":
-                        name_str = "et al."
-                else:
-                    first_name = get_raw_text(names[0], not_change_letter_case=True)
-                    last_name = get_raw_text(names[1], not_change_letter_case=True)
-                    if style == "IEEEbib":
-                        name_str = first_name + " " + last_name
-                    elif style == "IEEEtran":
-                        first_name_abbr = re.sub(
-                            r"(\s*-?\w)[^-\s]*", "\\1.", first_name
-                        )
-                        name_str = first_name_abbr + " " + last_name
-                if i == num_authors - 2:
-                    if authors[-1] == ("others",):
-                        string += name_str + " "
-                    else:
-                        string += name_str + ", and "
-                else:
-                    string += name_str + ", "
-
-            title = get_raw_text(self.tags["title"])
-            year = self.tags["year"]
-            if isinstance(year, str):
-                year = get_raw_text(year)
-
-            if self.type in ("article", "misc"):
-                pub = get_raw_text(self.tags["journal"], not_change_letter_case=True)
-                vol_num_pages = ""
-                for key in ("volume", "number", "pages"):
-                    if self.tags.get(key, None) is None:
-                        continue
-                    if key == "volume":
-                        volume = self.tags[key]
-                        if isinstance(volume, str):
-                            volume = get_raw_text(volume)
-                        vol_num_pages += "vol. {}, ".format(volume)
-                    elif key == "number":
-                        number = self.tags[key]
-                        if isinstance(number, str):
-                            number = get_raw_text(number)
-                        vol_num_pages += "no. {}, ".format(number)
-                    elif key == "pages":
-                        pages = self.tags[key]
-                        if isinstance(pages, str):
-                            pages = re.sub(r"-+", u"\u2013", get_raw_text(pages))
-                        elif isinstance(pages, tuple):
-                            pages = "{}\u2013{}".format(pages[0], pages[1])
-                        vol_num_pages += "pp. {}, ".format(pages)
-                if vol_num_pages == "":
-                    string += u"\u201c{},\u201d {}, {}".format(title, pub, year)
-                else:
-                    string += u"\u201c{},\u201d {}, {}{}".format(
-                        title, pub, vol_num_pages, year
-                    )
-            elif self.type in ("inproceedings", "incollection"):
-                pub = get_raw_text(self.tags["booktitle"], not_change_letter_case=True)
-                pages = ""
-                for key in ("pages",):
-                    if self.tags.get(key, None) is None:
-                        continue
-                    if key == "pages":
-                        pages = self.tags[key]
-                        if isinstance(pages, str):
-                            pages = "pp. " + re.sub(
-                                r"-+", u"\u2013", get_raw_text(pages)
-                            )
-                        elif isinstance(pages, tuple):
-                            pages = "pp. {}\u2013{}".format(pages[0], pages[1])
-                        else:
-                            pages = "pp. {}".format(pages)
-                if pages == "":
-                    string += u"\u201c{},\u201d in {}, {}".format(title, pub, year)
-                else:
-                    string += u"\u201c{},\u201d in {}, {}, {}".format(
-                        title, pub, year, pages
-                    )
-            elif self.type == "book":
-                pub = get_raw_text(self.tags["publisher"], not_change_letter_case=True)
-                ed_ser, vol_pages = "", ""
-                for key in ("edition", "series", "volume"):
-                    if self.tags.get(key, None) is None:
-                        continue
-                    if key == "edition":
-                        edition = self.tags[key]
-                        if isinstance(edition, str):
-                            edition = get_raw_text(edition)
-                        else:
-                            edition = str(edition)
-                        for no in number_suffix:
-                            if edition.endswith(no):
-                                edition += number_suffix[no]
-                                break
-                        else:
-                            edition += "th"
-                        ed_ser += "{} ed., ".format(edition)
-                    elif key == "series":
-                        series = self.tags[key]
-                        if isinstance(series, str):
-                            series = get_raw_text(series)
-                        ed_ser += "ser. {}, ".format(series)
-                    elif key == "volume":
-                        volume = self.tags[key]
-                        if isinstance(volume, str):
-                            volume = get_raw_text(volume)
-                        vol_pages += "vol. {}, ".format(volume)
-                    elif key == "pages":
-                        pages = self.tags[key]
-                        if isinstance(pages, str):
-                            pages = re.sub(r"-+", u"\u2013", get_raw_text(pages))
-                        elif isinstance(pages, tuple):
-                            pages = "{}\u2013{}".format(pages[0], pages[1])
-                        vol_pages += "pp. {}, ".format(pages)
-                # TODO: need to remove quotes around the title
-                if ed_ser == "":
-                    string += u"\u201c{},\u201d {}, ".format(title, pub)
-                else:
-                    string += u"\u201c{},\u201d {}{}, ".format(title, ed_ser, pub)
-                if vol_pages == "":
-                    string += f"{year}"
-                else:
-                    string += f"{vol_pages}{year}"
-            elif self.type == "manual":
-                if "organization" in self.tags:
-                    pub = get_raw_text(self.tags["organization"], not_change_letter_case=True)
-                else:
-                    pub = get_raw_text(self.tags["address"], not_change_letter_case=True)
-                if "edition" in self.tags:
-                    edition = self.tags["edition"]
-                    if isinstance(edition, str):
-                        edition = get_raw_text(edition)
-                    else:
-                        edition = str(edition)
-                    for no in number_suffix:
-                        if edition.endswith(no):
-                            edition += number_suffix[no]
-                            break
-                    else:
-                        edition += "th"
-                    ed = "{} ed., ".format(edition)
-                    string += u"\u201c{},\u201d {}{}, {}".format(title, ed, pub, year)
-                else:
-                    # TODO: need to remove quotes around the title
-                    string += u"\u201c{},\u201d {}, {}".format(title, pub, year)
-            elif self.type == "techreport":
-                if "institution" in self.tags:
-                    pub = get_raw_text(self.tags["institution"], not_change_letter_case=True)
-                else:
-                    pub = get_raw_text(self.tags["address"], not_change_letter_case=True)
-
-                if "number" in self.tags:
-                    number = self.tags["number"]
-                    if isinstance(number, str):
-                        number = get_raw_text(number)
-                    num = "Tech. Rep. {}, ".format(number)
-                else:
-                    num = "Tech. Rep., "
-                    
-                string += u"\u201c{},\u201d {}, {}{}".format(
-                    title, pub, num, year
-                )
-            else:
-                raise ValueError("Unsupported publication type: %s" % self.type)
-        else:
-            raise ValueError("Unsupported style: %s" % style)
-        if self.tags.get("note", None) is not None:
-            string += ", {}.".format(self.tags["note"])
-        else:
-            string += "."
-        return string
+        return _render(_RenderContext(self), _compile_style(style))
 
     @staticmethod
     def plaintext_to_bibtex(plaintext, default_type="article"):
@@ -1367,3 +1973,492 @@ class BibTeXEntry:
             assert len(lst) >= 3, lst
 
         return bib
+
+
+# Block found by `iter_entries` in a .bib file:
+#   type (str): lower-cased block type, e.g. "article", "string", "comment"
+#   string (str): the whole block from "@" to the closing "}"
+#   start, end (int): character offsets of the block in the file
+Span = namedtuple("Span", ["type", "string", "start", "end"])
+
+_block_head_ptn = re.compile(r"%[^\n]*|@\s*(\w+)\s*\{")
+
+
+def _iter_blocks(f, chunk_size):
+    """Find the boundaries of all @xxx{...} blocks while reading `f` in chunks."""
+    buf, base, pos = "", 0, 0
+    head, depth = None, 0
+    while True:
+        need_more = False
+        if head is None:
+            match = _block_head_ptn.search(buf, pos)
+            if match is None:
+                # keep a possibly incomplete "@xxx" at the end of the buffer
+                at = buf.rfind("@", pos)
+                pos = len(buf) if at < 0 else at
+                need_more = True
+            elif match.group(1) is None:
+                # commented line outside entries
+                if match.end() == len(buf):
+                    pos = match.start()
+                    need_more = True
+                else:
+                    pos = match.end()
+            else:
+                head, depth = (match.group(1).lower(), match.start()), 1
+                pos = match.end()
+        else:
+            match = _braced_delim_ptn.search(buf, pos)
+            if match is None:
+                pos = len(buf)
+                need_more = True
+            elif buf[match.start() - 1] == "\\":
+                pos = match.end()
+            elif match.group() == "%":
+                newline = buf.find("\n", match.start())
+                if newline < 0:
+                    pos = match.start()
+                    need_more = True
+                else:
+                    pos = newline
+            else:
+                depth += 1 if match.group() == "{" else -1
+                pos = match.end()
+                if depth == 0:
+                    yield Span(head[0], buf[head[1] : pos], base + head[1], base + pos)
+                    head = None
+
+        if need_more:
+            chunk = f.read(chunk_size)
+            if chunk == "":
+                if head is not None:
+                    raise ValueError(
+                        "Unterminated @%s block at offset %d" % (head[0], base + head[1])
+                    )
+                if match is None or pos >= len(buf):
+                    return
+                # the last commented line without a trailing newline
+                pos = len(buf)
+                continue
+            # drop the consumed part of the buffer
+            keep = pos if head is None else head[1]
+            buf = buf[keep:] + chunk
+            base += keep
+            pos -= keep
+            if head is not None:
+                head = (head[0], 0)
+
+
+def iter_entries(source, raw=False, define_strings=True, chunk_size=1 << 16, **kwargs):
+    """Parse the entries in a .bib file one at a time.
+
+    The file is read in chunks, so only the entry being parsed is kept in memory.
+
+    Args:
+        source (str or file object): path to the .bib file, or a file object
+            opened in text mode
+        raw (bool): True: yield a `Span` for every block (including @string,
+                          @preamble and @comment) without parsing it
+                    False: yield a `BibTeXEntry` for every entry
+        define_strings (bool): whether to use the @string definitions in the file
+            for the entries after them (see `BibTeXEntry.strings`; only used when
+            raw is False). They are not added to `predefined_string`.
+        chunk_size (int): number of characters read from the file at a time
+        kwargs: keyword arguments passed to `BibTeXEntry`, e.g. force_name=True
+    Yields:
+        entry (BibTeXEntry or Span): parsed entry or raw block
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "r") as f:
+            yield from iter_entries(
+                f, raw=raw, define_strings=define_strings, chunk_size=chunk_size, **kwargs
+            )
+        return
+
+    strings = None
+    for span in _iter_blocks(source, chunk_size):
+        if raw:
+            yield span
+        elif span.type == "string":
+            if define_strings:
+                name, value = parse_string_definition(span.string, strings)
+                # a new dict, so that the entries before keep their definitions
+                strings = {**(strings or {}), name: value}
+        elif span.type not in ("preamble", "comment"):
+            yield BibTeXEntry(span.string, strings=strings, **kwargs)
+
+
+# Marker in the int columns of `BibTeXCollection` for a value that is missing
+# or not a plain int (e.g. a range or a macro), which is kept with the fields
+_NO_NUMBER = -(2 ** 31)
+
+
+class BibTeXCollection:
+    """Column-oriented container of BibTeX entries.
+
+    Entries are stored field-wise instead of as `BibTeXEntry` objects: field
+    names, entry types, venues and author names are interned, fields of the
+    same shape share one tuple of field names, and year / volume / number are
+    kept in `array` columns. Filtering and sorting work on the columns, and a
+    `BibTeXEntry` is only created when an entry is accessed.
+    """
+
+    __slots__ = (
+        "types",
+        "names",
+        "venues",
+        "years",
+        "volumes",
+        "numbers",
+        "indent",
+        "strings",
+        "_keys",
+        "_values",
+        "_schemas",
+    )
+
+    # fields with int values kept in array columns
+    _number_columns = ("year", "volume", "number")
+    # string fields whose values are interned
+    _interned_fields = (
+        "booktitle",
+        "journal",
+        "publisher",
+        "organization",
+        "institution",
+        "address",
+        "school",
+    )
+
+    def __init__(self, entries=(), indent=2):
+        self.types = []
+        self.names = []
+        # journal or booktitle of each entry ("" if neither is given)
+        self.venues = []
+        self.years = array("i")
+        self.volumes = array("i")
+        self.numbers = array("i")
+        self.indent = indent
+        # @string definitions of each entry (see `BibTeXEntry.strings`)
+        self.strings = []
+        # field names and field values of each entry
+        self._keys = []
+        self._values = []
+        self._schemas = {}
+        self.extend(entries)
+
+    @classmethod
+    def from_file(cls, source, indent=2, **kwargs):
+        """Load all the entries in a .bib file.
+
+        Args:
+            source (str or file object): path to the .bib file, or a file object
+            indent (int): indent of the materialized entries
+            kwargs: keyword arguments passed to `iter_entries`
+        Returns:
+            collection (BibTeXCollection): collection of the entries
+        """
+        return cls(iter_entries(source, **kwargs), indent=indent)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = range(len(self))[index]
+        bib = BibTeXEntry("", indent=self.indent, strings=self.strings[index])
+        bib.type = self.types[index]
+        bib.name = self.names[index]
+        for k, v in zip(self._keys[index], self._values[index]):
+            if v is None and k in self._number_columns:
+                number = self.__number_column(k)[index]
+                if number != _NO_NUMBER:
+                    v = number
+            elif k == "author":
+                v = list(v)
+            bib.tags[k] = v
+        return bib
+
+    def __number_column(self, key):
+        if key == "year":
+            return self.years
+        elif key == "volume":
+            return self.volumes
+        else:
+            return self.numbers
+
+    def append(self, bib):
+        """Add an entry to the collection.
+
+        Args:
+            bib (BibTeXEntry): entry to add
+        """
+        keys = tuple(sys.intern(k) for k in bib.tags)
+        keys = self._schemas.setdefault(keys, keys)
+        values = []
+        numbers = {}
+        for k in keys:
+            v = bib.tags[k]
+            if (
+                k in self._number_columns
+                and type(v) is int
+                and _NO_NUMBER < v < 2 ** 31
+            ):
+                numbers[k] = v
+                v = None
+            elif k == "author":
+                v = tuple(
+                    tuple(sys.intern(part) for part in author) for author in v
+                )
+            elif k in self._interned_fields and isinstance(v, str):
+                v = sys.intern(v)
+            values.append(v)
+
+        venue = bib.tags.get("journal") or bib.tags.get("booktitle") or ""
+        self.types.append(sys.intern(bib.type))
+        self.names.append(bib.name)
+        self.strings.append(bib.strings)
+        self.venues.append(sys.intern(venue) if isinstance(venue, str) else "")
+        self.years.append(numbers.get("year", _NO_NUMBER))
+        self.volumes.append(numbers.get("volume", _NO_NUMBER))
+        self.numbers.append(numbers.get("number", _NO_NUMBER))
+        self._keys.append(keys)
+        self._values.append(tuple(values))
+
+    def extend(self, bibs):
+        """Add entries to the collection.
+
+        Args:
+            bibs (Iterable[BibTeXEntry]): entries to add
+        """
+        for bib in bibs:
+            self.append(bib)
+
+    def field(self, index, key, default=None):
+        """Get a field of an entry without creating the `BibTeXEntry`.
+
+        Args:
+            index (int): index of the entry
+            key (str): lower-case field name
+            default: value returned if the entry does not have the field
+        Returns:
+            value: parsed value of the field (see `BibTeXEntry.tags`)
+        """
+        keys = self._keys[index]
+        if key not in keys:
+            return default
+        v = self._values[index][keys.index(key)]
+        if v is None and key in self._number_columns:
+            number = self.__number_column(key)[index]
+            if number != _NO_NUMBER:
+                v = number
+        elif key == "author":
+            v = list(v)
+        return v
+
+    def filter(self, type=None, venue=None, year=None, indices=None):
+        """Find the entries matching all the given conditions.
+
+        Args:
+            type (str or None): entry type, e.g. "article" (case-insensitive)
+            venue (str or None): substring of the journal / booktitle
+                (case-insensitive)
+            year (int or Tuple[int, int] or None): year, or inclusive range of years
+            indices (Iterable[int] or None): only check these entries
+                (default: all entries)
+        Returns:
+            indices (List[int]): indices of the matched entries
+        """
+        if indices is None:
+            indices = range(len(self))
+        if type is not None:
+            type = type.lower()
+            types = self.types
+            indices = [i for i in indices if types[i] == type]
+        if venue is not None:
+            # match each distinct venue only once
+            venue = venue.lower()
+            matched = {v for v in set(self.venues) if venue in v.lower()}
+            venues = self.venues
+            indices = [i for i in indices if venues[i] in matched]
+        if year is not None:
+            first, last = year if isinstance(year, tuple) else (year, year)
+            years = self.years
+            indices = [i for i in indices if first <= years[i] <= last]
+        return list(indices)
+
+    def order_by(self, key="year", indices=None, reverse=False):
+        """Sort the entries by a column.
+
+        Entries without an int year / volume / number come first when sorting
+        by that column.
+
+        Args:
+            key (str): "year", "volume", "number", "type", "venue" or "name"
+            indices (Iterable[int] or None): only sort these entries
+                (default: all entries)
+            reverse (bool): sort in descending order
+        Returns:
+            indices (List[int]): indices of the entries in sorted order
+        """
+        if key in self._number_columns:
+            column = self.__number_column(key)
+        elif key == "type":
+            column = self.types
+        elif key == "venue":
+            column = self.venues
+        elif key == "name":
+            column = self.names
+        else:
+            raise ValueError("Unknown column: {}".format(key))
+        if indices is None:
+            indices = range(len(self))
+        return sorted(indices, key=column.__getitem__, reverse=reverse)
+
+
+# Per-phase profiling: while enabled, the registered functions are replaced by
+# timing wrappers, so that disabled profiling adds no overhead at all
+_profiling = False
+# phase -> [number of calls, total seconds]
+_profile_phases = {}
+_profile_counters = {}
+# (owner, attribute, phase) of each registered function
+_profile_targets = []
+# (owner, attribute, original function) of each wrapped function
+_profile_originals = []
+
+
+def _profiled(phase, func):
+    stats = _profile_phases.setdefault(phase, [0, 0.0])
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats[0] += 1
+            stats[1] += time.perf_counter() - start
+
+    return wrapper
+
+
+def _wrap_profile_target(owner, attribute, phase):
+    original = vars(owner)[attribute]
+    _profile_originals.append((owner, attribute, original))
+    setattr(owner, attribute, _profiled(phase, original))
+
+
+def add_profile_phase(owner, attribute, phase):
+    """Register a function to be timed while profiling is enabled.
+
+    Nested phases are timed independently, i.e. the time of a phase includes
+    the time of the phases called from it.
+
+    Args:
+        owner (module or class): module or class holding the function
+        attribute (str): name of the function in `owner`
+        phase (str): name of the phase reported by `get_profile`
+    """
+    _profile_targets.append((owner, attribute, phase))
+    if _profiling:
+        _wrap_profile_target(owner, attribute, phase)
+
+
+def count_event(name, n=1):
+    """Increase the counter `name` by `n` if profiling is enabled."""
+    if _profiling:
+        _profile_counters[name] = _profile_counters.get(name, 0) + n
+
+
+def enable_profiling():
+    """Start timing the registered phases and counting events.
+
+    Only calls made in the current process are recorded, through the module
+    attributes (functions imported by name before enabling are not timed).
+    """
+    global _profiling
+    if _profiling:
+        return
+    _profiling = True
+    for owner, attribute, phase in _profile_targets:
+        _wrap_profile_target(owner, attribute, phase)
+
+
+def disable_profiling():
+    """Stop profiling and restore the original functions (results are kept)."""
+    global _profiling
+    _profiling = False
+    while _profile_originals:
+        owner, attribute, original = _profile_originals.pop()
+        setattr(owner, attribute, original)
+
+
+def reset_profile():
+    """Discard the recorded timings and counters."""
+    for stats in _profile_phases.values():
+        stats[0] = 0
+        stats[1] = 0.0
+    _profile_counters.clear()
+
+
+def get_profile():
+    """Return the recorded timings and counters.
+
+    Returns:
+        profile (dict): {"phases": {phase: {"calls": int, "seconds": float}},
+                         "counters": {name: int}}
+    """
+    return {
+        "phases": {
+            phase: {"calls": calls, "seconds": seconds}
+            for phase, (calls, seconds) in _profile_phases.items()
+            if calls > 0
+        },
+        "counters": dict(_profile_counters),
+    }
+
+
+def format_profile():
+    """Format the recorded timings and counters as a table.
+
+    Returns:
+        string (str): one line per phase (slowest first) and per counter
+    """
+    profile = get_profile()
+    lines = ["{:<28}{:>10}{:>14}{:>16}".format("phase", "calls", "total (s)", "per call (us)")]
+    for phase, stats in sorted(
+        profile["phases"].items(), key=lambda kv: kv[1]["seconds"], reverse=True
+    ):
+        lines.append(
+            "{:<28}{:>10}{:>14.4f}{:>16.2f}".format(
+                phase,
+                stats["calls"],
+                stats["seconds"],
+                stats["seconds"] / stats["calls"] * 1e6,
+            )
+        )
+    if profile["counters"]:
+        lines.append("")
+        lines.append("{:<28}{:>10}".format("counter", "count"))
+        for name, n in sorted(profile["counters"].items()):
+            lines.append("{:<28}{:>10}".format(name, n))
+    return "\n".join(lines)
+
+
+_module = sys.modules[__name__]
+add_profile_phase(BibTeXEntry, "_BibTeXEntry__parse_string", "parse")
+add_profile_phase(_module, "tokenize_entry", "parse.tokenize")
+add_profile_phase(_module, "_parse_author_token", "parse.author")
+add_profile_phase(_module, "_parse_number_token", "parse.number")
+add_profile_phase(_module, "_parse_string_tokens", "parse.string")
+add_profile_phase(_module, "get_raw_text", "get_raw_text")
+add_profile_phase(_module, "raw_string_to_bib_style", "raw_string_to_bib_style")
+add_profile_phase(BibTeXEntry, "to_plaintext", "to_plaintext")
+add_profile_phase(_module, "render_many", "render_many")
+del _module
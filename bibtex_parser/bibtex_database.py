@@ -1,15 +1,580 @@
 #!/usr/bin/env python3
-import argparse
+# Modules only needed by a few code paths (e.g. asyncio for `serve`,
+# multiprocessing for `add_fromfile(workers=...)`) are imported where they are
+# used, so that a one-off command does not pay for them at startup
+# (check with benchmarks/check_startup.py).
+import bisect
+import io
+import os
 import re
 import sqlite3
+import sys
+import time
+import unicodedata
+from collections import namedtuple
+from contextlib import closing
 
 from bibtex import BibTeXEntry
+from bibtex import Span
+from bibtex import add_profile_phase
+from bibtex import count_event
+from bibtex import define_string
+from bibtex import enable_profiling
+from bibtex import format_profile
 from bibtex import get_raw_text
+from bibtex import iter_entries
+from bibtex import parse_string_definition
+from bibtex import predefined_string
 from bibtex import remove_brace_pair
+from bibtex import render_many
+from bibtex import style_version
+
+
+_record_keys = (
+    "type",
+    "name",
+    "bibstring",
+    "citestring",
+    "title",
+    "author",
+    "booktitle",
+    "journal",
+    "volume",
+    "number",
+    "pages",
+    "year",
+    "organization",
+    "publisher",
+)
+
+
+def _proc_bib_dict(dic, strings=None):
+    # strings: @string definitions of the file of the entry (see `BibTeXEntry.strings`)
+    ret = {}
+    for k, v in dic.items():
+        if v is None or (hasattr(v, "__len__") and len(v) == 0):
+            continue
+        if strings and isinstance(v, str) and v.startswith("#"):
+            v = strings.get(v[1:], v)
+        if isinstance(v, dict):
+            ret[k] = {k2: _proc_bib_dict(v2, strings) for k2, v2 in v.items()}
+        elif k in ("title", "journal", "booktitle") and isinstance(v, str):
+            ret[k] = get_raw_text(v, not_change_letter_case=True)
+        elif isinstance(v, str):
+            ret[k] = remove_brace_pair(v)
+        elif k == "author" and isinstance(v, (list, tuple)):
+            ret[k] = remove_brace_pair(
+                re.sub(
+                    r', others$', ' et al.',
+                    ", ".join([
+                        get_raw_text(" ".join(each), not_change_letter_case=True)
+                        for each in v
+                    ]),
+                )
+            )
+        elif k == "pages" and isinstance(v, (list, tuple)):
+            ret[k] = remove_brace_pair(u"\u2013".join([str(vv) for vv in v]))
+        else:
+            ret[k] = v
+    return ret
+
+
+def _iter_bibstrings(f):
+    # Yields (bibstring, strings) of the entries in `f`, where strings are the
+    # @string definitions before the entry (see `BibTeXEntry.strings`).
+    strings = None
+    for span in iter_entries(f, raw=True):
+        if span.type == "string":
+            name, value = parse_string_definition(span.string, strings)
+            # a new dict, so that the entries before keep their definitions
+            strings = {**(strings or {}), name: value}
+        elif span.type not in ("preamble", "comment"):
+            yield span.string, strings
+
+
+def _prepare_bibtex(args):
+    """Parse a bib string and render everything needed for inserting it.
+
+    This also runs in the worker processes of `BibTeXDatabase.add_fromfile`.
+    """
+    bibstring, strings, style = args
+    try:
+        bib = BibTeXEntry(bibstring, force_name=True, strings=strings)
+        # the stored bib string must not refer to the macros of the file
+        bib.expand_strings()
+        return bib, _proc_bib_dict(bib.tags), bib.to_plaintext(style=style)
+    except:
+        print(bibstring)
+        raise
+
+
+def _init_worker(strings):
+    # strings defined by `define_string` in the parent process
+    for name, value in strings.items():
+        define_string(name, value)
+
+
+def _iter_hashed_blocks(spans, style):
+    """Yield (span, hash, strings) for the raw blocks of a .bib file.
+
+    The hash of an entry also covers the style and the @string definitions
+    before it, which change the rendered record. The hash of @string,
+    @preamble and @comment blocks is None. `strings` are the @string
+    definitions before the block (see `BibTeXEntry.strings`).
+    """
+    import hashlib
+
+    macros = hashlib.sha1(style.encode("utf-8"))
+    strings = None
+    for span in spans:
+        if span.type == "string":
+            name, value = parse_string_definition(span.string, strings)
+            strings = {**(strings or {}), name: value}
+            macros.update(span.string.encode("utf-8"))
+            yield span, None, strings
+        elif span.type in ("preamble", "comment"):
+            yield span, None, strings
+        else:
+            h = macros.copy()
+            h.update(span.string.encode("utf-8"))
+            yield span, h.hexdigest(), strings
+
+
+def _common_affixes(old, new):
+    """Return the lengths of the common prefix and suffix of two strings.
+
+    The prefix and the suffix do not overlap in either string.
+    """
+    # binary search, comparing only the part after the known common prefix
+    lo, hi = 0, min(len(old), len(new))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[lo:mid] == new[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    prefix = lo
+    lo, hi = 0, min(len(old), len(new)) - prefix
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[len(old) - mid : len(old) - lo] == new[len(new) - mid : len(new) - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return prefix, lo
+
+
+def _sync_message(bibfile, results, count_update, count_vanished, delete, count_unchanged):
+    count_insert = sum(ret.startswith("Inserted with UID=") for ret in results)
+    return (
+        f"Synced {bibfile}: {count_insert} inserted, {count_update} updated, "
+        f"{count_vanished} {'deleted' if delete else 'untracked'}, "
+        f"{len(results) - count_insert} duplicate(s), {count_unchanged} unchanged."
+    )
+
+
+# Changes of a watched .bib file found by rescanning its modified region:
+# removed: hashes of the entries no longer in the file
+# added: (span, hash, strings) of the entries in the rescanned region
+# offset, delta: the entries from `offset` (in the old file) on moved by
+#     `delta` characters
+# first: (span, hash) of the first occurrence of each entry removed from or
+#     added to the region that is still in the file
+# count: number of entries in the file
+_FileDiff = namedtuple("_FileDiff", ["removed", "added", "offset", "delta", "first", "count"])
+
+
+class _WatchedFile:
+    # A .bib file polled by `BibTeXDatabase.watch`. The blocks found by the
+    # last scan are kept, so that only the modified region of the file is
+    # scanned again.
+
+    def __init__(self, path, style):
+        self.path = path
+        self.style = style
+        self.signature = None
+        self.text = None
+        self.blocks = []  # (span, hash, strings) of all blocks, see `_iter_hashed_blocks`
+        self.diff = None  # `_FileDiff`, or None after a full scan
+        self.error = None  # last warning, printed only once
+
+    def entries(self):
+        return [block for block in self.blocks if block[1] is not None]
+
+    def poll(self):
+        # Returns True if the file changed since the last call, and sets
+        # `diff` to the changes unless the whole file had to be scanned.
+        stat = os.stat(self.path)
+        signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if signature == self.signature:
+            return False
+        # a file that fails to scan is only scanned again once it changes
+        self.signature = signature
+        with open(self.path, "r") as f:
+            text = f.read()
+        if text == self.text:
+            return False
+        self.diff = None
+        if self.text is not None:
+            self.__rescan(text)
+        if self.diff is None:
+            count_event("watch.full_scans")
+            self.blocks = list(
+                _iter_hashed_blocks(iter_entries(io.StringIO(text), raw=True), self.style)
+            )
+        self.text = text
+        return True
+
+    def reset(self):
+        # scan the whole file at the next change
+        self.text = None
+
+    def __rescan(self, text):
+        # Scan the region between the last block before the first modified
+        # character and the first block after it that starts at the same
+        # position as before (shifted by the change in length).
+        # Nothing is done if the region contains @string definitions, which
+        # change the hashes of all following entries.
+        prefix, suffix = _common_affixes(self.text, text)
+        delta = len(text) - len(self.text)
+        ends = [block[0].end for block in self.blocks]
+        starts = [block[0].start for block in self.blocks]
+        first = bisect.bisect_right(ends, prefix)
+        scan_from = ends[first - 1] if first > 0 else 0
+        tail = {
+            starts[i] + delta: i
+            for i in range(bisect.bisect_left(starts, len(self.text) - suffix), len(starts))
+        }
+        scanned = []
+        resync = len(self.blocks)
+        for span in iter_entries(io.StringIO(text[scan_from:]), raw=True):
+            span = Span(span.type, span.string, span.start + scan_from, span.end + scan_from)
+            if span.start >= len(text) - suffix and span.start in tail:
+                resync = tail[span.start]
+                break
+            scanned.append(span)
+        old = self.blocks[first:resync]
+        if any(span.type == "string" for span in scanned) or any(
+            block[0].type == "string" for block in old
+        ):
+            return
+        count_event("watch.scanned_blocks", len(scanned))
+        strings = [block[0] for block in self.blocks[:first] if block[0].type == "string"]
+        hashed = list(_iter_hashed_blocks(strings + scanned, self.style))[len(strings) :]
+        offset = starts[resync] if resync < len(starts) else len(self.text)
+        self.blocks = (
+            self.blocks[:first]
+            + hashed
+            + [
+                (Span(span.type, span.string, span.start + delta, span.end + delta), digest, strings)
+                for span, digest, strings in self.blocks[resync:]
+            ]
+        )
+        # entries removed from the region may still be duplicated elsewhere,
+        # and the offsets of an entry are those of its first occurrence
+        touched = {digest for _, digest, _ in old + hashed if digest is not None}
+        first = {}
+        count = 0
+        for span, digest, _ in self.blocks:
+            if digest is not None:
+                count += 1
+                if digest in touched and digest not in first:
+                    first[digest] = span
+        self.diff = _FileDiff(
+            removed=touched - first.keys(),
+            added=[block for block in hashed if block[1] is not None],
+            offset=offset,
+            delta=delta,
+            first=[(span, digest) for digest, span in first.items()],
+            count=count,
+        )
+
+
+_fulltext_keys = ("title", "author", "booktitle", "journal", "citestring")
+
+
+# near-duplicate detection: records sharing any blocking key are compared,
+# and match if they share a DOI / arXiv id, or if their titles are similar
+# enough and their years do not differ
+_dedup_threshold = 0.9
+_stop_words = frozenset(
+    ("a", "an", "and", "as", "at", "by", "for", "from", "in", "into", "of", "on",
+     "or", "the", "to", "via", "with")
+)
+_doi_ptn = re.compile(r"(?:https?://(?:dx\.)?doi\.org/|doi:\s*)?(10\.\d{4,9}/\S+)", re.I)
+_arxiv_id_ptn = re.compile(r"(\d{4}\.\d{4,5}|[a-z][a-z.\-]+/\d{7})(?:v\d+)?", re.I)
+
+
+# letters (case-folded) that have no decomposition into an ASCII letter and accents
+_transliteration = {
+    "æ": "ae", "œ": "oe", "ø": "o", "ł": "l", "đ": "d", "ð": "d", "þ": "th",
+    "ı": "i", "ħ": "h", "ŧ": "t", "ŋ": "ng", "ĸ": "k", "ŀ": "l", "ƒ": "f",
+}
+_transliteration_ptn = re.compile("|".join(_transliteration))
+
+
+def _normalize_words(string):
+    # lower-case ASCII words, without accents and punctuation, e.g. "Østergaard"
+    # => ["ostergaard"]; a string without any of them (e.g. a CJK name) gives
+    # its case-folded words instead
+    if string.isascii():
+        return re.findall(r"[a-z0-9]+", string.lower())
+    string = string.casefold()
+    folded = _transliteration_ptn.sub(lambda m: _transliteration[m.group()], string)
+    folded = unicodedata.normalize("NFKD", folded)
+    words = re.findall(r"[a-z0-9]+", folded.encode("ascii", "ignore").decode("ascii"))
+    if len(words) == 0:
+        words = "".join(
+            c if c.isalnum() or unicodedata.category(c)[0] == "M" else " "
+            for c in unicodedata.normalize("NFC", string)
+        ).split()
+    return words
+
+
+def _title_fingerprint(title):
+    if not isinstance(title, str):
+        return ""
+    return " ".join(w for w in _normalize_words(title) if w not in _stop_words)
+
+
+def _title_key(title):
+    # (fingerprint, set of its words) compared by `_match`
+    fingerprint = _title_fingerprint(title)
+    return fingerprint, frozenset(fingerprint.split())
+
+
+def _dedup_keys(bib, title, year):
+    """Return the blocking keys of a record for near-duplicate detection.
+
+    Args:
+        bib (BibTeXEntry): the entry
+        title (str): plain-text title (as stored in the database)
+        year (int or str): year (as stored in the database)
+    Returns:
+        keys (List[str]): "t:" title fingerprint, "p:" its first four words,
+                          "a:" last name of the first author and year,
+                          "d:" DOI, "x:" arXiv id
+    """
+    keys = []
+    fingerprint = _title_fingerprint(title)
+    if fingerprint:
+        keys.append("t:" + fingerprint)
+        words = fingerprint.split()
+        if len(words) > 4:
+            keys.append("p:" + " ".join(words[:4]))
+    authors = bib.tags.get("author", None)
+    if year is not None and isinstance(authors, (list, tuple)) and len(authors) > 0:
+        last = "".join(_normalize_words(get_raw_text(authors[0][-1], not_change_letter_case=True)))
+        if last and last != "others":
+            keys.append(f"a:{last}:{year}")
+    for k in ("doi", "url"):
+        value = bib.tags.get(k, None)
+        if isinstance(value, str):
+            match = _doi_ptn.search(re.sub(r"[{}]", "", value))
+            if match is not None:
+                keys.append("d:" + match.group(1).rstrip(".").lower())
+                break
+    for k in ("eprint", "journal", "note", "url", "howpublished"):
+        value = bib.tags.get(k, None)
+        if isinstance(value, str) and (k == "eprint" or "arxiv" in value.lower()):
+            match = _arxiv_id_ptn.search(value)
+            if match is not None:
+                keys.append("x:" + match.group(1).lower())
+                break
+    return keys
+
+
+def _author_keys(first, last):
+    # (folded last name, folded first name, first initial) of an author
+    last_key = " ".join(_normalize_words(last))
+    first_key = " ".join(_normalize_words(first))
+    return last_key, first_key, first_key[:1]
+
+
+def _iter_authors(bib):
+    # Yields (position, first, last) of the authors of `bib` as plain text,
+    # starting at 1 and skipping "others".
+    authors = bib.tags.get("author", None)
+    if not isinstance(authors, (list, tuple)):
+        return
+    for position, name in enumerate(authors, 1):
+        if len(name) == 0 or (len(name) == 1 and name[0] == "others"):
+            continue
+        last = get_raw_text(name[-1], not_change_letter_case=True)
+        first = ""
+        if len(name) > 1:
+            first = get_raw_text(" ".join(name[:-1]), not_change_letter_case=True)
+        yield position, first, last
+
+
+def _first_names_match(first_key, other_first_key):
+    # whether two folded first names can be the same person, e.g. "e" (E.) and
+    # "emmanuel", or "j p" (J.-P.) and "jean pierre"
+    for word, other_word in zip(first_key.split(), other_first_key.split()):
+        if not (word.startswith(other_word) or other_word.startswith(word)):
+            return False
+    return True
+
+
+def _match(kinds, title, year, other_title, other_year, threshold):
+    # kinds: kinds of the blocking keys shared by the two records
+    # title, other_title: see `_title_key`
+    # Returns (score, reason) if the records are duplicates, and None otherwise.
+    if "d" in kinds:
+        return 2.0, "same DOI"
+    if "x" in kinds:
+        return 2.0, "same arXiv id"
+    (fingerprint, words), (other_fingerprint, other_words) = title, other_title
+    if not fingerprint or not other_fingerprint:
+        return None
+    if year is not None and other_year is not None and str(year) != str(other_year):
+        return None
+    # titles this similar share most of their words
+    if 2 * len(words & other_words) < len(words | other_words):
+        return None
+    from difflib import SequenceMatcher
+
+    matcher = SequenceMatcher(None, fingerprint, other_fingerprint, autojunk=False)
+    if matcher.real_quick_ratio() < threshold or matcher.quick_ratio() < threshold:
+        return None
+    ratio = matcher.ratio()
+    if ratio < threshold:
+        return None
+    return ratio, f"similar title ({ratio:.2f})"
+
+
+def _match_conditions(match, keys, kwargs):
+    # Returns the SQL conditions on the columns `keys` and their parameters.
+    # match="exact" and match="prefix" can use the index on `name`
+    if match == "exact":
+        conditions = [f"{k} = ?" for k in keys]
+        values = tuple(kwargs[k] for k in keys)
+    elif match == "prefix":
+        # case-sensitive, unlike LIKE
+        conditions = [f"{k} GLOB ?" for k in keys]
+        values = tuple(
+            re.sub(r"([*?\[])", "[\\1]", str(kwargs[k])) + "*" for k in keys
+        )
+    elif match == "substring":
+        conditions = [f"{k} LIKE '%'||?||'%'" for k in keys]
+        values = tuple(kwargs[k] for k in keys)
+    else:
+        raise ValueError(f"Unsupported match: {match}")
+    return conditions, values
+
+
+def _search_filters(kwargs):
+    # {column: value} of the non-empty search terms, with lists, tuples and
+    # dicts matched by their string
+    return {
+        k: str(v) if isinstance(v, (list, tuple, dict)) else v
+        for k, v in kwargs.items()
+        if v is not None and (not hasattr(v, "__len__") or len(v) > 0)
+    }
+
+
+def _iter_rows(cursor, batch_size):
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if len(rows) == 0:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+
+# columns of the records in the database
+_columns = ("uid",) + _record_keys
+# columns of each record in `BibTeXDatabase.export(fmt="jsonl")`
+_export_keys = ("uid",) + tuple(k for k in _record_keys if k not in ("bibstring", "citestring"))
+
+
+# version of the tables, indices and triggers created by BibTeXDatabase (stored
+# as `PRAGMA user_version`); increase it when changing them, so that existing
+# databases are upgraded when opened
+_schema_version = 3
+# the keys in the dedup and author tables of older schema versions were folded
+# differently (see `_normalize_words`) and are rebuilt when upgrading
+_keys_version = 3
+
+
+class _ConnectionPool:
+    # sqlite3 connections to a database file: a single connection, or one per
+    # thread if `concurrent` (see `BibTeXDatabase`)
+    def __init__(self, dbfile, concurrent=False, timeout=5.0):
+        self.dbfile = dbfile
+        self.concurrent = concurrent
+        self.timeout = timeout
+        self.closed = False
+        self.__connections = {}  # thread -> (connection, cursor)
+        if not concurrent:
+            self.__single = self.__connect()
+        else:
+            import threading
+
+            self.__lock = threading.Lock()
+            self.__current_thread = threading.current_thread
+
+    def __connect(self):
+        if not self.concurrent:
+            conn = sqlite3.connect(self.dbfile, timeout=self.timeout)
+        else:
+            # closed by the thread calling `close`, and possibly handed over to
+            # another thread when its thread finishes
+            conn = sqlite3.connect(self.dbfile, timeout=self.timeout, check_same_thread=False)
+            # still consistent after a crash in WAL mode; only the last
+            # transactions may be lost on power failure
+            conn.execute("PRAGMA synchronous = NORMAL")
+        count_event("db.connections")
+        return conn, conn.cursor()
+
+    def get(self):
+        # Returns (connection, cursor) of the calling thread.
+        if self.closed:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        if not self.concurrent:
+            return self.__single
+        thread = self.__current_thread()
+        item = self.__connections.get(thread, None)
+        if item is not None:
+            return item
+        with self.__lock:
+            # reuse the connection of a finished thread, discarding the
+            # changes it did not commit
+            finished = next((t for t in self.__connections if not t.is_alive()), None)
+            if finished is not None:
+                item = self.__connections.pop(finished)
+                if item[0].in_transaction:
+                    item[0].rollback()
+            else:
+                item = self.__connect()
+            self.__connections[thread] = item
+        return item
+
+    def __len__(self):
+        return 1 if not self.concurrent else len(self.__connections)
+
+    def close(self):
+        if not self.concurrent:
+            items = [self.__single]
+        else:
+            with self.__lock:
+                items = list(self.__connections.values())
+                self.__connections.clear()
+        self.closed = True
+        for conn, cursor in items:
+            cursor.close()
+            conn.close()
 
 
 class BibTeXDatabase:
-    def __init__(self, dbfile="mybib.db", dbname="bibtex"):
+    # concurrent: use WAL mode and a connection per thread, so that any number
+    #             of threads (and processes) can read the database while one
+    #             of them writes; writers wait for each other up to `timeout`
+    #             seconds. Every thread commits its own changes, and `close`
+    #             discards the uncommitted changes of the other threads.
+    def __init__(self, dbfile="mybib.db", dbname="bibtex", fulltext=False, concurrent=False, timeout=5.0):
         columns = [
             # meta info
             ("uid", "INTEGER PRIMARY KEY AUTOINCREMENT"),
@@ -32,10 +597,49 @@ class BibTeXDatabase:
         ]
         self.name = dbname
         self.__dbfile = dbfile
-        self.__conn = sqlite3.connect(dbfile)
-        self.__cursor = self.__conn.cursor()
+        self.concurrent = concurrent
+        self.__timeout = timeout
+        self.__pool = _ConnectionPool(dbfile, concurrent, timeout)
         self.connected = True
+        if concurrent:
+            # persistent: later connections of any process also use WAL
+            self.__cursor.execute("PRAGMA journal_mode = WAL")
+
+        # the schema is only (re)created if the tables of `dbname` are missing
+        # or were created by an older `_schema_version`
+        tables = (
+            dbname,
+            f"{dbname}_citations",
+            f"{dbname}_sources",
+            f"{dbname}_dedup",
+            f"{dbname}_authors",
+            f"{dbname}_entry_authors",
+        )
+        self.__cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN "
+            f"({', '.join(['?' for _ in tables])}, ?)",
+            tables + (f"{dbname}_fts",),
+        )
+        existing = {name for name, in self.__cursor.fetchall()}
+        self.__cursor.execute("PRAGMA user_version")
+        version = self.__cursor.fetchone()[0]
+        if version < _schema_version or not existing.issuperset(tables):
+            self.__create_schema(
+                columns,
+                f"{dbname}_dedup" in existing and version >= _keys_version,
+                f"{dbname}_entry_authors" in existing and version >= _keys_version,
+            )
+            self.__cursor.execute(f"PRAGMA user_version = {max(version, _schema_version)}")
+            self.__conn.commit()
 
+        # full-text index (FTS5) over `_fulltext_keys`, which is kept in sync with
+        # the bibtex table by triggers once created
+        self.fulltext = f"{dbname}_fts" in existing
+        if fulltext and not self.fulltext:
+            self.create_fulltext_index()
+
+    def __create_schema(self, columns, dedup_indexed, authors_indexed):
+        dbname = self.name
         self.__cursor.execute(
             f'CREATE TABLE IF NOT EXISTS {dbname} '
             '({})'.format(
@@ -43,44 +647,148 @@ class BibTeXDatabase:
             )
         )
 
+        # rendered citation strings of any style, keyed by the version of the
+        # style (see `bibtex.style_version`) so that stale strings are never
+        # returned; rows are dropped by triggers when the bibstring changes
+        cache = f"{dbname}_citations"
+        self.__cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {cache} ("
+            "uid INTEGER NOT NULL, style TEXT NOT NULL, version TEXT NOT NULL, "
+            "citestring TEXT, PRIMARY KEY (uid, style, version)) WITHOUT ROWID"
+        )
+        self.__cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {cache}_update "
+            f"AFTER UPDATE OF bibstring ON {dbname} "
+            "WHEN old.bibstring IS NOT new.bibstring "
+            f"BEGIN DELETE FROM {cache} WHERE uid = old.uid; END"
+        )
+        self.__cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {cache}_delete AFTER DELETE ON {dbname} "
+            f"BEGIN DELETE FROM {cache} WHERE uid = old.uid; END"
+        )
+
+        # origin of the records synced from .bib files (see `sync_fromfile`):
+        # absolute path, content hash and character offsets of each entry
+        sources = f"{dbname}_sources"
+        self.__cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {sources} ("
+            "source TEXT NOT NULL, hash TEXT NOT NULL, uid INTEGER NOT NULL, "
+            "start INTEGER, end INTEGER, PRIMARY KEY (source, hash)) WITHOUT ROWID"
+        )
+        self.__cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {sources}_uid ON {sources} (uid)"
+        )
+        self.__cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {sources}_delete AFTER DELETE ON {dbname} "
+            f"BEGIN DELETE FROM {sources} WHERE uid = old.uid; END"
+        )
+
+        # blocking keys for near-duplicate detection (see `_dedup_keys`)
+        dedup = f"{dbname}_dedup"
+        self.__cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {dedup} ("
+            "key TEXT NOT NULL, uid INTEGER NOT NULL, PRIMARY KEY (key, uid)) WITHOUT ROWID"
+        )
+        self.__cursor.execute(f"CREATE INDEX IF NOT EXISTS {dedup}_uid ON {dedup} (uid)")
+        self.__cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {dedup}_delete AFTER DELETE ON {dbname} "
+            f"BEGIN DELETE FROM {dedup} WHERE uid = old.uid; END"
+        )
+        if not dedup_indexed:
+            self.build_dedup_index()
+
+        # normalized authors (see `_author_keys`) and the authors of each record
+        # by position (starting at 1), for `search_by_author` and `coauthors`
+        authors = f"{dbname}_authors"
+        entry_authors = f"{dbname}_entry_authors"
+        self.__cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {authors} ("
+            "aid INTEGER PRIMARY KEY, last TEXT NOT NULL, first TEXT NOT NULL, "
+            "last_key TEXT NOT NULL, first_key TEXT NOT NULL, initial TEXT NOT NULL, "
+            "UNIQUE (last, first))"
+        )
+        self.__cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {authors}_key ON {authors} (last_key, initial)"
+        )
+        self.__cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {entry_authors} ("
+            "uid INTEGER NOT NULL, position INTEGER NOT NULL, aid INTEGER NOT NULL, "
+            "PRIMARY KEY (uid, position)) WITHOUT ROWID"
+        )
+        self.__cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {entry_authors}_aid ON {entry_authors} (aid, uid)"
+        )
+        self.__cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {entry_authors}_delete AFTER DELETE ON {dbname} "
+            f"BEGIN DELETE FROM {entry_authors} WHERE uid = old.uid; END"
+        )
+        if not authors_indexed:
+            self.build_author_index()
+
+    # connection and cursor of the calling thread
+    @property
+    def __conn(self):
+        return self.__pool.get()[0]
+
+    @property
+    def __cursor(self):
+        return self.__pool.get()[1]
+
+    def create_fulltext_index(self):
+        fts = f"{self.name}_fts"
+        keys = ", ".join(_fulltext_keys)
+        new_keys = ", ".join(f"new.{k}" for k in _fulltext_keys)
+        old_keys = ", ".join(f"old.{k}" for k in _fulltext_keys)
+        self.__cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"{keys}, content='{self.name}', content_rowid='uid', "
+            "tokenize='unicode61 remove_diacritics 2')"
+        )
+        self.__cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {self.name} "
+            f"BEGIN INSERT INTO {fts} (rowid, {keys}) VALUES (new.uid, {new_keys}); END"
+        )
+        self.__cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {self.name} "
+            f"BEGIN INSERT INTO {fts} ({fts}, rowid, {keys}) "
+            f"VALUES ('delete', old.uid, {old_keys}); END"
+        )
+        self.__cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE ON {self.name} "
+            f"BEGIN INSERT INTO {fts} ({fts}, rowid, {keys}) "
+            f"VALUES ('delete', old.uid, {old_keys}); "
+            f"INSERT INTO {fts} (rowid, {keys}) VALUES (new.uid, {new_keys}); END"
+        )
+        # index the existing records
+        self.__cursor.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+        self.fulltext = True
+
+    @property
+    def in_transaction(self):
+        # whether the connection of the calling thread has uncommitted changes
+        return self.__conn.in_transaction
+
     def commit(self):
         self.__conn.commit()
 
+    def rollback(self):
+        self.__conn.rollback()
+
     def close(self, do_commit=False):
         if do_commit:
             self.commit()
-        self.__cursor.close()
-        self.__conn.close()
+        self.__pool.close()
         self.connected = False
 
     def reconnect(self):
         if not self.connected:
-            self.__conn = sqlite3.connect(self.__dbfile)
-            self.__cursor = self.__conn.cursor()
+            self.__pool = _ConnectionPool(self.__dbfile, self.concurrent, self.__timeout)
             self.connected = True
         else:
             print("Already Connected. Nothing to do.")
 
-    def operate(self, option, **kwargs):
-        keys = tuple(
-            k for k in [
-                "type",
-                "name",
-                "bibstring",
-                "citestring",
-                "title",
-                "author",
-                "booktitle",
-                "journal",
-                "volume",
-                "number",
-                "pages",
-                "year",
-                "organization",
-                "publisher",
-            ]
-            if kwargs.get(k, None) is not None
-        )
+    def operate(self, option, match="substring", **kwargs):
+        keys = tuple(k for k in _record_keys if kwargs.get(k, None) is not None)
         if option == "insert":
             self.__cursor.execute(
                 f"INSERT INTO {self.name} ({', '.join(keys)}) VALUES "
@@ -101,86 +809,344 @@ class BibTeXDatabase:
                 tuple(kwargs[k] for k in keys)
             )
         elif option == "select":
+            conditions, values = _match_conditions(match, keys, kwargs)
             self.__cursor.execute(
-                f"SELECT * FROM {self.name} WHERE " +
-                # " AND ".join([f"{k} = ?" for k in keys]),
-                " AND ".join([f"{k} LIKE '%'||?||'%'" for k in keys]),
-                tuple(kwargs[k] for k in keys)
+                f"SELECT * FROM {self.name} WHERE " + " AND ".join(conditions),
+                values,
             )
         else:
             raise ValueError(f"Unsupported option: {option}")
 
-    def __proc_bib_dict(self, dic):
-        ret = {}
-        for k, v in dic.items():
-            if v is None or (hasattr(v, "__len__") and len(v) == 0):
-                continue
-            if isinstance(v, dict):
-                ret[k] = {k2: self.__proc_bib_dict(v2) for k2, v2 in v.items()}
-            elif k in ("title", "journal", "booktitle") and isinstance(v, str):
-                ret[k] = get_raw_text(v, not_change_letter_case=True)
-            elif isinstance(v, str):
-                ret[k] = remove_brace_pair(v)
-            elif k == "author" and isinstance(v, (list, tuple)):
-                ret[k] = remove_brace_pair(
-                    re.sub(
-                        r', others$', ' et al.',
-                        ", ".join([
-                            get_raw_text(" ".join(each), not_change_letter_case=True)
-                            for each in v
-                        ]),
-                    )
-                )
-            elif k == "pages" and isinstance(v, (list, tuple)):
-                ret[k] = remove_brace_pair(u"\u2013".join([str(vv) for vv in v]))
-            else:
-                ret[k] = v
-        return ret
-
-    def add_bibtex(self, bibtex, name=None, style="IEEEtran"):
-        bib = bibtex if isinstance(bibtex, BibTeXEntry) else BibTeXEntry(bibtex, force_name=True)
+    def add_bibtex(self, bibtex, name=None, style="IEEEtran", dedup=None):
+        # dedup: None: only records with the same name are detected as duplicates
+        #        "report": also report the near-duplicates of the inserted record
+        #        "merge": add the missing fields of the entry to its best
+        #                 near-duplicate instead of inserting it
+        # a BibTeXEntry is copied, as it is renamed and its macros expanded
+        bib = bibtex.copy() if isinstance(bibtex, BibTeXEntry) else BibTeXEntry(bibtex, force_name=True)
         if name is not None:
             bib.name = name
-        tags = self.__proc_bib_dict(bib.tags)
+        bib.expand_strings()
+        item = (bib, _proc_bib_dict(bib.tags), bib.to_plaintext(style=style))
+        if dedup is not None:
+            return self.__add_deduped(*item, style=style, dedup=dedup)
+        return self.__insert_bib(*item, style=style)
+
+    def __insert_bib(self, bib, tags, citestring, style=None):
         try:
             self.operate(
                 "insert",
                 type=bib.type,
                 name=bib.name,
                 bibstring=str(bib),
-                citestring=bib.to_plaintext(style=style),
+                citestring=citestring,
                 **tags,
             )
         except sqlite3.IntegrityError:
-            bib_existing = BibTeXEntry(self.search_bibtex(name=bib.name)[0][3])
+            bib_existing = BibTeXEntry(self.get_by_name(bib.name)[3])
             if (
                 bib.tags.get("journal", "") != bib_existing.tags.get("journal", "")
                 or bib.tags.get("booktitle", "") != bib_existing.tags.get("booktitle", "")
             ):
-                idx = 1
-                retry = True
-                while retry:
-                    idx += 1
-                    name = bib.name + f"_{idx}"
-                    retry = len(self.search_bibtex(name=name)) > 0
-                return self.add_bibtex(bibtex, name=name, style=style)
+                bib.name = self.__free_name(bib.name)
+                count_event("db.renamed")
+                return self.__insert_bib(bib, tags, citestring, style=style)
             else:
-                return f"Record already exists. Nothing to do."
-        return f"Inserted with UID={self.__cursor.lastrowid}."
+                count_event("db.duplicates")
+                return "Record already exists. Nothing to do."
+        uid = self.__cursor.lastrowid
+        if style is not None:
+            self.__cache_citestrings([(uid, bib, citestring)], style)
+        self.__index_dedup_keys([(uid, bib, tags)])
+        self.__index_authors([(uid, bib)])
+        count_event("db.inserted")
+        return f"Inserted with UID={uid}."
+
+    def __free_name(self, name, taken=()):
+        # the first of name_2, name_3, ... that is neither in the database nor
+        # in `taken`
+        self.__cursor.execute(
+            f"SELECT name FROM {self.name} WHERE name GLOB ?",
+            (re.sub(r"([*?\[])", "[\\1]", name) + "_*",),
+        )
+        existing = {n for n, in self.__cursor.fetchall()}
+        idx = 2
+        while f"{name}_{idx}" in existing or f"{name}_{idx}" in taken:
+            idx += 1
+        count_event("db.rename_retries", idx - 1)
+        return f"{name}_{idx}"
+
+    def __add_deduped(self, bib, tags, citestring, style, dedup):
+        matches = self.__find_duplicates(bib, tags.get("title", None), tags.get("year", None))
+        if dedup == "merge" and len(matches) > 0:
+            uid, name, reason = matches[0]
+            self.__cursor.execute(f"SELECT bibstring FROM {self.name} WHERE uid = ?", (uid,))
+            bib_existing = BibTeXEntry(self.__cursor.fetchone()[0])
+            missing = [k for k in bib.tags if k not in bib_existing.tags]
+            if len(missing) > 0:
+                for k in missing:
+                    bib_existing.tags[k] = bib.tags[k]
+                self.__update_bib(
+                    uid,
+                    bib_existing,
+                    _proc_bib_dict(bib_existing.tags),
+                    bib_existing.to_plaintext(style=style),
+                    style,
+                )
+            count_event("db.merged")
+            return f"Merged {len(missing)} field(s) into record '{name}' with UID={uid} ({reason})."
+        elif dedup not in ("report", "merge"):
+            raise ValueError(f"Unsupported dedup: {dedup}")
+        ret = self.__insert_bib(bib, tags, citestring, style=style)
+        # the record with the (possibly renamed) name of the entry is the
+        # inserted or already existing one
+        reports = [
+            f"Possible duplicate of '{name}' with UID={uid} ({reason})."
+            for uid, name, reason in matches
+            if name != bib.name
+        ]
+        return "\n".join([ret] + reports)
+
+    def find_duplicates(self, bibtex, threshold=_dedup_threshold):
+        # Returns [(uid, name, reason)] of the records that are likely the same
+        # publication as `bibtex` (a bib string or a BibTeXEntry), best first.
+        bib = bibtex if isinstance(bibtex, BibTeXEntry) else BibTeXEntry(bibtex, force_name=True)
+        tags = _proc_bib_dict(bib.tags, bib.strings)
+        return self.__find_duplicates(bib, tags.get("title", None), tags.get("year", None), threshold)
+
+    def __find_duplicates(self, bib, title, year, threshold=_dedup_threshold):
+        keys = _dedup_keys(bib, title, year)
+        if len(keys) == 0:
+            return []
+        dedup = f"{self.name}_dedup"
+        self.__cursor.execute(
+            f"SELECT d.key, b.uid, b.name, b.title, b.year FROM {dedup} AS d "
+            f"JOIN {self.name} AS b ON b.uid = d.uid "
+            f"WHERE d.key IN ({', '.join(['?' for _ in keys])})",
+            keys,
+        )
+        candidates = {}  # uid -> (name, title, year, kinds of the shared keys)
+        for key, uid, name, other_title, other_year in self.__cursor.fetchall():
+            candidates.setdefault(uid, (name, other_title, other_year, set()))[3].add(key[0])
+        count_event("db.dedup_candidates", len(candidates))
+        title = _title_key(title)
+        matches = []
+        for uid, (name, other_title, other_year, kinds) in candidates.items():
+            match = _match(kinds, title, year, _title_key(other_title), other_year, threshold)
+            if match is not None:
+                matches.append((match[0], uid, name, match[1]))
+        # same identifiers first, then by decreasing title similarity
+        matches.sort(key=lambda m: (-m[0], m[1]))
+        return [(uid, name, reason) for _, uid, name, reason in matches]
 
-    def add_refstr(self, refstr, name=None, type="article", style="IEEEtran"):
+    def duplicate_report(self, threshold=_dedup_threshold):
+        # Returns [(uid1, name1, uid2, name2, reason)] for all pairs of records
+        # in the database that are likely the same publication. Only records
+        # sharing a blocking key are compared, and each pair at most once.
+        dedup = f"{self.name}_dedup"
+        self.__cursor.execute(
+            f"SELECT key, group_concat(uid) FROM {dedup} GROUP BY key HAVING COUNT(*) > 1"
+        )
+        # blocks of DOIs and arXiv ids first, whose records always match
+        blocks = sorted(
+            ((key[0], sorted(int(uid) for uid in uids.split(","))) for key, uids in self.__cursor.fetchall()),
+            key=lambda block: block[0] not in ("d", "x"),
+        )
+        uids = sorted({uid for _, block in blocks for uid in block})
+        records = {}  # uid -> (name, title key, year)
+        for i in range(0, len(uids), 500):
+            chunk = uids[i : i + 500]
+            self.__cursor.execute(
+                f"SELECT uid, name, title, year FROM {self.name} WHERE uid IN "
+                f"({', '.join(['?' for _ in chunk])})",
+                chunk,
+            )
+            for uid, name, title, year in self.__cursor.fetchall():
+                records[uid] = (name, _title_key(title), year)
+
+        matches = {}
+        compared = set()
+        for kind, block in blocks:
+            for i, uid1 in enumerate(block):
+                name1, title1, year1 = records[uid1]
+                for uid2 in block[i + 1 :]:
+                    if (uid1, uid2) in compared:
+                        continue
+                    compared.add((uid1, uid2))
+                    name2, title2, year2 = records[uid2]
+                    match = _match(kind, title1, year1, title2, year2, threshold)
+                    if match is not None:
+                        matches[(uid1, uid2)] = (uid1, name1, uid2, name2, match[1])
+        count_event("db.dedup_candidates", len(compared))
+        return [matches[pair] for pair in sorted(matches)]
+
+    def build_dedup_index(self):
+        # (re)compute the blocking keys of all records
+        self.__cursor.execute(f"DELETE FROM {self.name}_dedup")
+        cursor = self.__conn.cursor()
+        cursor.execute(f"SELECT uid, bibstring, title, year FROM {self.name}")
+        count = 0
+        while True:
+            rows = cursor.fetchmany(500)
+            if len(rows) == 0:
+                break
+            records = []
+            for uid, bibstring, title, year in rows:
+                bib = BibTeXEntry(bibstring, lazy=True)
+                records.append((uid, bib, {"title": title, "year": year}))
+            self.__index_dedup_keys(records)
+            count += len(rows)
+        cursor.close()
+        return count
+
+    def __index_dedup_keys(self, records):
+        # records: (uid, bib, tags) of inserted or updated records
+        self.__cursor.executemany(
+            f"INSERT OR IGNORE INTO {self.name}_dedup (key, uid) VALUES (?, ?)",
+            [
+                (key, uid)
+                for uid, bib, tags in records
+                for key in _dedup_keys(bib, tags.get("title", None), tags.get("year", None))
+            ],
+        )
+
+    def build_author_index(self):
+        # (re)fill the authors of all records
+        self.__cursor.execute(f"DELETE FROM {self.name}_entry_authors")
+        self.__cursor.execute(f"DELETE FROM {self.name}_authors")
+        cursor = self.__conn.cursor()
+        cursor.execute(f"SELECT uid, bibstring FROM {self.name}")
+        count = 0
+        while True:
+            rows = cursor.fetchmany(500)
+            if len(rows) == 0:
+                break
+            self.__index_authors(
+                [(uid, BibTeXEntry(bibstring, lazy=True)) for uid, bibstring in rows]
+            )
+            count += len(rows)
+        cursor.close()
+        return count
+
+    def __index_authors(self, records):
+        # records: (uid, bib) of inserted or updated records
+        entries = [
+            (uid, position, first, last)
+            for uid, bib in records
+            for position, first, last in _iter_authors(bib)
+        ]
+        if len(entries) == 0:
+            return
+        authors = f"{self.name}_authors"
+        names = list({(last, first) for _, _, first, last in entries})
+        self.__cursor.executemany(
+            f"INSERT OR IGNORE INTO {authors} (last, first, last_key, first_key, initial) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(last, first) + _author_keys(first, last) for last, first in names],
+        )
+        aids = {}
+        for i in range(0, len(names), 250):
+            chunk = names[i : i + 250]
+            self.__cursor.execute(
+                f"SELECT last, first, aid FROM {authors} WHERE (last, first) IN "
+                f"(VALUES {', '.join(['(?, ?)' for _ in chunk])})",
+                [v for name in chunk for v in name],
+            )
+            aids.update({(last, first): aid for last, first, aid in self.__cursor.fetchall()})
+        self.__cursor.executemany(
+            f"INSERT OR REPLACE INTO {self.name}_entry_authors (uid, position, aid) VALUES (?, ?, ?)",
+            [(uid, position, aids[(last, first)]) for uid, position, first, last in entries],
+        )
+        count_event("db.authors_indexed", len(entries))
+
+    def __author_ids(self, last, first=None):
+        # aids of the authors with the last name `last` whose first name is
+        # compatible with `first` (see `_first_names_match`)
+        last_key, first_key, initial = _author_keys(first or "", last)
+        if not last_key:
+            raise ValueError(f"Invalid last name: {last!r}")
+        if initial:
+            self.__cursor.execute(
+                f"SELECT aid, first_key FROM {self.name}_authors WHERE last_key = ? AND initial = ?",
+                (last_key, initial),
+            )
+        else:
+            self.__cursor.execute(
+                f"SELECT aid, first_key FROM {self.name}_authors WHERE last_key = ?", (last_key,)
+            )
+        return [aid for aid, other in self.__cursor.fetchall() if _first_names_match(first_key, other)]
+
+    def search_by_author(self, last, first=None, position=None, columns=None, limit=None):
+        # Returns the records (in uid order) with an author whose last name is
+        # `last` (ignoring case, accents and punctuation, e.g. "Fevotte" matches
+        # "F{\'e}votte" but "Li" does not match "Lin"), and whose first name is
+        # compatible with `first` if given (e.g. "E." or "Emmanuel").
+        # position: only match the author at this position (1: first author)
+        # columns, limit: see `search_bibtex`
+        if columns is None:
+            projection = "b.*"
+        else:
+            columns = [columns] if isinstance(columns, str) else list(columns)
+            unknown = [k for k in columns if k not in _columns]
+            if len(unknown) > 0:
+                raise ValueError(f"Unsupported column(s): {', '.join(unknown)}")
+            projection = ", ".join(f"b.{k}" for k in columns)
+        aids = self.__author_ids(last, first)
+        if len(aids) == 0:
+            return []
+        query = (
+            f"SELECT {projection} FROM {self.name} AS b WHERE b.uid IN "
+            f"(SELECT uid FROM {self.name}_entry_authors WHERE aid IN "
+            f"({', '.join(['?' for _ in aids])})"
+        )
+        values = tuple(aids)
+        if position is not None:
+            query += " AND position = ?"
+            values += (int(position),)
+        query += ") ORDER BY b.uid"
+        if limit is not None:
+            query += " LIMIT ?"
+            values += (int(limit),)
+        self.__cursor.execute(query, values)
+        return self.__cursor.fetchall()
+
+    def coauthors(self, last, first=None, limit=None):
+        # Returns [(last, first, number of shared records)] of the coauthors of
+        # the author(s) matched as in `search_by_author`, most frequent first.
+        # Coauthors are grouped by folded last name and first initial, with
+        # one of their spellings.
+        aids = self.__author_ids(last, first)
+        if len(aids) == 0:
+            return []
+        marks = ", ".join(["?" for _ in aids])
+        entry_authors = f"{self.name}_entry_authors"
+        query = (
+            f"SELECT a.last, a.first, COUNT(DISTINCT e.uid) AS n FROM {entry_authors} AS e "
+            f"JOIN {self.name}_authors AS a ON a.aid = e.aid "
+            f"WHERE e.uid IN (SELECT uid FROM {entry_authors} WHERE aid IN ({marks})) "
+            f"AND e.aid NOT IN ({marks}) "
+            "GROUP BY a.last_key, a.initial ORDER BY n DESC, a.last_key, a.initial"
+        )
+        values = tuple(aids) * 2
+        if limit is not None:
+            query += " LIMIT ?"
+            values += (int(limit),)
+        self.__cursor.execute(query, values)
+        return self.__cursor.fetchall()
+
+    def add_refstr(self, refstr, name=None, type="article", style="IEEEtran", dedup=None):
         bib = BibTeXEntry.plaintext_to_bibtex(refstr, default_type=type)
-        return self.add_bibtex(bib, name=name, style=style)
+        return self.add_bibtex(bib, name=name, style=style, dedup=dedup)
 
     def update_bibtex(self, bibtex, name=None, style="IEEEtran"):
-        bib = bibtex if isinstance(bibtex, BibTeXEntry) else BibTeXEntry(bibtex, force_name=True)
+        bib = bibtex.copy() if isinstance(bibtex, BibTeXEntry) else BibTeXEntry(bibtex, force_name=True)
         if name is not None:
             bib.name = name
-        tags = self.__proc_bib_dict(bib.tags)
-        match = self.search_bibtex(name=bib.name)
-        match = [m for m in match if m[2] == bib.name]
-        if len(match) != 1:
-            return f"{len(match)} records found. Do nothing."
+        bib.expand_strings()
+        tags = _proc_bib_dict(bib.tags)
+        match = self.get_by_name(bib.name)
+        if match is None:
+            return "0 records found. Do nothing."
         # bib_existing = BibTeXEntry(match[0][3])
         # bib_existing.type = bib.type
         # bib_existing.name = bib.name
@@ -188,14 +1154,7 @@ class BibTeXDatabase:
         # tags_existing.update(tags)
 
         try:
-            self.operate(
-                "update",
-                type=bib.type,
-                name=bib.name,
-                bibstring=str(bib),
-                citestring=bib.to_plaintext(style=style),
-                **tags,
-            )
+            self.__update_bib(match[0], bib, tags, bib.to_plaintext(style=style), style)
             # self.operate(
             #     "update",
             #     type=bib_existing.type,
@@ -206,101 +1165,1003 @@ class BibTeXDatabase:
             # )
         except:
             return f"Fail to update record: '{bib.name}'"
-        return f"Updated record '{bib.name}' with UID={match[0][0]}."
+        return f"Updated record '{bib.name}' with UID={match[0]}."
+
+    def __update_bib(self, uid, bib, tags, citestring, style):
+        # replace all fields of the record, so that fields removed from the
+        # entry do not keep their old values
+        record = dict(tags, type=bib.type, name=bib.name, bibstring=str(bib), citestring=citestring)
+        keys = [k for k in _record_keys if k != "name"]
+        self.__cursor.execute(
+            f"UPDATE {self.name} SET " + ", ".join(f"{k} = ?" for k in keys) + " WHERE uid = ?",
+            tuple(record.get(k, None) for k in keys) + (uid,),
+        )
+        self.__cache_citestrings([(uid, bib, citestring)], style)
+        self.__cursor.execute(f"DELETE FROM {self.name}_dedup WHERE uid = ?", (uid,))
+        self.__index_dedup_keys([(uid, bib, tags)])
+        self.__cursor.execute(f"DELETE FROM {self.name}_entry_authors WHERE uid = ?", (uid,))
+        self.__index_authors([(uid, bib)])
 
     def remove_bibtex(self, **kwargs):
-        opt = {
-            k: str(v) if isinstance(v, (list, tuple, dict)) else v
-            for k, v in kwargs.items()
-            if v is not None and (not hasattr(v, "__len__") or len(v) > 0)
-        }
-        ret = self.search_bibtex(**opt)
+        opt = _search_filters(kwargs)
+        ret = self.search_bibtex(match="exact", columns="uid", **opt)
         if len(ret) > 0:
             self.operate("delete", **opt)
             return f"Deleted {len(ret)} records."
         else:
             return "No match found. Nothing to do."
 
-    def search_bibtex(self, **kwargs):
-        opt = {
-            k: str(v) if isinstance(v, (list, tuple, dict)) else v
-            for k, v in kwargs.items()
-            if v is not None and (not hasattr(v, "__len__") or len(v) > 0)
-        }
-        self.operate("select", **opt)
-        return self.__cursor.fetchall()
+    def search_bibtex(self, *, match="substring", columns=None, order_by="uid", after_uid=None, limit=None, **kwargs):
+        # match: "substring" (default), "prefix" or "exact"
+        # columns: names of the columns of the returned rows (default: all)
+        # order_by: column to sort the rows by, in descending order if prefixed
+        #           with "-" (e.g. "-year"); ties are sorted by uid
+        # after_uid: only return the rows after the row with this uid in that
+        #            order, i.e. the uid of the last row of the previous page
+        # limit: maximum number of rows
+        cursor = self.__select(match, _search_filters(kwargs), columns, order_by, after_uid, limit)
+        rows = cursor.fetchall()
+        cursor.close()
+        return rows
+
+    def iter_search_bibtex(
+        self, *, match="substring", columns=None, order_by="uid", after_uid=None, limit=None, batch_size=500, **kwargs
+    ):
+        # like `search_bibtex`, but returns a generator of the rows, which are
+        # fetched `batch_size` at a time
+        cursor = self.__select(match, _search_filters(kwargs), columns, order_by, after_uid, limit)
+        return _iter_rows(cursor, batch_size)
 
-    def list_database(self):
-        self.__cursor.execute(f"SELECT * FROM {self.name}")
+    def __select(self, match, filters, columns, order_by, after_uid, limit):
+        # Returns a new cursor over the selected rows (see `search_bibtex`).
+        if columns is None:
+            projection = "*"
+        else:
+            columns = [columns] if isinstance(columns, str) else list(columns)
+            unknown = [k for k in columns if k not in _columns]
+            if len(unknown) > 0:
+                raise ValueError(f"Unsupported column(s): {', '.join(unknown)}")
+            projection = ", ".join(columns)
+        unknown = [k for k in filters if k not in _columns]
+        if len(unknown) > 0:
+            raise ValueError(f"Unsupported column(s): {', '.join(unknown)}")
+        descending = order_by.startswith("-")
+        key = order_by[1:] if descending else order_by
+        if key not in _columns:
+            raise ValueError(f"Unsupported order_by: {order_by}")
+
+        conditions, values = _match_conditions(match, tuple(filters), filters)
+        if after_uid is not None:
+            condition, params = self.__after(key, descending, after_uid)
+            conditions.append(condition)
+            values += params
+        query = f"SELECT {projection} FROM {self.name}"
+        if len(conditions) > 0:
+            query += " WHERE " + " AND ".join(conditions)
+        direction = " DESC" if descending else ""
+        query += f" ORDER BY {key}{direction}"
+        if key != "uid":
+            query += f", uid{direction}"
+        if limit is not None:
+            query += " LIMIT ?"
+            values += (int(limit),)
+        cursor = self.__conn.cursor()
+        cursor.execute(query, values)
+        return cursor
+
+    def __after(self, key, descending, uid):
+        # Returns the condition and its parameters selecting the rows after the
+        # row `uid` when sorted by (key, uid).
+        op = "<" if descending else ">"
+        if key == "uid":
+            return f"uid {op} ?", (uid,)
+        self.__cursor.execute(f"SELECT {key} FROM {self.name} WHERE uid = ?", (uid,))
+        row = self.__cursor.fetchone()
+        if row is None:
+            raise ValueError(f"No record with UID={uid}.")
+        value = row[0]
+        # NULLs are sorted first in ascending order and last in descending order
+        if value is None:
+            if descending:
+                return f"({key} IS NULL AND uid < ?)", (uid,)
+            return f"({key} IS NOT NULL OR uid > ?)", (uid,)
+        condition = f"{key} {op} ? OR ({key} = ? AND uid {op} ?)"
+        if descending:
+            condition += f" OR {key} IS NULL"
+        return f"({condition})", (value, value, uid)
+
+    def search_fulltext(self, query, limit=20, raw_query=False):
+        # query: keywords matched in any order (as prefixes for the last one),
+        #        or an FTS5 query string if raw_query is True
+        # Returns the best `limit` matches ranked by BM25, with title matches
+        # weighted the most.
+        if not self.fulltext:
+            raise ValueError(
+                "Full-text index is not enabled. Use `create_fulltext_index()` first."
+            )
+        if not raw_query:
+            words = re.findall(r"\w+", query)
+            if len(words) == 0:
+                return []
+            query = " ".join('"{}"'.format(w) for w in words) + "*"
+        fts = f"{self.name}_fts"
+        self.__cursor.execute(
+            f"SELECT {self.name}.* FROM {fts} JOIN {self.name} "
+            f"ON {self.name}.uid = {fts}.rowid WHERE {fts} MATCH ? "
+            f"ORDER BY bm25({fts}, 10.0, 5.0, 2.0, 2.0, 1.0) LIMIT ?",
+            (query, limit),
+        )
         return self.__cursor.fetchall()
 
+    def get_by_name(self, name):
+        self.__cursor.execute(f"SELECT * FROM {self.name} WHERE name = ?", (name,))
+        return self.__cursor.fetchone()
+
+    def exists(self, name):
+        self.__cursor.execute(f"SELECT 1 FROM {self.name} WHERE name = ?", (name,))
+        return self.__cursor.fetchone() is not None
+
+    def list_database(self, columns=None, order_by="uid", after_uid=None, limit=None):
+        # see `search_bibtex`
+        cursor = self.__select("exact", {}, columns, order_by, after_uid, limit)
+        rows = cursor.fetchall()
+        cursor.close()
+        return rows
+
+    def iter_database(self, columns=None, order_by="uid", after_uid=None, limit=None, batch_size=500):
+        # see `iter_search_bibtex`
+        cursor = self.__select("exact", {}, columns, order_by, after_uid, limit)
+        return _iter_rows(cursor, batch_size)
+
+    def export(self, fmt, out, where=None, match="exact", style="IEEEtran", batch_size=500):
+        # Write the records (in the order of insertion) to the text stream `out`
+        # without loading them all in memory.
+        # fmt: "bib": bib strings separated by blank lines
+        #      "plaintext": one reference per line, rendered in `style` (through
+        #                   the cache of citation strings, see `get_citestrings`)
+        #      "jsonl": one JSON object per line with the fields in `_export_keys`
+        # where: {column: value} to export only the matching records (see `match`
+        #        in `search_bibtex`)
+        # Returns the number of exported records.
+        if fmt == "bib":
+            columns = "uid, bibstring"
+        elif fmt == "plaintext":
+            columns = "b.uid, b.bibstring, c.citestring"
+        elif fmt == "jsonl":
+            import json
+
+            columns = ", ".join(_export_keys)
+        else:
+            raise ValueError(f"Unsupported format: {fmt}")
+        where = {k: v for k, v in (where or {}).items() if v is not None}
+        keys = tuple(where)
+        unknown = [k for k in keys if k not in _export_keys]
+        if len(unknown) > 0:
+            raise ValueError(f"Unsupported column(s): {', '.join(unknown)}")
+        conditions, values = _match_conditions(match, keys, where)
+        if fmt == "plaintext":
+            conditions = [f"b.{c}" for c in conditions]
+            query = (
+                f"SELECT {columns} FROM {self.name} AS b LEFT JOIN {self.name}_citations AS c "
+                "ON c.uid = b.uid AND c.style = ? AND c.version = ?"
+            )
+            values = (style, style_version(style)) + values
+        else:
+            query = f"SELECT {columns} FROM {self.name}"
+        if len(conditions) > 0:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY uid" if fmt != "plaintext" else " ORDER BY b.uid"
+
+        # a separate cursor, as rendering the missing citation strings uses
+        # the shared one
+        cursor = self.__conn.cursor()
+        cursor.execute(query, values)
+        count = 0
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if len(rows) == 0:
+                break
+            if fmt == "bib":
+                lines = [bibstring + "\n\n" for _, bibstring in rows]
+            elif fmt == "plaintext":
+                misses = [(uid, bibstring) for uid, bibstring, citestring in rows if citestring is None]
+                rendered = self.__render_uncached(misses, style) if len(misses) > 0 else {}
+                lines = [
+                    (citestring if citestring is not None else rendered[uid]) + "\n"
+                    for uid, _, citestring in rows
+                    if citestring is not None or uid in rendered
+                ]
+            else:
+                lines = [
+                    json.dumps(dict(zip(_export_keys, row)), ensure_ascii=False) + "\n"
+                    for row in rows
+                ]
+            out.write("".join(lines))
+            count += len(lines)
+        cursor.close()
+        count_event("db.exported", count)
+        return count
+
     def __len__(self):
         if self.connected:
             self.__cursor.execute(f"SELECT COUNT(*) FROM {self.name}")
-            length = self.__cursor.fetchone()[0]
-        else:
-            self.reconnect()
-            self.__cursor.execute(f"SELECT COUNT(*) FROM {self.name}")
-            length = self.__cursor.fetchone()[0]
-            self.close()
-        return length
-
-    def add_fromfile(self, bibfile, skipNlines=0):
-        count_insert = 0
-        count_duplicate = 0
-        level = 0
-        found = False
-        bibstring = ""
+            return self.__cursor.fetchone()[0]
+        # count with a temporary connection instead of reopening the database
+        with closing(sqlite3.connect(self.__dbfile, timeout=self.__timeout)) as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM {self.name}").fetchone()[0]
+
+    def add_fromfile(self, bibfile, skipNlines=0, style="IEEEtran", workers=1, dedup=None):
+        # workers > 1: split all entries up front, and parse / render them in a
+        # process pool, while the records are still inserted by this process
         with open(bibfile, "r") as f:
-            for i, line in enumerate(f):
-                if i < skipNlines:
-                    continue
-                line = line.lstrip()
-                if not line or line.startswith("%"):
-                    # skip empty or commented lines
-                    continue
-                if level == 0:
-                    found = re.match(r'^\s*@\w+\{', line) is not None
-                prev = ""
-                for c in line:
-                    if c == "{" and prev != "\\":
-                        level += 1
-                    elif c == "}" and prev != "\\":
-                        level -= 1
-                    prev = c
-                if found:
-                    bibstring = bibstring + line
-                    if level == 0:
-                        found = False
-                        try:
-                            ret = self.add_bibtex(bibstring)
-                        except:
-                            print(bibstring)
-                            raise
-                        if ret.startswith("Inserted with UID="):
-                            count_insert += 1
-                        else:
-                            count_duplicate += 1
-                        bibstring = ""
+            for i in range(skipNlines):
+                f.readline()
+            args = ((bibstring, strings, style) for bibstring, strings in _iter_bibstrings(f))
+            if workers > 1:
+                import multiprocessing
+
+                args = list(args)
+                with multiprocessing.Pool(
+                    workers, initializer=_init_worker, initargs=(predefined_string,)
+                ) as pool:
+                    results = self.__add_prepared(
+                        pool.imap(_prepare_bibtex, args, chunksize=64), style=style, dedup=dedup
+                    )
+            else:
+                results = self.__add_prepared(map(_prepare_bibtex, args), style=style, dedup=dedup)
+        count_insert = sum(ret.startswith("Inserted with UID=") for ret in results)
+        count_duplicate = len(results) - count_insert
         if count_insert == 0:
             return f"No new records found in {bibfile}. Nothing to do.\n{count_duplicate} duplicate records already exist."
         else:
             return f"Inserted {count_insert} new record(s).\n{count_duplicate} duplicate records already exist."
 
+    def add_many(self, entries, batch_size=500, style="IEEEtran", dedup=None):
+        # entries: bib strings or BibTeXEntry objects (which are left as they
+        # are: copies are stored, renamed if needed)
+        # Returns one message for each entry, the same as add_bibtex.
+        def prepare(bibtex):
+            if isinstance(bibtex, BibTeXEntry):
+                bibtex = bibtex.copy()
+                bibtex.expand_strings()
+                return bibtex, _proc_bib_dict(bibtex.tags), bibtex.to_plaintext(style=style)
+            return _prepare_bibtex((bibtex, None, style))
+
+        return self.__add_prepared(
+            map(prepare, entries), batch_size=batch_size, style=style, dedup=dedup
+        )
+
+    def __add_prepared(self, prepared, batch_size=500, style=None, dedup=None):
+        # insert all records in a single transaction
+        with self.__conn:
+            if dedup is not None:
+                # one at a time, so that each entry is also compared with the
+                # entries inserted before it
+                return [
+                    self.__add_deduped(*item, style=style, dedup=dedup) for item in prepared
+                ]
+            return self.__insert_prepared(prepared, batch_size=batch_size, style=style)
+
+    def __insert_prepared(self, prepared, batch_size=500, style=None):
+        # insert the records `batch_size` rows at a time
+        results = []
+        batch = []
+        for item in prepared:
+            batch.append(item)
+            if len(batch) == batch_size:
+                results.extend(self.__insert_batch(batch, style=style))
+                batch = []
+        if len(batch) > 0:
+            results.extend(self.__insert_batch(batch, style=style))
+        return results
+
+    def __insert_batch(self, batch, style=None):
+        existing = {}
+        for i in range(0, len(batch), 500):
+            names = [bib.name for bib, _, _ in batch[i : i + 500]]
+            self.__cursor.execute(
+                f"SELECT name, bibstring FROM {self.name} WHERE name IN "
+                f"({', '.join(['?' for _ in names])})",
+                names,
+            )
+            existing.update(self.__cursor.fetchall())
+        pending = {}
+        rows = []
+        for bib, tags, citestring in batch:
+            if bib.name in pending or bib.name in existing:
+                if bib.name in pending:
+                    bib_existing = pending[bib.name]
+                else:
+                    bib_existing = BibTeXEntry(existing[bib.name])
+                if (
+                    bib.tags.get("journal", "") == bib_existing.tags.get("journal", "")
+                    and bib.tags.get("booktitle", "") == bib_existing.tags.get("booktitle", "")
+                ):
+                    continue
+                bib.name = self.__free_name(bib.name, taken=pending)
+                count_event("db.renamed")
+            pending[bib.name] = bib
+            record = dict(tags, type=bib.type, name=bib.name, bibstring=str(bib), citestring=citestring)
+            rows.append(tuple(record.get(k, None) for k in _record_keys))
+
+        self.__cursor.executemany(
+            f"INSERT INTO {self.name} ({', '.join(_record_keys)}) VALUES "
+            f"({', '.join(['?' for _ in _record_keys])}) ON CONFLICT(name) DO NOTHING",
+            rows,
+        )
+        # rows skipped by "ON CONFLICT" (e.g. inserted by another connection
+        # in the meantime) are reported as existing records
+        uids = {}
+        for i in range(0, len(rows), 500):
+            names = [row[1] for row in rows[i : i + 500]]
+            self.__cursor.execute(
+                f"SELECT name, uid, bibstring FROM {self.name} WHERE name IN "
+                f"({', '.join(['?' for _ in names])})",
+                names,
+            )
+            uids.update({name: (uid, bibstring) for name, uid, bibstring in self.__cursor.fetchall()})
+
+        results = []
+        citestrings = []
+        records = []
+        duplicates = 0
+        for bib, tags, citestring in batch:
+            uid, bibstring = uids.get(bib.name, (None, None))
+            if bib.name in pending and pending[bib.name] is bib and bibstring == str(bib):
+                results.append(f"Inserted with UID={uid}.")
+                citestrings.append((uid, bib, citestring))
+                records.append((uid, bib, tags))
+            else:
+                results.append("Record already exists. Nothing to do.")
+                duplicates += 1
+        if style is not None:
+            self.__cache_citestrings(citestrings, style)
+        self.__index_dedup_keys(records)
+        self.__index_authors([(uid, bib) for uid, bib, _ in records])
+        count_event("db.inserted", len(batch) - duplicates)
+        count_event("db.duplicates", duplicates)
+        return results
+
+    def sync_fromfile(self, bibfile, delete=False, style="IEEEtran", batch_size=500):
+        # Make the records synced from `bibfile` match its current entries.
+        # Only the entries whose content hash changed since the last sync are
+        # parsed: entries with a known name are updated, the others are
+        # inserted as in `add_fromfile` (renamed or skipped if the name is
+        # taken by another record). Records of entries removed from the file
+        # are deleted if `delete` is True, and otherwise no longer tracked.
+        # Everything is applied in a single transaction.
+        with open(bibfile, "r") as f:
+            entries = [
+                block
+                for block in _iter_hashed_blocks(iter_entries(f, raw=True), style)
+                if block[1] is not None
+            ]
+        return self.__apply_sync(bibfile, entries, delete, style, batch_size)
+
+    def watch(self, bibfiles, interval=0.2, delete=True, style="IEEEtran", batch_size=500):
+        # Keep the database synced with `bibfiles` until interrupted: the files
+        # are polled every `interval` seconds, and the changes of each modified
+        # file are applied in a single transaction as in `sync_fromfile`
+        # (including deletions if `delete` is True). Only the modified region
+        # of a file is scanned again, using the entry offsets from the previous
+        # scan, and only the entries in that region are compared with the
+        # database.
+        watched = [_WatchedFile(path, style) for path in bibfiles]
+        while True:
+            for w in watched:
+                try:
+                    if not w.poll():
+                        continue
+                    if w.diff is None:
+                        ret = self.__apply_sync(w.path, w.entries(), delete, style, batch_size)
+                    else:
+                        ret = self.__apply_diff(w.path, w.diff, delete, style, batch_size)
+                    print(ret)
+                    w.error = None
+                except Exception as e:
+                    # e.g. the file is missing or being written
+                    if repr(e) != w.error:
+                        print(f"Warning: failed to sync {w.path}: {e!r}")
+                        w.error = repr(e)
+                    # the database may not match the last scan
+                    w.reset()
+            time.sleep(interval)
+
+    def __apply_sync(self, bibfile, entries, delete, style, batch_size):
+        # entries: (span, hash, strings) of all entries in `bibfile`
+        source = os.path.abspath(bibfile)
+        sources = f"{self.name}_sources"
+        self.__cursor.execute(
+            f"SELECT s.hash, s.uid, s.start, s.end, b.name FROM {sources} AS s "
+            f"JOIN {self.name} AS b ON b.uid = s.uid WHERE s.source = ?",
+            (source,),
+        )
+        known = {}  # hash -> (uid, start, end)
+        owned = {}  # name -> uid
+        for digest, uid, start, end, name in self.__cursor.fetchall():
+            known[digest] = (uid, start, end)
+            owned[name] = uid
+
+        seen = set()  # uids of the entries still in the file
+        kept = set()  # hashes of the unchanged entries
+        moved = []  # (start, end, source, hash) of the unchanged entries that moved
+        changed = []  # (span, hash, strings) of the new or modified entries
+        for span, digest, strings in entries:
+            if digest in known:
+                uid, start, end = known[digest]
+                seen.add(uid)
+                if digest not in kept and (start, end) != (span.start, span.end):
+                    moved.append((span.start, span.end, source, digest))
+                kept.add(digest)
+            else:
+                changed.append((span, digest, strings))
+        count_event("db.sync_unchanged", len(entries) - len(changed))
+
+        with self.__conn:
+            self.__cursor.executemany(
+                f"DELETE FROM {sources} WHERE source = ? AND hash = ?",
+                [(source, digest) for digest in known if digest not in kept],
+            )
+            self.__cursor.executemany(
+                f"UPDATE {sources} SET start = ?, end = ? WHERE source = ? AND hash = ?",
+                moved,
+            )
+            results, count_update = self.__sync_changed(
+                source, changed, owned, seen, style, batch_size
+            )
+            vanished = [uid for uid in owned.values() if uid not in seen]
+            self.__remove_vanished(source, vanished, delete)
+        return _sync_message(
+            bibfile, results, count_update, len(vanished), delete, len(entries) - len(changed)
+        )
+
+    def __apply_diff(self, bibfile, diff, delete, style, batch_size):
+        # diff: `_FileDiff` of `bibfile` since the last sync or diff
+        source = os.path.abspath(bibfile)
+        sources = f"{self.name}_sources"
+        # the added entries that are already known (moved within the region,
+        # or duplicates of other entries)
+        known = {}  # hash -> uid
+        added = [digest for _, digest, _ in diff.added]
+        for i in range(0, len(added), 500):
+            chunk = added[i : i + 500]
+            self.__cursor.execute(
+                f"SELECT hash, uid FROM {sources} WHERE source = ? AND hash IN "
+                f"({', '.join(['?' for _ in chunk])})",
+                (source, *chunk),
+            )
+            known.update(self.__cursor.fetchall())
+        changed = [block for block in diff.added if block[1] not in known]
+        removed = list(diff.removed)
+        count_event("db.sync_unchanged", diff.count - len(changed))
+
+        with self.__conn:
+            uids = set()
+            for i in range(0, len(removed), 500):
+                chunk = removed[i : i + 500]
+                condition = f"source = ? AND hash IN ({', '.join(['?' for _ in chunk])})"
+                self.__cursor.execute(
+                    f"SELECT uid FROM {sources} WHERE {condition}", (source, *chunk)
+                )
+                uids.update(uid for uid, in self.__cursor.fetchall())
+                self.__cursor.execute(f"DELETE FROM {sources} WHERE {condition}", (source, *chunk))
+            if diff.delta != 0:
+                self.__cursor.execute(
+                    f"UPDATE {sources} SET start = start + ?, end = end + ? "
+                    "WHERE source = ? AND start >= ?",
+                    (diff.delta, diff.delta, source, diff.offset),
+                )
+            # the only records that changed entries can update are those of
+            # the removed entries that no other entry of the file refers to
+            uids = list(uids)
+            owned = {}  # name -> uid
+            for i in range(0, len(uids), 500):
+                chunk = uids[i : i + 500]
+                self.__cursor.execute(
+                    f"SELECT name, uid FROM {self.name} WHERE uid IN "
+                    f"({', '.join(['?' for _ in chunk])}) AND uid NOT IN "
+                    f"(SELECT uid FROM {sources} WHERE source = ?)",
+                    (*chunk, source),
+                )
+                owned.update(self.__cursor.fetchall())
+            seen = set()
+            results, count_update = self.__sync_changed(
+                source, changed, owned, seen, style, batch_size
+            )
+            # the shift only holds for the entries that stayed after the
+            # region: the offsets of the entries removed from or added to it
+            # are recomputed from the first occurrence in the whole file, also
+            # for the rows written above from the region alone
+            self.__cursor.executemany(
+                f"UPDATE {sources} SET start = ?, end = ? WHERE source = ? AND hash = ?",
+                [(span.start, span.end, source, digest) for span, digest in diff.first],
+            )
+            vanished = [uid for uid in owned.values() if uid not in seen]
+            self.__remove_vanished(source, vanished, delete)
+        return _sync_message(
+            bibfile, results, count_update, len(vanished), delete, diff.count - len(changed)
+        )
+
+    def __sync_changed(self, source, changed, owned, seen, style, batch_size):
+        # Update or insert the records of the new or modified entries of
+        # `source`, and track them in the sources table.
+        # changed: (span, hash, strings) of the entries
+        # owned: {name: uid} of the records that the entries can update
+        # seen: uids of the records that are still referred to by the file,
+        #       which are not updated (the synced records are added)
+        # Returns the results of the insertions and the number of updates.
+        sources = f"{self.name}_sources"
+        count_update = 0
+        rows = {}  # hash -> (source, hash, uid, start, end) of the first occurrence
+        inserts = []
+        for span, digest, strings in changed:
+            bib, tags, citestring = _prepare_bibtex((span.string, strings, style))
+            uid = owned.get(bib.name, None)
+            if uid is not None and uid not in seen:
+                self.__update_bib(uid, bib, tags, citestring, style)
+                seen.add(uid)
+                rows.setdefault(digest, (source, digest, uid, span.start, span.end))
+                count_update += 1
+            else:
+                inserts.append((span, digest, (bib, tags, citestring)))
+        results = self.__insert_prepared(
+            (item for _, _, item in inserts), batch_size=batch_size, style=style
+        )
+        count_event("db.sync_updated", count_update)
+
+        # track the inserted records, and the existing records that the
+        # other entries duplicate if those are synced as well (updated above,
+        # or tracked from a file): records added otherwise (e.g. by add_bibtex)
+        # are never taken over, so that removing the duplicate from the file
+        # does not delete them
+        synced = set(seen)
+        for i in range(0, len(inserts), 500):
+            chunk = list(zip(inserts[i : i + 500], results[i : i + 500]))
+            self.__cursor.execute(
+                f"SELECT name, uid FROM {self.name} WHERE name IN "
+                f"({', '.join(['?' for _ in chunk])})",
+                [item[0].name for (_, _, item), _ in chunk],
+            )
+            uids = dict(self.__cursor.fetchall())
+            synced.update(
+                uids[item[0].name]
+                for (_, _, item), ret in chunk
+                if ret.startswith("Inserted with UID=")
+            )
+            duplicates = [uids[item[0].name] for (_, _, item), _ in chunk]
+            self.__cursor.execute(
+                f"SELECT DISTINCT uid FROM {sources} WHERE uid IN "
+                f"({', '.join(['?' for _ in duplicates])})",
+                duplicates,
+            )
+            tracked = {uid for uid, in self.__cursor.fetchall()}
+            for (span, digest, (bib, _, _)), _ in chunk:
+                uid = uids[bib.name]
+                if uid not in synced and uid not in tracked:
+                    count_event("db.sync_untracked")
+                    continue
+                seen.add(uid)
+                rows.setdefault(digest, (source, digest, uid, span.start, span.end))
+        self.__cursor.executemany(
+            f"INSERT OR REPLACE INTO {sources} (source, hash, uid, start, end) "
+            "VALUES (?, ?, ?, ?, ?)",
+            list(rows.values()),
+        )
+        return results, count_update
+
+    def __remove_vanished(self, source, vanished, delete):
+        # vanished: uids of the records whose entries were removed from `source`
+        # Records that are also synced from another file are kept.
+        sources = f"{self.name}_sources"
+        if delete:
+            for i in range(0, len(vanished), 500):
+                chunk = vanished[i : i + 500]
+                self.__cursor.execute(
+                    f"DELETE FROM {self.name} WHERE uid IN "
+                    f"({', '.join(['?' for _ in chunk])}) AND uid NOT IN "
+                    f"(SELECT uid FROM {sources} WHERE source != ?)",
+                    (*chunk, source),
+                )
+        count_event("db.sync_vanished", len(vanished))
+
+    def __cache_citestrings(self, citestrings, style):
+        # citestrings: (uid, bib, citestring) rendered with `style`
+        # The strings of entries that refer to undefined macros are not cached,
+        # as "UNDEFINED" would be returned even after the macro is defined.
+        version = style_version(style)
+        self.__cursor.executemany(
+            f"INSERT OR REPLACE INTO {self.name}_citations "
+            "(uid, style, version, citestring) VALUES (?, ?, ?, ?)",
+            [
+                (uid, style, version, citestring)
+                for uid, bib, citestring in citestrings
+                if "UNDEFINED" not in citestring or len(bib.undefined_strings()) == 0
+            ],
+        )
+
+    def __render_uncached(self, rows, style):
+        # rows: (uid, bibstring) pairs; entries that fail to render are skipped
+        # with a warning instead of aborting the whole batch
+        bibs = [BibTeXEntry(bibstring, lazy=True) for _, bibstring in rows]
+        try:
+            citestrings = render_many(bibs, style)
+        except Exception:
+            citestrings = []
+            for uid, bibstring in rows:
+                try:
+                    citestrings.append(BibTeXEntry(bibstring).to_plaintext(style=style))
+                except Exception as e:
+                    print(f"Warning: failed to render UID={uid} in style '{style}': {e!r}")
+                    citestrings.append(None)
+        rendered = [
+            (uid, bib, citestring)
+            for (uid, _), bib, citestring in zip(rows, bibs, citestrings)
+            if citestring is not None
+        ]
+        self.__cache_citestrings(rendered, style)
+        count_event("db.citations_rendered", len(rendered))
+        return {uid: citestring for uid, _, citestring in rendered}
+
+    def get_citestrings(self, names, style="IEEEtran"):
+        # names: entry names
+        # Returns {name: citation string in `style`} for the names in the
+        # database. Strings missing from the cache are rendered and cached,
+        # and committed right away unless a transaction is already open, so
+        # that a lookup does not hold the write lock of the database.
+        version = style_version(style)
+        autocommit = not self.__conn.in_transaction
+        names = list(names)
+        ret = {}
+        for i in range(0, len(names), 500):
+            chunk = names[i : i + 500]
+            self.__cursor.execute(
+                f"SELECT b.name, b.uid, b.bibstring, c.citestring "
+                f"FROM {self.name} AS b LEFT JOIN {self.name}_citations AS c "
+                "ON c.uid = b.uid AND c.style = ? AND c.version = ? "
+                f"WHERE b.name IN ({', '.join(['?' for _ in chunk])})",
+                (style, version, *chunk),
+            )
+            rows = self.__cursor.fetchall()
+            misses = []
+            uid_to_name = {}
+            for name, uid, bibstring, citestring in rows:
+                if citestring is None:
+                    misses.append((uid, bibstring))
+                    uid_to_name[uid] = name
+                else:
+                    ret[name] = citestring
+            count_event("db.citation_hits", len(rows) - len(misses))
+            if len(misses) > 0:
+                for uid, citestring in self.__render_uncached(misses, style).items():
+                    ret[uid_to_name[uid]] = citestring
+        if autocommit and self.__conn.in_transaction:
+            self.__conn.commit()
+        return ret
+
+    def get_citestring(self, name, style="IEEEtran"):
+        return self.get_citestrings([name], style=style).get(name, None)
+
+    def render_citestrings(self, style="IEEEtran", batch_size=500):
+        # fill the cache of `style` for all records, and drop the strings
+        # rendered by other versions of the style
+        # Returns the number of newly rendered strings.
+        version = style_version(style)
+        cache = f"{self.name}_citations"
+        self.__cursor.execute(
+            f"DELETE FROM {cache} WHERE style = ? AND version != ?", (style, version)
+        )
+        self.__cursor.execute(
+            f"SELECT uid FROM {self.name} WHERE uid NOT IN "
+            f"(SELECT uid FROM {cache} WHERE style = ? AND version = ?)",
+            (style, version),
+        )
+        uids = [uid for uid, in self.__cursor.fetchall()]
+        count = 0
+        for i in range(0, len(uids), batch_size):
+            chunk = uids[i : i + batch_size]
+            self.__cursor.execute(
+                f"SELECT uid, bibstring FROM {self.name} WHERE uid IN "
+                f"({', '.join(['?' for _ in chunk])})",
+                chunk,
+            )
+            count += len(self.__render_uncached(self.__cursor.fetchall(), style))
+        return count
+
     def clear(self):
         self.__cursor.execute(f"DELETE FROM {self.name}")
+        self.__cursor.execute(f"DELETE FROM {self.name}_authors")
+
+
+# methods of BibTeXDatabase served by `serve`: name -> whether it writes
+_served_methods = {
+    "search_bibtex": False,
+    "search_fulltext": False,
+    "get_by_name": False,
+    "exists": False,
+    "list_database": False,
+    "__len__": False,
+    "get_citestrings": False,
+    "get_citestring": False,
+    "find_duplicates": False,
+    "search_by_author": False,
+    "coauthors": False,
+    "duplicate_report": False,
+    "add_bibtex": True,
+    "add_refstr": True,
+    "update_bibtex": True,
+    "remove_bibtex": True,
+    "add_fromfile": True,
+    "sync_fromfile": True,
+    "render_citestrings": True,
+}
+# maximum length of a request line in bytes
+_max_request_size = 1 << 24
+
+
+def serve(db, path="mybib.sock", readers=4):
+    """Serve the methods of `db` on a Unix domain socket until interrupted.
+
+    The protocol is newline-delimited JSON, one object per line in each
+    direction, e.g.
+        -> {"id": 1, "method": "search_bibtex", "args": [], "kwargs": {"title": "speech"}}
+        <- {"id": 1, "result": [[1, "article", ...]]}
+        -> {"id": 2, "method": "get_by_name", "args": ["Unknown"]}
+        <- {"id": 2, "result": null}
+    and {"id": ..., "error": "ValueError: ..."} if the call fails. Only the
+    methods in `_served_methods` are available, and every request is
+    committed (or rolled back on errors) before it is answered.
+
+    Requests of a connection are answered in order. If `db` was opened with
+    `concurrent=True`, read requests run in a pool of `readers` threads and
+    write requests in a single thread, so that a long import does not block
+    the lookups; otherwise all requests run one at a time.
+
+    Args:
+        db (BibTeXDatabase): database to serve
+        path (str): path of the socket, which is only accessible to the
+            current user and removed on exit
+        readers (int): number of threads for read requests
+    """
+    import asyncio
+
+    # the threads serving the requests only see committed changes, e.g. the
+    # tables created by `db`
+    db.commit()
+    try:
+        asyncio.run(_serve(db, path, readers))
+    except asyncio.CancelledError:
+        # SIGTERM
+        pass
+
+
+async def _serve(db, path, readers):
+    import asyncio
+    import json
+    import signal
+    import socket
+    from concurrent.futures import ThreadPoolExecutor
+
+    if os.path.exists(path):
+        with closing(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)) as sock:
+            try:
+                sock.connect(path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # left by a server that did not exit cleanly
+                os.remove(path)
+            else:
+                raise ValueError(f"Another server is running on '{path}'.")
+    if db.concurrent:
+        read_pool = ThreadPoolExecutor(readers, thread_name_prefix="bibtex-read")
+        write_pool = ThreadPoolExecutor(1, thread_name_prefix="bibtex-write")
+    else:
+        # the connection can only be used by this thread
+        read_pool = write_pool = None
+    loop = asyncio.get_running_loop()
+
+    def execute(method, args, kwargs):
+        # reads may write as well (e.g. `get_citestrings` caches the strings
+        # it renders), so any transaction left open is ended before the
+        # response, not to block the other writers
+        writes = _served_methods[method]
+        try:
+            result = getattr(db, method)(*args, **kwargs)
+        except BaseException:
+            if writes or db.in_transaction:
+                db.rollback()
+            raise
+        if writes or db.in_transaction:
+            db.commit()
+        return result
+
+    async def respond(line):
+        uid = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("A request must be a JSON object.")
+            uid = request.get("id", None)
+            method = request.get("method", None)
+            if method not in _served_methods:
+                raise ValueError(f"Unsupported method: {method}")
+            args = request.get("args", [])
+            kwargs = request.get("kwargs", {})
+            pool = write_pool if _served_methods[method] else read_pool
+            if pool is None:
+                result = execute(method, args, kwargs)
+            else:
+                result = await loop.run_in_executor(pool, execute, method, args, kwargs)
+        except Exception as e:
+            count_event("serve.errors")
+            return {"id": uid, "error": f"{type(e).__name__}: {e}"}
+        count_event("serve.requests")
+        return {"id": uid, "result": result}
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # longer than `_max_request_size`
+                    response = {"id": None, "error": "ValueError: Request too large."}
+                    writer.write(json.dumps(response).encode() + b"\n")
+                    break
+                if len(line) == 0:
+                    break
+                response = await respond(line)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_unix_server(handle, path, limit=_max_request_size)
+    os.chmod(path, 0o600)
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    print(f"Serving '{db.name}' on {path}", file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        loop.remove_signal_handler(signal.SIGTERM)
+        for pool in {read_pool, write_pool} - {None}:
+            pool.shutdown()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class BibTeXClient:
+    """Client of `serve`.
+
+    e.g.
+        client = BibTeXClient("mybib.sock")
+        rows = client.call("search_bibtex", title="speech")
+        print(client.call("get_citestring", "Performance-Vincent2006", style="APA"))
+        client.close()
+    """
+
+    def __init__(self, path="mybib.sock"):
+        import socket
+
+        self.__sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__sock.connect(path)
+        self.__file = self.__sock.makefile("rwb")
+        self.__id = 0
+
+    def call(self, method, *args, **kwargs):
+        """Call `method` of the served database.
+
+        Returns:
+            result: return value of the method, with the database rows as
+                tuples (like in BibTeXDatabase)
+        Raises:
+            ValueError: if the call failed in the server
+        """
+        import json
+
+        self.__id += 1
+        request = {"id": self.__id, "method": method, "args": args, "kwargs": kwargs}
+        self.__file.write(json.dumps(request).encode() + b"\n")
+        self.__file.flush()
+        line = self.__file.readline()
+        if len(line) == 0:
+            raise ValueError("Connection closed by the server.")
+        response = json.loads(line)
+        if "error" in response:
+            raise ValueError(response["error"])
+        result = response["result"]
+        # JSON has no tuples
+        if method == "get_by_name" and result is not None:
+            return tuple(result)
+        elif isinstance(result, list):
+            return [tuple(r) if isinstance(r, list) else r for r in result]
+        return result
+
+    def close(self):
+        self.__file.close()
+        self.__sock.close()
+
+
+_module = sys.modules[__name__]
+add_profile_phase(_module, "_prepare_bibtex", "db.prepare")
+add_profile_phase(_module, "_proc_bib_dict", "db.proc_bib_dict")
+add_profile_phase(_module, "get_raw_text", "get_raw_text")
+add_profile_phase(BibTeXDatabase, "_BibTeXDatabase__insert_bib", "db.insert")
+add_profile_phase(BibTeXDatabase, "_BibTeXDatabase__insert_batch", "db.insert_batch")
+add_profile_phase(BibTeXDatabase, "commit", "db.commit")
+add_profile_phase(BibTeXDatabase, "_BibTeXDatabase__render_uncached", "db.render_citations")
+add_profile_phase(BibTeXDatabase, "_BibTeXDatabase__find_duplicates", "db.dedup")
+add_profile_phase(BibTeXDatabase, "_BibTeXDatabase__apply_sync", "db.sync")
+add_profile_phase(BibTeXDatabase, "_BibTeXDatabase__apply_diff", "db.sync_diff")
+add_profile_phase(_WatchedFile, "poll", "watch.scan")
+del _module
 
 def get_parser():
+    import argparse
+
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--add-bibtex", type=str, default=None, help="parse and insert a bibtex entry"
     )
+    parser.add_argument(
+        "--add-fromfile",
+        type=str,
+        default=None,
+        help="parse and insert all bibtex entries in a .bib file",
+    )
+    parser.add_argument(
+        "--sync",
+        type=str,
+        default=None,
+        help="insert or update the entries of a .bib file that changed since the "
+        "last sync",
+    )
+    parser.add_argument(
+        "--delete-missing",
+        action="store_true",
+        help="with --sync, delete the records of entries removed from the file",
+    )
+    parser.add_argument(
+        "--watch",
+        type=str,
+        nargs="+",
+        default=None,
+        help="keep the database synced with the .bib files (including deletions) "
+        "until interrupted",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=0.2,
+        help="seconds between two checks of the files in --watch",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of processes for parsing the entries in --add-fromfile",
+    )
     parser.add_argument(
         "--add-refstr",
         type=str,
         default=None,
         help="parse and insert a plain reference string",
     )
+    parser.add_argument(
+        "--dedup",
+        type=str,
+        default=None,
+        choices=("report", "merge"),
+        help="for --add-bibtex, --add-fromfile and --add-refstr: report the likely "
+        "duplicates of new entries (e.g. the same paper under another key), or merge "
+        "the entries into them",
+    )
+    parser.add_argument(
+        "--duplicates",
+        action="store_true",
+        help="list the pairs of entries in the database that are likely duplicates",
+    )
     parser.add_argument(
         "--remove",
         type=str,
@@ -311,29 +2172,147 @@ def get_parser():
         "--search",
         type=str,
         default=None,
-        help="search for a bibtex containing the specified keyword(s) from the database",
+        help="search for a bibtex containing the specified keyword(s) in any field from the database",
+    )
+    parser.add_argument(
+        "--author",
+        type=str,
+        default=None,
+        help="search for bibtex entries by an author, given as 'Last' or 'Last, First' "
+        "(ignoring case and accents)",
+    )
+    parser.add_argument(
+        "--coauthors",
+        type=str,
+        default=None,
+        help="list the coauthors of an author given as in --author, with the number of "
+        "shared entries",
+    )
+    parser.add_argument(
+        "--search-fulltext",
+        type=str,
+        default=None,
+        help="search for bibtex entries matching the keyword(s) in any order, "
+        "ranked by relevance (builds the full-text index on first use)",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=20,
+        help="maximum number of results for --search-fulltext",
     )
     parser.add_argument(
         "--list",
         action="store_true",
         help="list all bibtex entries in the current database",
     )
+    parser.add_argument(
+        "--cite",
+        type=str,
+        nargs="+",
+        default=None,
+        help="print the citation strings of the bibtex entries with the specified keys",
+    )
+    parser.add_argument(
+        "--render-all",
+        action="store_true",
+        help="render and cache the citation strings of all entries in --style",
+    )
+    parser.add_argument(
+        "--export",
+        type=str,
+        default=None,
+        help="write all entries to a file (or '-' for stdout) in --format",
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        default="bib",
+        choices=("bib", "plaintext", "jsonl"),
+        help="format of --export: bib strings, references in --style, or JSON Lines",
+    )
+    parser.add_argument(
+        "--style",
+        type=str,
+        default="IEEEtran",
+        help="citation style for --cite, --render-all and --export",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="keep the database open and answer requests on --socket until "
+        "interrupted (see `serve`)",
+    )
+    parser.add_argument(
+        "--client",
+        action="store_true",
+        help="send the request to the server on --socket instead of opening the "
+        "database",
+    )
+    parser.add_argument(
+        "--socket",
+        type=str,
+        default="mybib.sock",
+        help="Unix domain socket for --serve and --client",
+    )
+    parser.add_argument(
+        "--concurrent",
+        action="store_true",
+        help="switch the database to WAL mode, so that other processes can read it "
+        "while this one writes",
+    )
+    parser.add_argument(
+        "--profile",
+        "--stats",
+        dest="profile",
+        action="store_true",
+        help="print the time spent in each phase and the insert/conflict counters "
+        "to stderr",
+    )
     return parser
 
 
 if __name__ == "__main__":
-    db = BibTeXDatabase()
-
     parser = get_parser()
     args = parser.parse_args()
+    if args.profile:
+        enable_profiling()
+
+    if args.client:
+        if args.watch is not None or args.serve or args.export is not None:
+            parser.error("--watch, --serve and --export cannot be used with --client")
+        db = BibTeXClient(args.socket)
+        call = db.call
+    else:
+        # full-text search is the main query of the clients of --serve
+        db = BibTeXDatabase(
+            fulltext=args.search_fulltext is not None or args.serve,
+            concurrent=args.concurrent or args.serve,
+        )
+
+        def call(method, *args, **kwargs):
+            return getattr(db, method)(*args, **kwargs)
+
     check_args_num = [
         args.add_bibtex is not None,
+        args.add_fromfile is not None,
         args.add_refstr is not None,
         args.remove is not None,
         args.search is not None,
+        args.search_fulltext is not None,
         args.list,
+        args.cite is not None,
+        args.render_all,
+        args.sync is not None,
+        args.watch is not None,
+        args.duplicates,
+        args.serve,
+        args.export is not None,
+        args.author is not None,
+        args.coauthors is not None,
     ]
 
+    ret = None
     do_commit = False
     if sum(check_args_num) > 1:
         print(
@@ -341,17 +2320,76 @@ if __name__ == "__main__":
             % parser.format_help()
         )
     elif check_args_num[0]:
-        ret = db.add_bibtex(args.add_bibtex)
+        ret = call("add_bibtex", args.add_bibtex, dedup=args.dedup)
         do_commit = True
     elif check_args_num[1]:
-        ret = db.add_refstr(args.add_refstr)
+        ret = call(
+            "add_fromfile",
+            os.path.abspath(args.add_fromfile),
+            workers=args.jobs,
+            dedup=args.dedup,
+        )
         do_commit = True
     elif check_args_num[2]:
-        ret = db.remove_bibtex(args.remove)
+        ret = call("add_refstr", args.add_refstr, dedup=args.dedup)
         do_commit = True
     elif check_args_num[3]:
-        ret = db.search_bibtex(args.search)
+        ret = call("remove_bibtex", name=args.remove)
+        do_commit = True
     elif check_args_num[4]:
-        ret = db.list_database()
+        ret = call("search_bibtex", bibstring=args.search)
+    elif check_args_num[5]:
+        ret = call("search_fulltext", args.search_fulltext, limit=args.limit)
+        do_commit = True
+    elif check_args_num[6]:
+        ret = call("list_database")
+    elif check_args_num[7]:
+        citestrings = call("get_citestrings", args.cite, style=args.style)
+        ret = "\n".join(
+            citestrings.get(name, f"'{name}' not found.") for name in args.cite
+        )
+        do_commit = True
+    elif check_args_num[8]:
+        ret = f"Rendered {call('render_citestrings', style=args.style)} citation string(s)."
+        do_commit = True
+    elif check_args_num[9]:
+        ret = call("sync_fromfile", os.path.abspath(args.sync), delete=args.delete_missing)
+        do_commit = True
+    elif check_args_num[10]:
+        try:
+            db.watch(args.watch, interval=args.interval)
+        except KeyboardInterrupt:
+            pass
+        do_commit = True
+    elif check_args_num[11]:
+        ret = call("duplicate_report")
+    elif check_args_num[12]:
+        try:
+            serve(db, args.socket)
+        except KeyboardInterrupt:
+            pass
+    elif check_args_num[13]:
+        if args.export == "-":
+            count = db.export(args.format, sys.stdout, style=args.style)
+        else:
+            with open(args.export, "w", encoding="utf-8") as f:
+                count = db.export(args.format, f, style=args.style)
+        print(f"Exported {count} entries.", file=sys.stderr)
+        do_commit = True
+    elif check_args_num[14]:
+        ret = call("search_by_author", *[s.strip() for s in args.author.split(",", 1)])
+    elif check_args_num[15]:
+        ret = call("coauthors", *[s.strip() for s in args.coauthors.split(",", 1)])
 
-    db.close(do_commit=do_commit)
+    if args.client:
+        # committed by the server
+        db.close()
+    else:
+        db.close(do_commit=do_commit)
+    if isinstance(ret, list):
+        for row in ret:
+            print(row)
+    elif ret is not None:
+        print(ret)
+    if args.profile:
+        print(format_profile(), file=sys.stderr)